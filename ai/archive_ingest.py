@@ -0,0 +1,162 @@
+"""
+Streaming readers for pre-packed image batches.
+
+The request body is fed chunk by chunk into a QueueReader, a blocking file-like
+object read from a worker thread. The bounded queue provides backpressure, so
+memory use does not grow with the size of the upload. The event loop feeds it
+with feed_async(), which waits for queue space without occupying a thread, and
+the reader gives up after ARCHIVE_READ_TIMEOUT seconds without data. Supported
+formats:
+
+- tar (optionally gzip/bz2/xz compressed): members are read in stream mode
+- zip: the central directory sits at the end of the file, so the upload is
+  spooled to a SpooledTemporaryFile (memory up to ARCHIVE_SPOOL_BYTES, then a
+  temporary file) before members are read; members are never extracted
+- npy: an (N, H, W, 3) uint8 array, read one frame at a time
+"""
+
+import asyncio
+import io
+import os
+import queue
+import tarfile
+import tempfile
+import zipfile
+
+import numpy as np
+
+ARCHIVE_SPOOL_BYTES = int(os.environ.get("ARCHIVE_SPOOL_BYTES", str(64 * 1024 * 1024)))
+ARCHIVE_READ_TIMEOUT = float(os.environ.get("ARCHIVE_READ_TIMEOUT", "60"))
+
+ARCHIVE_CONTENT_TYPES = {
+    "application/x-tar": "tar",
+    "application/tar": "tar",
+    "application/x-gtar": "tar",
+    "application/gzip": "tar",
+    "application/x-gzip": "tar",
+    "application/zip": "zip",
+    "application/x-zip-compressed": "zip",
+    "application/x-npy": "npy",
+    "application/npy": "npy"
+}
+
+ARCHIVE_FORMATS = ["tar", "zip", "npy"]
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp"}
+
+class QueueReader(io.RawIOBase):
+    """Read-only stream over chunks pushed from another thread"""
+
+    def __init__(self, max_chunks: int = 16, timeout: float = ARCHIVE_READ_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = b""
+        self._eof = False
+        self.abandoned = False
+
+    def readable(self):
+        return True
+
+    def feed(self, chunk) -> bool:
+        """Push a chunk (None for end of stream). Blocks while the queue is full.
+        Returns False if the reader has stopped consuming."""
+        while not self.abandoned:
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def feed_async(self, chunk) -> bool:
+        """feed() for the event loop: waits for queue space with an awaited backoff instead of blocking a thread"""
+        delay = 0.001
+        while not self.abandoned:
+            try:
+                self._queue.put_nowait(chunk)
+                return True
+            except queue.Full:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        return False
+
+    def abandon(self):
+        """Called by the consumer when it stops reading, so feed() does not block forever"""
+        self.abandoned = True
+
+    def readinto(self, b):
+        while not self._buffer and not self._eof:
+            try:
+                chunk = self._queue.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No archive data received for {self.timeout:g} s")
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = chunk
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+def _is_image_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+def iter_tar_members(stream):
+    """Yield (name, image bytes) for image members of a tar stream"""
+    with tarfile.open(fileobj=stream, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile() and _is_image_name(member.name):
+                yield member.name, archive.extractfile(member).read()
+
+def iter_zip_members(stream):
+    """Yield (name, image bytes) for image members of a zip upload"""
+    with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_BYTES) as spool:
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                break
+            spool.write(chunk)
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_image_name(info.filename):
+                    yield info.filename, archive.read(info)
+
+def _read_exact(stream, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+def iter_npy_frames(stream):
+    """Yield (name, HxWx3 uint8 array) for each frame of an NPY stack"""
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+
+    if dtype != np.uint8 or fortran_order or len(shape) != 4 or shape[3] != 3:
+        raise ValueError(f"NPY stack must be a C-ordered (N, H, W, 3) uint8 array, got {dtype} {shape}")
+
+    frame_bytes = shape[1] * shape[2] * 3
+    for i in range(shape[0]):
+        data = _read_exact(stream, frame_bytes)
+        if len(data) < frame_bytes:
+            raise ValueError(f"NPY stack truncated at frame {i} of {shape[0]}")
+        yield f"frame_{i:06d}", np.frombuffer(data, dtype=np.uint8).reshape(shape[1], shape[2], 3)
+
+def iter_archive(stream, archive_format: str):
+    """Dispatch to the reader for the given archive format"""
+    if archive_format == "tar":
+        return iter_tar_members(stream)
+    if archive_format == "zip":
+        return iter_zip_members(stream)
+    if archive_format == "npy":
+        return iter_npy_frames(stream)
+    raise ValueError(f"archive format must be one of {ARCHIVE_FORMATS}")
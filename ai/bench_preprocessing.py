@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for image preprocessing, with stored baselines and regression gating.
+
+Each registered case times one step:
+
+- decode: compressed bytes to pixels
+- convert: non-RGB images (RGBA, grayscale) to RGB
+- resize: to the disaster and damage model input sizes
+- tensorize: a batch of uint8 arrays to normalized float32 model input
+- end-to-end: upload bytes to model input
+
+Cases run on a generated image set covering realistic sizes (VGA, 1080p, 12 MP
+phone photos) and formats (JPEG, PNG, WebP, RGBA PNG, grayscale JPEG), or on
+the files of --images. Cases marked "hot" are the functions the server
+actually runs (preprocessing.py). The others are alternatives, such as JPEG
+draft decoding, OpenCV, torchvision transforms and Keras load_img (as in
+test_disaster_auto.py). They are measured for comparison only.
+
+Every case is timed as the best of --repeat runs, each long enough to last at
+least --min-time seconds. The runs are interleaved across cases. --save-baseline stores the results. --baseline
+compares a later run against them and exits 1 when a hot case is slower by
+more than --max-regression-pct. A fixed numpy calibration workload is timed
+with every run, and baseline times are scaled by the change in its speed, so
+a busier or slower host does not read as a code regression.
+
+Usage:
+    python bench_preprocessing.py --list
+    python bench_preprocessing.py --save-baseline preprocessing_baseline.json
+    python bench_preprocessing.py --baseline preprocessing_baseline.json --max-regression-pct 15
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import (
+    load_rgb_image, resize_for_disaster, resize_for_damage, decode_for_models,
+    disaster_input, damage_input, DAMAGE_INPUT_SIZE
+)
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+CASES = {}
+
+SIZES = {
+    "small": (640, 480),
+    "medium": (1920, 1080),
+    "large": (4032, 3024)
+}
+
+FORMATS = {
+    # name: (PIL format, mode, save options)
+    "jpeg": ("JPEG", "RGB", {"quality": 90}),
+    "png": ("PNG", "RGB", {}),
+    "webp": ("WEBP", "RGB", {"quality": 90}),
+    "png-rgba": ("PNG", "RGBA", {}),
+    "jpeg-gray": ("JPEG", "L", {"quality": 90})
+}
+
+class CaseUnavailable(Exception):
+    """The case cannot run here (missing package)"""
+
+def register_case(name: str, stage: str, description: str, hot: bool = False, replaces: str = None,
+                  default: bool = True, per_sample: bool = True):
+    """Register a case factory: factory(sample, args) -> zero-argument callable to time, or None if it does not apply
+
+    An alternative names the hot case it could replace; its speed and output are compared with that case.
+    """
+    def decorator(factory):
+        CASES[name] = {"stage": stage, "description": description, "hot": hot, "replaces": replaces,
+                       "default": default, "per_sample": per_sample, "factory": factory}
+        return factory
+    return decorator
+
+def synthetic_image(width: int, height: int, mode: str, seed: int) -> Image.Image:
+    """Photo-like content: smooth colour regions plus sensor noise, so codecs work as hard as on real images"""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (height // 48 + 2, width // 48 + 2, 3), dtype=np.uint8)
+    smooth = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BICUBIC), dtype=np.int16)
+    noisy = np.clip(smooth + rng.integers(-10, 11, smooth.shape, dtype=np.int16), 0, 255).astype(np.uint8)
+    img = Image.fromarray(noisy)
+    if mode == "RGBA":
+        alpha = Image.fromarray(np.full((height, width), 255, dtype=np.uint8))
+        img.putalpha(alpha)
+    elif mode != "RGB":
+        img = img.convert(mode)
+    return img
+
+def encode_image(img: Image.Image, fmt: str, options: dict) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+def make_sample(name: str, data: bytes, args) -> dict:
+    raw = Image.open(io.BytesIO(data))
+    raw.load()
+    rgb = raw if raw.mode == "RGB" else raw.convert("RGB")
+    return {
+        "name": name,
+        "format": raw.format,
+        "mode": raw.mode,
+        "width": raw.width,
+        "height": raw.height,
+        "bytes": data,
+        "raw": raw,
+        "rgb": rgb,
+        "rgb_array": np.asarray(rgb)
+    }
+
+def build_samples(args) -> list:
+    """Generated (size x format) samples, or the files of --images"""
+    samples = []
+    if args.images:
+        for filename in sorted(os.listdir(args.images)):
+            path = os.path.join(args.images, filename)
+            with open(path, "rb") as f:
+                data = f.read()
+            try:
+                samples.append(make_sample(os.path.splitext(filename)[0], data, args))
+            except Exception as e:
+                print(f"⚠ Skipping {filename}: {e}")
+        return samples
+
+    for size_name in args.sizes:
+        width, height = SIZES[size_name]
+        for seed, format_name in enumerate(args.formats):
+            fmt, mode, options = FORMATS[format_name]
+            data = encode_image(synthetic_image(width, height, mode, args.seed + seed), fmt, options)
+            samples.append(make_sample(f"{format_name}-{size_name}", data, args))
+    return samples
+
+def _require_cv2():
+    if cv2 is None:
+        raise CaseUnavailable("opencv-python is not installed")
+
+def _torchvision_transforms():
+    try:
+        from torchvision import transforms
+    except ImportError:
+        raise CaseUnavailable("torchvision is not installed")
+    return transforms
+
+def _batch(args, size) -> list:
+    rng = np.random.default_rng(args.seed)
+    return [rng.integers(0, 256, (size[0], size[1], 3), dtype=np.uint8) for _ in range(args.batch_size)]
+
+# --- decode ---
+
+@register_case("decode-pil", "decode", "Image.open + load (load_rgb_image without the RGB conversion)", hot=True)
+def _decode_pil(sample, args):
+    data = sample["bytes"]
+    return lambda: Image.open(io.BytesIO(data)).load()
+
+@register_case("decode-pil-draft", "decode", "JPEG DCT-domain downscale (Image.draft) to at least the largest input size",
+               replaces="decode-pil")
+def _decode_pil_draft(sample, args):
+    if sample["format"] != "JPEG":
+        return None
+    data = sample["bytes"]
+    # PIL (width, height) of the largest resize output; resize_for_disaster gets the disaster size unchanged
+    target = (max(args.disaster_size[0], args.damage_size[1]), max(args.disaster_size[1], args.damage_size[0]))
+
+    def run():
+        img = Image.open(io.BytesIO(data))
+        img.draft("RGB", target)
+        img.load()
+    return run
+
+@register_case("decode-cv2", "decode", "cv2.imdecode to a BGR array", replaces="decode-pil")
+def _decode_cv2(sample, args):
+    _require_cv2()
+    buffer = np.frombuffer(sample["bytes"], dtype=np.uint8)
+    return lambda: cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+# --- convert ---
+
+@register_case("convert-pil", "convert", "Image.convert('RGB') as in load_rgb_image", hot=True)
+def _convert_pil(sample, args):
+    if sample["mode"] == "RGB":
+        return None
+    raw = sample["raw"]
+    return lambda: raw.convert("RGB")
+
+@register_case("convert-numpy", "convert", "Drop alpha / repeat gray channel on the numpy array",
+               replaces="convert-pil")
+def _convert_numpy(sample, args):
+    raw = sample["raw"]
+    if sample["mode"] == "RGBA":
+        return lambda: np.ascontiguousarray(np.asarray(raw)[..., :3])
+    if sample["mode"] == "L":
+        return lambda: np.repeat(np.asarray(raw)[..., None], 3, axis=2)
+    return None
+
+@register_case("convert-cv2-bgr", "convert", "cv2.cvtColor BGR -> RGB after cv2.imdecode", replaces="convert-pil")
+def _convert_cv2(sample, args):
+    _require_cv2()
+    if sample["mode"] == "RGB":
+        return None
+    bgr = cv2.imdecode(np.frombuffer(sample["bytes"], dtype=np.uint8), cv2.IMREAD_COLOR)
+    return lambda: cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+# --- resize ---
+
+@register_case("resize-disaster-pil", "resize", "resize_for_disaster (PIL default resampling)", hot=True)
+def _resize_disaster(sample, args):
+    # The server passes DISASTER_MODEL_INPUT_SIZE (the model's H, W) to resize_for_disaster unchanged
+    rgb, size = sample["rgb"], tuple(args.disaster_size)
+    return lambda: resize_for_disaster(rgb, size)
+
+@register_case("resize-damage-pil", "resize", "resize_for_damage (PIL bilinear)", hot=True)
+def _resize_damage(sample, args):
+    rgb, size = sample["rgb"], tuple(args.damage_size)
+    return lambda: resize_for_damage(rgb, size)
+
+@register_case("resize-pil-reducing-gap", "resize", "PIL bilinear with reducing_gap=2 (integer pre-reduction)",
+               replaces="resize-damage-pil")
+def _resize_reducing_gap(sample, args):
+    rgb, size = sample["rgb"], (args.damage_size[1], args.damage_size[0])
+    return lambda: np.asarray(rgb.resize(size, Image.BILINEAR, reducing_gap=2.0), dtype=np.uint8)
+
+@register_case("resize-cv2-area", "resize", "cv2.resize INTER_AREA on the RGB array", replaces="resize-damage-pil")
+def _resize_cv2_area(sample, args):
+    _require_cv2()
+    array, size = sample["rgb_array"], (args.damage_size[1], args.damage_size[0])
+    return lambda: cv2.resize(array, size, interpolation=cv2.INTER_AREA)
+
+@register_case("resize-cv2-linear", "resize", "cv2.resize INTER_LINEAR (no antialiasing) on the RGB array",
+               replaces="resize-damage-pil")
+def _resize_cv2_linear(sample, args):
+    _require_cv2()
+    array, size = sample["rgb_array"], (args.damage_size[1], args.damage_size[0])
+    return lambda: cv2.resize(array, size, interpolation=cv2.INTER_LINEAR)
+
+@register_case("resize-torchvision", "resize", "transforms.Resize on the PIL image", replaces="resize-damage-pil")
+def _resize_torchvision(sample, args):
+    resize = _torchvision_transforms().Resize(tuple(args.damage_size))
+    rgb = sample["rgb"]
+    return lambda: resize(rgb)
+
+# --- tensorize ---
+
+@register_case("tensor-disaster-numpy", "tensorize", "disaster_input: stack, float32, /255 (NHWC)",
+               hot=True, per_sample=False)
+def _tensor_disaster(sample, args):
+    arrays = _batch(args, args.disaster_size)
+    return lambda: disaster_input(arrays)
+
+@register_case("tensor-damage-numpy", "tensorize", "damage_input: stack, float32, /255, NCHW",
+               hot=True, per_sample=False)
+def _tensor_damage(sample, args):
+    arrays = _batch(args, args.damage_size)
+    return lambda: damage_input(arrays)
+
+@register_case("tensor-damage-torch", "tensorize", "torch.from_numpy, permute and divide in torch",
+               replaces="tensor-damage-numpy", per_sample=False)
+def _tensor_damage_torch(sample, args):
+    try:
+        import torch
+    except ImportError:
+        raise CaseUnavailable("torch is not installed")
+    arrays = _batch(args, args.damage_size)
+    return lambda: torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2).float().div(255.0).contiguous()
+
+@register_case("tensor-torchvision", "tensorize", "transforms.ToTensor per image, then torch.stack",
+               replaces="tensor-damage-numpy", per_sample=False)
+def _tensor_torchvision(sample, args):
+    to_tensor = _torchvision_transforms().ToTensor()
+    arrays = _batch(args, args.damage_size)
+    import torch
+    return lambda: torch.stack([to_tensor(array) for array in arrays])
+
+# --- end-to-end ---
+
+@register_case("e2e-decode-for-models", "end-to-end", "decode_for_models: one decode, both resizes (server path)",
+               hot=True)
+def _e2e_decode_for_models(sample, args):
+    data, disaster_size = sample["bytes"], tuple(args.disaster_size)
+    damage_size = tuple(args.damage_size)
+    return lambda: decode_for_models(data, disaster_size, damage_size)
+
+@register_case("e2e-damage-single", "end-to-end", "load_rgb_image + resize_for_damage + damage_input (batch of 1)",
+               hot=True)
+def _e2e_damage_single(sample, args):
+    data, size = sample["bytes"], tuple(args.damage_size)
+    return lambda: damage_input([resize_for_damage(load_rgb_image(data), size)])
+
+@register_case("e2e-disaster-single", "end-to-end", "load_rgb_image + resize_for_disaster + disaster_input (batch of 1)",
+               hot=True)
+def _e2e_disaster_single(sample, args):
+    data, size = sample["bytes"], tuple(args.disaster_size)
+    return lambda: disaster_input([resize_for_disaster(load_rgb_image(data), size)])
+
+@register_case("e2e-torchvision", "end-to-end", "Image.open + convert + Resize/ToTensor transforms",
+               replaces="e2e-damage-single")
+def _e2e_torchvision(sample, args):
+    transforms = _torchvision_transforms()
+    pipeline = transforms.Compose([transforms.Resize(tuple(args.damage_size)), transforms.ToTensor()])
+    data = sample["bytes"]
+    return lambda: pipeline(Image.open(io.BytesIO(data)).convert("RGB")).unsqueeze(0)
+
+@register_case("e2e-keras-load-img", "end-to-end",
+               "keras load_img + img_to_array as in test_disaster_auto.py (imports TensorFlow)",
+               replaces="e2e-disaster-single", default=False)
+def _e2e_keras(sample, args):
+    try:
+        from tensorflow.keras.preprocessing import image
+    except ImportError:
+        raise CaseUnavailable("tensorflow is not installed")
+    data, size = sample["bytes"], tuple(args.disaster_size)
+    return lambda: np.expand_dims(image.img_to_array(image.load_img(io.BytesIO(data), target_size=size)) / 255.0, 0)
+
+def loop_size(fn, min_time: float) -> int:
+    """Calls per timed run so that one run lasts at least min_time seconds"""
+    fn()
+    number = 1
+    while True:
+        elapsed = time_loop(fn, number)
+        if elapsed >= min_time:
+            return number
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+
+def time_loop(fn, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - start
+
+def summarize_runs(runs_s: list, number: int) -> dict:
+    """Best and median microseconds per call"""
+    runs = np.asarray(runs_s) / number * 1e6
+    median = float(np.median(runs))
+    return {
+        "best_us": round(float(runs.min()), 3),
+        "median_us": round(median, 3),
+        "spread_pct": round(float(runs.max() - runs.min()) / median * 100.0, 2) if median else 0.0,
+        "number": number,
+        "repeat": len(runs)
+    }
+
+def calibration_workload():
+    """Fixed numpy work that does not depend on the preprocessing code, to measure how fast this machine is now"""
+    data = np.arange(1 << 18, dtype=np.float32)
+
+    def run():
+        return float(np.sqrt(data * 1.0001 + 1.0).sum())
+    return run
+
+def output_difference(output, reference):
+    """Mean absolute difference between two outputs of the same shape (None if not comparable)"""
+    try:
+        a = np.asarray(output, dtype=np.float32)
+        b = np.asarray(reference, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    if a.shape != b.shape or not a.size:
+        return None
+    return round(float(np.abs(a - b).mean()), 6)
+
+def environment() -> dict:
+    """Library versions and machine details; baselines are only comparable on a matching environment"""
+    import PIL
+    versions = {"python": platform.python_version(), "pillow": PIL.__version__, "numpy": np.__version__,
+                "opencv": cv2.__version__ if cv2 is not None else None}
+    for module in ("torch", "torchvision"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    versions.update({"machine": platform.machine(), "processor": platform.processor() or None,
+                     "cpu_count": os.cpu_count(), "system": platform.system()})
+    return versions
+
+def select_cases(names) -> list:
+    if not names:
+        return [name for name, case in CASES.items() if case["default"]]
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        print(f"❌ Unknown cases: {', '.join(unknown)} (see --list)")
+        sys.exit(2)
+    return names
+
+def run(args) -> dict:
+    if cv2 is not None:
+        cv2.setNumThreads(args.threads)
+    try:
+        import torch
+        torch.set_num_threads(args.threads)
+    except ImportError:
+        pass
+
+    print(f"🖼 Preparing samples ({'files in ' + args.images if args.images else 'generated'})")
+    samples = build_samples(args)
+    for sample in samples:
+        print(f"    {sample['name']:20s} {sample['format']:5s} {sample['mode']:4s} "
+              f"{sample['width']}x{sample['height']} {len(sample['bytes']) / 1024:8.1f} KB")
+
+    # (key, case name, sample, fn, calls per run); the calibration workload is timed alongside the cases
+    calibration = calibration_workload()
+    items = [("calibration", None, None, calibration, loop_size(calibration, args.min_time))]
+    for name in select_cases(args.cases):
+        case = CASES[name]
+        targets = samples if case["per_sample"] else [{"name": f"batch{args.batch_size}"}]
+        for sample in targets:
+            try:
+                fn = case["factory"](sample, args)
+            except CaseUnavailable as e:
+                print(f"  ⚠ {name} skipped: {e}")
+                break
+            if fn is not None:
+                items.append((f"{name}/{sample['name']}", name, sample, fn, loop_size(fn, args.min_time)))
+
+    # Rounds are interleaved across all cases, so drift in machine speed (other tenants, frequency
+    # scaling) during the run hits every case alike instead of whichever ran at the time
+    print(f"⏱ Timing {len(items) - 1} cases, {args.repeat} interleaved rounds")
+    runs = {key: [] for key, *_ in items}
+    for _ in range(args.repeat):
+        for key, _, _, fn, number in items:
+            runs[key].append(time_loop(fn, number))
+
+    calibration_us = summarize_runs(runs["calibration"], items[0][4])["best_us"]
+    results = {}
+    for key, name, sample, fn, number in items[1:]:
+        case = CASES[name]
+        timing = summarize_runs(runs[key], number)
+        result = dict(timing, case=name, sample=sample["name"], stage=case["stage"], hot=case["hot"],
+                      replaces=case["replaces"])
+        if case["replaces"]:
+            reference = CASES[case["replaces"]]["factory"](sample, args)
+            result["mean_abs_diff"] = output_difference(fn(), reference()) if reference else None
+        results[key] = result
+        print(f"  {'🔥' if case['hot'] else '  '} {key:48s} {timing['best_us']:12.1f} us "
+              f"(median {timing['median_us']:.1f}, spread {timing['spread_pct']:.1f}%)")
+    print(f"     calibration workload {calibration_us:.1f} us")
+
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": environment(),
+        "calibration_us": calibration_us,
+        "settings": {"disaster_size": list(args.disaster_size), "damage_size": list(args.damage_size),
+                     "batch_size": args.batch_size, "threads": args.threads, "repeat": args.repeat,
+                     "min_time": args.min_time, "images": args.images, "seed": args.seed},
+        "results": results
+    }
+
+def summarize_alternatives(report: dict):
+    """Speed of each alternative relative to the hot case it could replace, and how far its output differs"""
+    results = report["results"]
+    lines = []
+    for key, result in results.items():
+        hot = results.get(f"{result['replaces']}/{result['sample']}") if result.get("replaces") else None
+        if hot is None:
+            continue
+        diff = result.get("mean_abs_diff")
+        lines.append(f"  {key:48s} {hot['best_us'] / result['best_us']:7.2f}x vs {result['replaces']}"
+                     f"{'' if diff is None else f' | output differs by {diff:.4g} on average'}")
+    if lines:
+        print("\n💡 Alternatives (speed-up over the hot path; only swap in one whose output matches):")
+        for line in lines:
+            print(line)
+
+def compare_baseline(report: dict, baseline: dict, max_regression_pct: float, min_delta_us: float,
+                     gate_all: bool, normalize: bool = True, allow_missing: bool = False) -> list:
+    """Print changes against the baseline; returns the gated cases slower than the limit or missing"""
+    failures = []
+    scale = 1.0
+    if normalize and baseline.get("calibration_us") and report.get("calibration_us"):
+        # Express the baseline in today's machine speed: a uniformly slower host is not a regression
+        scale = report["calibration_us"] / baseline["calibration_us"]
+        print(f"⏱ Machine speed vs baseline: calibration {baseline['calibration_us']:.1f} -> "
+              f"{report['calibration_us']:.1f} us; baseline times scaled by {scale:.3f}")
+    mismatched = {k: (baseline["environment"].get(k), v) for k, v in report["environment"].items()
+                  if baseline.get("environment", {}).get(k) != v}
+    if mismatched:
+        print("⚠ Baseline environment differs: " +
+              ", ".join(f"{k} {before} -> {now}" for k, (before, now) in mismatched.items()))
+    if baseline.get("settings", {}) != report["settings"]:
+        print("⚠ Baseline was recorded with different settings; results may not be comparable")
+
+    print(f"\n📊 Against baseline from {baseline.get('created', 'unknown')}")
+    for key, current in report["results"].items():
+        previous = baseline.get("results", {}).get(key)
+        if not previous:
+            continue
+        before, now = previous["best_us"] * scale, current["best_us"]
+        change = (now - before) / before * 100.0 if before else 0.0
+        gated = current["hot"] or gate_all
+        flag = ""
+        if gated and max_regression_pct is not None and change > max_regression_pct and now - before > min_delta_us:
+            flag = "  ❌"
+            failures.append(f"{key} +{change:.1f}%")
+        print(f"  {'🔥' if current['hot'] else '  '} {key:48s} {before:12.1f} -> {now:12.1f} us ({change:+6.1f}%){flag}")
+    # A gated case that stopped running (renamed, crashed, filtered out) must not pass silently
+    missing = [key for key, previous in baseline.get("results", {}).items()
+               if (previous.get("hot") or gate_all) and key not in report["results"]]
+    if missing:
+        print(f"{'⚠' if allow_missing else '❌'} {len(missing)} gated cases in the baseline did not run "
+              f"(e.g. {', '.join(missing[:3])}); were --cases, --sizes or --formats narrowed?")
+        if not allow_missing:
+            failures.extend(f"{key} did not run" for key in missing)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocessing micro-benchmarks with baseline regression gating")
+    parser.add_argument("--list", action="store_true", help="List registered cases and exit")
+    parser.add_argument("--cases", nargs="+", help="Cases to run (default: all except opt-in ones)")
+    parser.add_argument("--images", help="Benchmark these image files instead of generated samples")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--formats", nargs="+", choices=list(FORMATS), default=list(FORMATS))
+    parser.add_argument("--disaster-size", type=int, nargs=2, default=[64, 64], metavar=("H", "W"),
+                        help="Disaster model input size (default: 64 64, the server default)")
+    parser.add_argument("--damage-size", type=int, nargs=2, default=list(DAMAGE_INPUT_SIZE), metavar=("H", "W"))
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per batch in the tensorize cases")
+    parser.add_argument("--threads", type=int, default=1, help="OpenCV/torch threads (the server decodes per request)")
+    parser.add_argument("--repeat", type=int, default=7, help="Timed runs per case; the best is compared")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum seconds per timed run")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated images")
+    parser.add_argument("--output", help="Write the JSON results here")
+    parser.add_argument("--save-baseline", help="Write the results as a baseline file")
+    parser.add_argument("--baseline", help="Baseline file to compare against")
+    parser.add_argument("--max-regression-pct", type=float, default=10.0,
+                        help="With --baseline, exit 1 if a hot case is slower by more than this (default: 10)")
+    parser.add_argument("--min-delta-us", type=float, default=2.0,
+                        help="Ignore slowdowns smaller than this many microseconds (timer noise)")
+    parser.add_argument("--gate-all", action="store_true", help="Gate every case, not only the hot path")
+    parser.add_argument("--allow-missing", action="store_true",
+                        help="Do not fail when gated baseline cases did not run (for deliberately narrowed runs)")
+    parser.add_argument("--no-normalize", action="store_true",
+                        help="Compare raw times instead of scaling the baseline by the calibration workload")
+
+    args = parser.parse_args()
+
+    if args.list:
+        for name, case in CASES.items():
+            tags = "hot" if case["hot"] else ("opt-in" if not case["default"] else "")
+            print(f"{name:26s} {case['stage']:11s} {tags:7s} {case['description']}")
+        return
+
+    if args.images and not os.path.isdir(args.images):
+        print(f"❌ Image folder not found: {args.images}")
+        sys.exit(2)
+    baseline = None
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            print(f"❌ Baseline not found: {args.baseline} (create one with --save-baseline)")
+            sys.exit(2)
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    report = run(args)
+    summarize_alternatives(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"📝 Results written to {path}")
+
+    if baseline is not None:
+        failures = compare_baseline(report, baseline, args.max_regression_pct, args.min_delta_us, args.gate_all,
+                                    normalize=not args.no_normalize, allow_missing=args.allow_missing)
+        if failures:
+            print(f"❌ Preprocessing regressions over {args.max_regression_pct}% or missing: {', '.join(failures)}")
+            sys.exit(1)
+        print(f"✅ No {'' if args.gate_all else 'hot-path '}case is more than {args.max_regression_pct}% slower")
+
+if __name__ == "__main__":
+    main()
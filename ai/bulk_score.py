@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Offline bulk scoring for large image archives.
+
+Walks a directory tree, decodes and resizes images in a pool of worker
+processes and runs both models on the decoded images in large batches in the
+main process. Results are appended to a JSONL file (or Parquet part files when
+pyarrow is installed) and a checkpoint is written after every flushed batch so
+an interrupted run can be resumed with --resume.
+
+Usage:
+    python bulk_score.py /data/archive --output scores.jsonl
+    python bulk_score.py /data/archive --output scores_parquet --format parquet --resume
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import re
+import sys
+import time
+from collections import deque
+
+from preprocessing import decode_for_models, disaster_input, damage_input
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp"}
+# Parquet part files; numbers grow past five digits on very large runs
+PART_NAME = re.compile(r"part-(\d+)\.parquet")
+
+# Set in each decode worker by _init_worker
+_WORKER_DISASTER_SIZE = (64, 64)
+
+def list_images(root: str) -> list:
+    """Return every image path under root, relative to root, in a stable order"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return paths
+
+def update_listing_digest(digest, paths: list):
+    for path in paths:
+        digest.update(path.encode("utf-8") + b"\0")
+    return digest
+
+def listing_digest(paths: list) -> str:
+    """SHA-256 over a list of relative paths (identifies the already processed part of a listing)"""
+    return update_listing_digest(hashlib.sha256(), paths).hexdigest()
+
+def _init_worker(disaster_size):
+    global _WORKER_DISASTER_SIZE
+    _WORKER_DISASTER_SIZE = tuple(disaster_size)
+
+def decode_file(path: str):
+    """Read and preprocess one file in a worker process. Returns (disaster, damage, error)"""
+    try:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        disaster_arr, damage_arr = decode_for_models(image_bytes, _WORKER_DISASTER_SIZE)
+        return disaster_arr, damage_arr, None
+    except Exception as e:
+        return None, None, str(e)
+
+class CheckpointState:
+    """Progress record that lets an interrupted run resume where it stopped"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.next_index = 0
+        self.output_bytes = 0
+        self.parts = 0
+        self.scored = 0
+        self.failed = 0
+        self.processed_sha256 = None  # listing_digest of the first next_index paths
+        self.last_path = None
+
+    def load(self, input_root: str, output_format: str) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        if data.get("input_root") != os.path.abspath(input_root) or data.get("format") != output_format:
+            raise ValueError(f"Checkpoint {self.path} was written for a different input or format")
+        self.next_index = data["next_index"]
+        self.output_bytes = data.get("output_bytes", 0)
+        self.parts = data.get("parts", 0)
+        self.scored = data.get("scored", 0)
+        self.failed = data.get("failed", 0)
+        self.processed_sha256 = data.get("processed_sha256")
+        self.last_path = data.get("last_path")
+        return True
+
+    def check_listing(self, paths: list):
+        """Refuse to resume when files were added or removed among the already processed paths"""
+        if self.processed_sha256 is None:
+            print("⚠ Checkpoint has no listing digest; assuming the input is unchanged")
+            return
+        if self.next_index > len(paths) or listing_digest(paths[:self.next_index]) != self.processed_sha256:
+            raise ValueError(f"Files under the input changed before the resume point (last scored: {self.last_path}); "
+                             f"resuming by position would skip or re-score images. Start over without --resume")
+
+    def save(self, input_root: str, output_format: str):
+        data = {
+            "input_root": os.path.abspath(input_root),
+            "format": output_format,
+            "next_index": self.next_index,
+            "output_bytes": self.output_bytes,
+            "parts": self.parts,
+            "scored": self.scored,
+            "failed": self.failed,
+            "processed_sha256": self.processed_sha256,
+            "last_path": self.last_path,
+            "updated_at": time.time()
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+class JsonlWriter:
+    """Appends one JSON object per image to a single file"""
+
+    def __init__(self, path: str, state: CheckpointState):
+        self.state = state
+        mode = "r+b" if os.path.exists(path) and state.output_bytes else "wb"
+        self.file = open(path, mode)
+        # Drop anything written after the last checkpoint
+        self.file.truncate(state.output_bytes)
+        self.file.seek(state.output_bytes)
+
+    def write(self, records: list):
+        for record in records:
+            self.file.write(json.dumps(record).encode("utf-8") + b"\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.state.output_bytes = self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:
+    """Writes one Parquet part file per flushed batch into an output directory"""
+
+    def __init__(self, path: str, state: CheckpointState):
+        if pa is None:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)")
+        self.path = path
+        self.state = state
+        os.makedirs(path, exist_ok=True)
+        # Remove parts written after the last checkpoint
+        for name in os.listdir(path):
+            match = PART_NAME.fullmatch(name)
+            if match and int(match.group(1)) >= state.parts:
+                os.remove(os.path.join(path, name))
+
+    def write(self, records: list):
+        columns = {
+            "path": [r["path"] for r in records],
+            "error": [r.get("error") for r in records]
+        }
+        for key in ("disaster", "damage"):
+            columns[f"{key}_class"] = [r[key]["predicted_class"] if key in r else None for r in records]
+            columns[f"{key}_confidence"] = [r[key]["confidence"] if key in r else None for r in records]
+            columns[f"{key}_probabilities"] = [
+                list(r[key]["probabilities"].values()) if key in r else None for r in records
+            ]
+        part_path = os.path.join(self.path, f"part-{self.state.parts:05d}.parquet")
+        pq.write_table(pa.table(columns), part_path)
+        self.state.parts += 1
+
+    def close(self):
+        pass
+
+def load_models(args):
+    """Load the requested models through the API's own loaders"""
+    import fastapi_backend as backend
+
+    if args.models in ("disaster", "both"):
+        backend.load_disaster_model(args.disaster_model)
+    if args.models in ("damage", "both"):
+        backend.load_damage_model(args.damage_model)
+    return backend
+
+def score_batch(backend, args, paths: list, decoded: list) -> list:
+    """Run batched inference over one decoded batch and build output records"""
+    import torch
+
+    ok = [i for i, (_, _, error) in enumerate(decoded) if error is None]
+    records = [{"path": path} for path in paths]
+    for i, (_, _, error) in enumerate(decoded):
+        if error is not None:
+            records[i]["error"] = error
+
+    if ok:
+        if args.models in ("disaster", "both"):
+            probs = backend.predict_disaster_probs(disaster_input([decoded[i][0] for i in ok]))
+            for row, i in zip(probs, ok):
+                records[i]["disaster"] = backend.format_prediction(row, backend.DISASTER_CLASSES)
+        if args.models in ("damage", "both"):
+            batch = torch.from_numpy(damage_input([decoded[i][1] for i in ok]))
+            probs = backend.predict_damage_probs(batch)
+            for row, i in zip(probs, ok):
+                records[i]["damage"] = backend.format_prediction(row, backend.DAMAGE_CLASSES)
+    return records
+
+def run(args):
+    paths = list_images(args.input)
+    total = len(paths)
+    print(f"📁 Found {total} images under {args.input}")
+
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint.json"
+    state = CheckpointState(checkpoint_path)
+    if args.resume and state.load(args.input, args.format):
+        state.check_listing(paths)
+        print(f"↩ Resuming at image {state.next_index} ({state.scored} scored, {state.failed} failed)")
+    elif os.path.exists(checkpoint_path) and not args.resume:
+        print(f"⚠ Checkpoint {checkpoint_path} exists; pass --resume to continue it. Starting over.")
+
+    backend = load_models(args)
+    writer = ParquetWriter(args.output, state) if args.format == "parquet" else JsonlWriter(args.output, state)
+
+    workers = args.workers or os.cpu_count() or 1
+    chunksize = max(1, args.batch_size // (workers * 4))
+    ctx = mp.get_context("spawn")
+    pool = ctx.Pool(workers, initializer=_init_worker, initargs=(backend.DISASTER_MODEL_INPUT_SIZE,))
+    print(f"⚙ {workers} decode workers, batch size {args.batch_size}, prefetch {args.prefetch} batches")
+
+    start_index = state.next_index
+    start_time = time.time()
+    last_report = start_time
+    pending = deque()
+    next_submit = start_index
+    # Running digest of every path handed to the writer, saved with each checkpoint
+    processed = update_listing_digest(hashlib.sha256(), paths[:start_index])
+
+    def submit_next():
+        nonlocal next_submit
+        batch_paths = paths[next_submit:next_submit + args.batch_size]
+        full_paths = [os.path.join(args.input, p) for p in batch_paths]
+        pending.append((batch_paths, pool.map_async(decode_file, full_paths, chunksize)))
+        next_submit += len(batch_paths)
+
+    try:
+        # Keep a bounded number of batches decoding ahead of inference
+        while next_submit < total and len(pending) < args.prefetch:
+            submit_next()
+
+        while pending:
+            batch_paths, result = pending.popleft()
+            decoded = result.get()
+            if next_submit < total:
+                submit_next()
+
+            records = score_batch(backend, args, batch_paths, decoded)
+            writer.write(records)
+
+            failed = sum(1 for r in records if "error" in r)
+            state.failed += failed
+            state.scored += len(records) - failed
+            state.next_index += len(records)
+            update_listing_digest(processed, batch_paths)
+            state.processed_sha256 = processed.hexdigest()
+            state.last_path = batch_paths[-1]
+            state.save(args.input, args.format)
+
+            now = time.time()
+            if now - last_report >= args.report_every or not pending:
+                done = state.next_index - start_index
+                rate = done / max(now - start_time, 1e-9)
+                remaining = (total - state.next_index) / rate if rate > 0 else 0
+                print(f"  {state.next_index}/{total} images | {rate:.1f} img/s | "
+                      f"{state.failed} failed | ETA {remaining / 60:.1f} min")
+                last_report = now
+    except KeyboardInterrupt:
+        print(f"\n⏸ Interrupted. Progress saved to {checkpoint_path}; rerun with --resume")
+        pool.terminate()
+        writer.close()
+        sys.exit(130)
+
+    pool.close()
+    pool.join()
+    writer.close()
+
+    elapsed = time.time() - start_time
+    done = state.next_index - start_index
+    print("\n" + "=" * 40)
+    print(f"✅ Scored {state.scored} images ({state.failed} failed) in {elapsed:.1f}s")
+    print(f"   Throughput this run: {done / max(elapsed, 1e-9):.1f} images/s")
+    print(f"   Results: {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Score an image archive offline with the disaster and damage models")
+    parser.add_argument("input", help="Directory containing images (searched recursively)")
+    parser.add_argument("--output", required=True, help="JSONL file, or output directory for --format parquet")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="Output format (default: jsonl)")
+    parser.add_argument("--models", choices=["disaster", "damage", "both"], default="both",
+                        help="Which models to run (default: both)")
+    parser.add_argument("--disaster-model", default="disaster.h5", help="Path to the disaster model")
+    parser.add_argument("--damage-model", default="best_damage.pth", help="Path to the damage model")
+    parser.add_argument("--workers", type=int, default=0, help="Decode worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Images per inference batch (default: 256)")
+    parser.add_argument("--prefetch", type=int, default=4, help="Batches decoded ahead of inference (default: 4)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint.json)")
+    parser.add_argument("--resume", action="store_true", help="Continue from an existing checkpoint")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+
+    args = parser.parse_args()
+    if not os.path.isdir(args.input):
+        print(f"Error: {args.input} is not a directory")
+        sys.exit(1)
+
+    run(args)
+
+if __name__ == "__main__":
+    main()
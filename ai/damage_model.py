@@ -1,14 +1,16 @@
 import torch
 import torch.nn as nn
+from typing import List, Tuple
 
 class DamageConvBlock(nn.Module):
-    def __init__(self, in_ch, out_ch):
+    def __init__(self, in_ch, out_ch, mid_ch=None):
         super().__init__()
+        mid_ch = mid_ch or out_ch
         self.conv = nn.Sequential(
-            nn.Conv2d(in_ch, out_ch, 3, padding=1),
-            nn.BatchNorm2d(out_ch),
+            nn.Conv2d(in_ch, mid_ch, 3, padding=1),
+            nn.BatchNorm2d(mid_ch),
             nn.ReLU(inplace=True),
-            nn.Conv2d(out_ch, out_ch, 3, padding=1),
+            nn.Conv2d(mid_ch, out_ch, 3, padding=1),
             nn.BatchNorm2d(out_ch),
             nn.ReLU(inplace=True)
         )
@@ -16,37 +18,56 @@ class DamageConvBlock(nn.Module):
     def forward(self, x):
         return self.conv(x)
 
+DEFAULT_CHANNELS = (64, 128, 256, 512)
+DEFAULT_HIDDEN = (256, 128)
+DEFAULT_EXIT_THRESHOLD = 0.9
+
 class DamageCNN(nn.Module):
-    def __init__(self, num_classes=4, dropout_rate=0.4):
+    def __init__(self, num_classes=4, dropout_rate=0.4, channels=DEFAULT_CHANNELS, hidden=DEFAULT_HIDDEN):
         super().__init__()
+        # channels: (mid, out) pairs per block or one width per block (mid = out)
+        self.block_widths = [tuple(c) if isinstance(c, (list, tuple)) else (c, c) for c in channels]
+        self.hidden = list(hidden)
+        self.dropout_rate = dropout_rate
+        self.num_classes = num_classes
         
+        c1, c2, c3, c4 = self.block_widths
         self.features = nn.Sequential(
-            DamageConvBlock(3, 64),
+            DamageConvBlock(3, c1[1], c1[0]),
             nn.MaxPool2d(2),
             
-            DamageConvBlock(64, 128),
+            DamageConvBlock(c1[1], c2[1], c2[0]),
             nn.MaxPool2d(2),
             
-            DamageConvBlock(128, 256),
+            DamageConvBlock(c2[1], c3[1], c3[0]),
             nn.MaxPool2d(2),
             
-            DamageConvBlock(256, 512),
+            DamageConvBlock(c3[1], c4[1], c4[0]),
             nn.AdaptiveAvgPool2d(1)
         )
         
+        h1, h2 = self.hidden
         self.classifier = nn.Sequential(
             nn.Dropout(dropout_rate),
-            nn.Linear(512, 256),
+            nn.Linear(c4[1], h1),
             nn.ReLU(inplace=True),
             nn.Dropout(dropout_rate * 0.75),
-            nn.Linear(256, 128),
+            nn.Linear(h1, h2),
             nn.ReLU(inplace=True),
             nn.Dropout(dropout_rate * 0.5),
-            nn.Linear(128, num_classes)
+            nn.Linear(h2, num_classes)
         )
         
         self._init_weights()
 
+    def model_config(self):
+        """Constructor arguments, saved in checkpoints as 'model_config'"""
+        return {
+            "channels": [list(widths) for widths in self.block_widths],
+            "hidden": list(self.hidden),
+            "dropout_rate": self.dropout_rate
+        }
+
     def _init_weights(self):
         for m in self.modules():
             if isinstance(m, nn.Conv2d):
@@ -60,14 +81,115 @@ class DamageCNN(nn.Module):
                 nn.init.xavier_uniform_(m.weight, gain=0.1)
                 nn.init.constant_(m.bias, 0)
 
+    @torch.jit.export
+    def embed(self, x) -> Tuple[torch.Tensor, torch.Tensor]:
+        """(pooled last-block features, final logits); the features are the classifier's input"""
+        features = torch.flatten(self.features(x), 1)
+        return features, self.classifier(features)
+
     def forward(self, x):
         x = self.features(x)
         x = x.view(x.size(0), -1)
         x = self.classifier(x)
         return x
 
-def create_damage_model(dropout_rate=0.4):
-    return DamageCNN(num_classes=4, dropout_rate=dropout_rate)
+class EarlyExitHead(nn.Module):
+    """Small classifier on the pooled output of an early block"""
+
+    def __init__(self, in_ch, num_classes, hidden=64, dropout_rate=0.2):
+        super().__init__()
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.classifier = nn.Sequential(
+            nn.Dropout(dropout_rate),
+            nn.Linear(in_ch, hidden),
+            nn.ReLU(inplace=True),
+            nn.Linear(hidden, num_classes)
+        )
+
+    def forward(self, x):
+        return self.classifier(torch.flatten(self.pool(x), 1))
+
+class EarlyExitDamageCNN(DamageCNN):
+    """DamageCNN with exit heads after the first three blocks.
+    
+    In eval mode a sample leaves at the first head whose top softmax probability
+    reaches exit_threshold; the rest of the batch carries on through the next
+    block. Backbone and classifier keys match DamageCNN, so a trained DamageCNN
+    checkpoint loads with strict=False and only the heads need training.
+    """
+
+    def __init__(self, num_classes=4, dropout_rate=0.4, channels=DEFAULT_CHANNELS, hidden=DEFAULT_HIDDEN,
+                 exit_threshold=DEFAULT_EXIT_THRESHOLD, exit_hidden=64):
+        super().__init__(num_classes, dropout_rate, channels, hidden)
+        self.exit_threshold = float(exit_threshold)
+        self.exit_hidden = exit_hidden
+        self.exit_heads = nn.ModuleList([
+            EarlyExitHead(out_ch, num_classes, exit_hidden) for mid_ch, out_ch in self.block_widths[:3]
+        ])
+        for m in self.exit_heads.modules():
+            if isinstance(m, nn.Linear):
+                nn.init.xavier_uniform_(m.weight, gain=0.1)
+                nn.init.constant_(m.bias, 0)
+
+    def model_config(self):
+        config = super().model_config()
+        config.update({"early_exit": True, "exit_threshold": self.exit_threshold, "exit_hidden": self.exit_hidden})
+        return config
+
+    def forward_all(self, x) -> List[torch.Tensor]:
+        """Logits of every exit head followed by the final classifier, for the whole batch (training)"""
+        outputs: List[torch.Tensor] = []
+        for i, layer in enumerate(self.features):
+            x = layer(x)
+            for j, head in enumerate(self.exit_heads):
+                # Heads sit after the pooling that follows blocks 1-3 (features[1], [3], [5])
+                if i == 2 * j + 1:
+                    outputs.append(head(x))
+        outputs.append(self.classifier(x.view(x.size(0), -1)))
+        return outputs
+
+    def forward_with_exits(self, x) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Logits, and the exit each sample took (len(exit_heads) means the final classifier)"""
+        rows = torch.arange(x.size(0), device=x.device)
+        exits = torch.full((x.size(0),), len(self.exit_heads), dtype=torch.long, device=x.device)
+        outputs: List[torch.Tensor] = []
+        output_rows: List[torch.Tensor] = []
+        for i, layer in enumerate(self.features):
+            x = layer(x)
+            for j, head in enumerate(self.exit_heads):
+                if i == 2 * j + 1 and x.size(0) > 0:
+                    head_logits = head(x)
+                    confidence = torch.softmax(head_logits.float(), dim=1).max(dim=1)[0]
+                    done = confidence >= self.exit_threshold
+                    if bool(done.any()):
+                        outputs.append(head_logits[done])
+                        output_rows.append(rows[done])
+                        exits[rows[done]] = j
+                        x = x[~done]
+                        rows = rows[~done]
+        if x.size(0) > 0:
+            outputs.append(self.classifier(x.view(x.size(0), -1)))
+            output_rows.append(rows)
+        if len(outputs) == 0:
+            return torch.zeros(0, self.num_classes, device=x.device), exits
+        
+        # Put the rows back in input order
+        result = torch.cat(outputs)
+        logits = torch.empty_like(result)
+        logits[torch.cat(output_rows)] = result
+        return logits, exits
+
+    def forward(self, x):
+        if self.training:
+            return self.forward_all(x)[-1]
+        return self.forward_with_exits(x)[0]
+
+def create_damage_model(dropout_rate=0.4, channels=DEFAULT_CHANNELS, hidden=DEFAULT_HIDDEN,
+                        early_exit=False, exit_threshold=DEFAULT_EXIT_THRESHOLD, exit_hidden=64):
+    if early_exit:
+        return EarlyExitDamageCNN(num_classes=4, dropout_rate=dropout_rate, channels=channels, hidden=hidden,
+                                  exit_threshold=exit_threshold, exit_hidden=exit_hidden)
+    return DamageCNN(num_classes=4, dropout_rate=dropout_rate, channels=channels, hidden=hidden)
 
 def calculate_accuracy(pred, target):
     with torch.no_grad():
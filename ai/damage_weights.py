@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Weights-only, memory-mapped checkpoints for the damage assessment model.
+
+A training checkpoint holds the optimizer state and other extras besides the
+weights, and a plain torch.load unpickles all of it into memory. `export` keeps
+only model_state_dict and model_config, as contiguous CPU tensors in torch's
+zip format.
+
+build_damage_model() loads any zip-format checkpoint with
+torch.load(mmap=True, weights_only=True). Tensors stay backed by the file and
+are paged in on first use; optimizer state in a full checkpoint is never read.
+The model is created on the meta device and the mapped tensors are attached
+with load_state_dict(assign=True), so the weights are never copied. Processes
+loading the same file share its pages in the page cache. Legacy (non-zip)
+checkpoints, or ones with non-tensor pickled objects, fall back to a full
+torch.load(weights_only=False), which unpickles arbitrary objects; only load
+checkpoints from a trusted source.
+
+Usage:
+    python damage_weights.py export best_damage.pth --output best_damage.weights.pt
+    python damage_weights.py compare best_damage.pth best_damage.weights.pt
+"""
+
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+import torch
+
+from damage_model import create_damage_model
+
+WEIGHTS_FORMAT = "damage-weights-v1"
+
+def export_weights(checkpoint_path: str, output_path: str) -> dict:
+    """Write a weights-only copy of a damage checkpoint"""
+    # Training checkpoints carry pickled extras (optimizer state, numpy scalars), which weights_only rejects
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    state_dict = {
+        key: value.detach().to("cpu").contiguous().clone()
+        for key, value in checkpoint["model_state_dict"].items()
+    }
+    slim = {
+        "format": WEIGHTS_FORMAT,
+        "model_state_dict": state_dict,
+        "model_config": checkpoint.get("model_config", {})
+    }
+    if isinstance(checkpoint.get("epoch"), int):
+        slim["epoch"] = checkpoint["epoch"]
+
+    tmp_path = output_path + ".tmp"
+    torch.save(slim, tmp_path)
+    os.replace(tmp_path, output_path)
+    return {
+        "source_bytes": os.path.getsize(checkpoint_path),
+        "output_bytes": os.path.getsize(output_path),
+        "tensors": len(state_dict),
+        "dropped_keys": sorted(key for key in checkpoint if key not in slim)
+    }
+
+def load_state(path: str):
+    """Return (state_dict, model_config, memory_mapped) for a damage checkpoint"""
+    try:
+        checkpoint = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        mapped = True
+    except (RuntimeError, pickle.UnpicklingError) as e:
+        # Legacy format or pickled extras: read it the old way
+        print(f"⚠ Warning: {path} cannot be memory-mapped ({str(e).splitlines()[0]}); loading it fully")
+        # torch >= 2.6 defaults to weights_only=True, which would reject the extras again
+        checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+        mapped = False
+    return checkpoint["model_state_dict"], checkpoint.get("model_config", {}), mapped
+
+def build_damage_model(path: str, device):
+    """Create an eval-mode DamageCNN whose weights come from path. Returns (model, memory_mapped)"""
+    state_dict, config, mapped = load_state(path)
+    # Parameters start on the meta device (no allocation) and then take over the loaded tensors
+    with torch.device("meta"):
+        model = create_damage_model(**config)
+    model.load_state_dict(state_dict, assign=True)
+    return model.to(device).eval(), mapped
+
+def _rss_kb(key: str) -> int:
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1])
+    return 0
+
+def _measure(path: str, legacy: bool):
+    """Load a checkpoint in this fresh process and print load time and memory as JSON"""
+    rss_before = _rss_kb("VmRSS")
+    start = time.perf_counter()
+    if legacy:
+        checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+        model = create_damage_model(**checkpoint.get("model_config", {}))
+        model.load_state_dict(checkpoint["model_state_dict"])
+        model.eval()
+        mapped = False
+    else:
+        model, mapped = build_damage_model(path, "cpu")
+    load_ms = (time.perf_counter() - start) * 1000.0
+    rss_loaded = _rss_kb("VmRSS")
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 64, 64))
+    print(json.dumps({
+        "load_ms": round(load_ms, 2),
+        "memory_mapped": mapped,
+        "rss_added_after_load_mb": round((rss_loaded - rss_before) / 1024.0, 1),
+        "rss_added_after_inference_mb": round((_rss_kb("VmRSS") - rss_before) / 1024.0, 1),
+        "peak_rss_mb": round(_rss_kb("VmHWM") / 1024.0, 1)
+    }))
+
+def compare(args):
+    """Load each file in a fresh process: the full checkpoint the old way, the slim one memory-mapped"""
+    runs = [("full checkpoint, torch.load", args.checkpoint, True),
+            ("weights-only, mmap", args.weights, False)]
+    for label, path, legacy in runs:
+        cmd = [sys.executable, os.path.abspath(__file__), "_measure", path] + (["--legacy"] if legacy else [])
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            print(f"❌ Measuring {path} failed:\n{proc.stderr[-2000:]}")
+            sys.exit(1)
+        result = json.loads(lines[-1])
+        print(f"  {label:30s} {os.path.getsize(path) / 1e6:8.2f} MB file | load {result['load_ms']:8.2f} ms | "
+              f"+{result['rss_added_after_load_mb']} MB after load | "
+              f"+{result['rss_added_after_inference_mb']} MB after inference | peak {result['peak_rss_mb']} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Weights-only memory-mapped damage checkpoints")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write a weights-only copy of a training checkpoint")
+    export_parser.add_argument("checkpoint", help="Training checkpoint (e.g. best_damage.pth)")
+    export_parser.add_argument("--output", default="best_damage.weights.pt")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare load time and memory of the two formats")
+    compare_parser.add_argument("checkpoint")
+    compare_parser.add_argument("weights")
+
+    measure_parser = subparsers.add_parser("_measure")
+    measure_parser.add_argument("path")
+    measure_parser.add_argument("--legacy", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        summary = export_weights(args.checkpoint, args.output)
+        print(f"✅ Exported {summary['tensors']} tensors to {args.output}")
+        print(f"   {summary['source_bytes'] / 1e6:.2f} MB -> {summary['output_bytes'] / 1e6:.2f} MB "
+              f"(dropped: {', '.join(summary['dropped_keys']) or 'nothing'})")
+    elif args.command == "compare":
+        compare(args)
+    else:
+        _measure(args.path, args.legacy)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Async client for the Disaster Detection & Damage Assessment API.
+
+One DisasterClient keeps a pool of keep-alive connections (httpx) and never
+runs more than max_concurrency requests at once. predict() calls the
+single-image endpoints. submit() queues images and sends them to
+/predict-batch in groups of up to batch_size; a group is sent when it is full
+or batch_wait_ms after its first image. Connection errors and 429/502/503/504
+responses are retried with exponential backoff and jitter, honouring
+Retry-After.
+
+With downscale set, images are resized to the model input size before upload
+and re-encoded (PNG by default). The server's own resize then leaves them
+unchanged, so single-model predictions match a full-size upload exactly. For
+"both", one upload serves both models, so the damage model sees a bicubic
+rather than a bilinear resize and its probabilities can differ slightly.
+
+Usage:
+    python disaster_client.py photos/*.jpg --type both --downscale auto --concurrency 8
+
+    async with DisasterClient("http://localhost:8000", downscale="auto") as client:
+        results = await asyncio.gather(*[client.submit(path) for path in paths])
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import httpx
+from PIL import Image
+
+from preprocessing import DAMAGE_INPUT_SIZE, load_rgb_image
+
+RETRY_STATUS = {429, 502, 503, 504}
+MAX_BATCH_FILES = 10  # /predict-batch limit
+PREDICTION_TYPES = ["disaster", "damage", "both"]
+
+ImageInput = Union[str, bytes]
+
+class DisasterAPIError(Exception):
+    """A request failed for good (status_code is None for connection errors)"""
+
+    def __init__(self, status_code: Optional[int], detail: str):
+        super().__init__(f"{status_code}: {detail}" if status_code else detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def downscale_image(image_bytes: bytes, size: Tuple[int, int], resample=Image.BICUBIC,
+                    image_format: str = "PNG", quality: int = 90) -> bytes:
+    """Resize to size (width, height) and re-encode; PNG is lossless, JPEG uses quality"""
+    img = load_rgb_image(image_bytes).resize(tuple(size), resample)
+    buffer = io.BytesIO()
+    if image_format.upper() == "JPEG":
+        img.save(buffer, format="JPEG", quality=quality)
+    else:
+        img.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def parse_size(value: str) -> Tuple[int, int]:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height or width)
+
+class DisasterClient:
+    """Pooled, bounded-concurrency async client with batching, retries and optional downscaling"""
+
+    def __init__(self, base_url: str = "http://localhost:8000", max_concurrency: int = 8,
+                 timeout: float = 60.0, retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0,
+                 downscale: Union[None, str, Tuple[int, int]] = None, image_format: str = "PNG",
+                 quality: int = 90, batch_size: int = MAX_BATCH_FILES, batch_wait_ms: float = 20.0):
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.downscale = downscale  # None, "auto" (model input size from /health) or (width, height)
+        self.image_format = image_format
+        self.quality = quality
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_FILES))
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "images": 0,
+                      "original_bytes": 0, "uploaded_bytes": 0}
+        self._http = None
+        self._semaphore = None
+        self._disaster_size = None
+        self._health_lock = None
+        self._pending = {}  # prediction type -> [((filename, bytes, content type), future)]
+        self._flush_tasks = set()
+
+    async def __aenter__(self):
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._health_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Send whatever is still queued, then close the connection pool"""
+        for prediction_type in list(self._pending):
+            self._flush(prediction_type)
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # Full jitter keeps many clients from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    async def _request(self, method: str, path: str, **kwargs) -> Dict:
+        """Send one request with retries and return the decoded JSON body"""
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            async with self._semaphore:
+                self.stats["requests"] += 1
+                try:
+                    response = await self._http.request(method, path, **kwargs)
+                except httpx.TransportError as e:
+                    error = DisasterAPIError(None, f"{type(e).__name__}: {e}")
+                else:
+                    if response.status_code < 400:
+                        return response.json()
+                    try:
+                        detail = response.json().get("detail", response.text)
+                    except ValueError:
+                        detail = response.text
+                    error = DisasterAPIError(response.status_code, str(detail))
+                    if response.status_code not in RETRY_STATUS:
+                        self.stats["failures"] += 1
+                        raise error
+                    retry_after = response.headers.get("retry-after")
+            if attempt == self.retries:
+                break
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+        self.stats["failures"] += 1
+        raise error
+
+    async def health(self) -> Dict:
+        return await self._request("GET", "/health")
+
+    async def _upload_size(self, prediction_type: str):
+        """(resize size, resample filter) for client-side downscaling, or None to send originals"""
+        if self.downscale is None:
+            return None
+        if self.downscale != "auto":
+            return tuple(self.downscale), Image.BICUBIC
+        async with self._health_lock:
+            # Ask the server once, however many images are being prepared
+            if self._disaster_size is None:
+                self._disaster_size = tuple((await self.health())["disaster_model_input_size"])
+        # Same size arguments and filters as preprocessing.resize_for_disaster / resize_for_damage
+        damage_size = (DAMAGE_INPUT_SIZE[1], DAMAGE_INPUT_SIZE[0])
+        if prediction_type == "disaster":
+            return self._disaster_size, Image.BICUBIC
+        if prediction_type == "damage":
+            return damage_size, Image.BILINEAR
+        return tuple(max(a, b) for a, b in zip(self._disaster_size, damage_size)), Image.BICUBIC
+
+    async def _prepare(self, image: ImageInput, prediction_type: str, filename: Optional[str]):
+        """Read and (optionally) downscale one image; returns (filename, bytes, content type)"""
+        if isinstance(image, str):
+            filename = filename or os.path.basename(image)
+            with open(image, "rb") as f:
+                data = f.read()
+        else:
+            data = image
+        filename = filename or "image.jpg"
+        self.stats["images"] += 1
+        self.stats["original_bytes"] += len(data)
+
+        content_type = "image/jpeg"
+        target = await self._upload_size(prediction_type)
+        if target is not None:
+            size, resample = target
+            # Resizing is CPU-bound; keep it off the event loop
+            data = await asyncio.get_running_loop().run_in_executor(
+                None, downscale_image, data, size, resample, self.image_format, self.quality)
+            content_type = "image/jpeg" if self.image_format.upper() == "JPEG" else "image/png"
+        self.stats["uploaded_bytes"] += len(data)
+        return filename, data, content_type
+
+    async def predict(self, image: ImageInput, prediction_type: str = "both",
+                      filename: Optional[str] = None, **params) -> Dict:
+        """One image through /predict-disaster, /predict-damage or /predict-both"""
+        if prediction_type not in PREDICTION_TYPES:
+            raise ValueError(f"prediction_type must be one of {PREDICTION_TYPES}")
+        upload = await self._prepare(image, prediction_type, filename)
+        return await self._request("POST", f"/predict-{prediction_type}", files={"file": upload}, params=params)
+
+    async def predict_batch(self, images: List[ImageInput], prediction_type: str = "both") -> List[Dict]:
+        """Score a list of images through /predict-batch; returns one result per image, in order"""
+        futures = [self.submit(image, prediction_type) for image in images]
+        return await asyncio.gather(*futures)
+
+    async def submit(self, image: ImageInput, prediction_type: str = "both",
+                     filename: Optional[str] = None) -> Dict:
+        """Queue one image for the next /predict-batch call and return its result"""
+        if prediction_type not in PREDICTION_TYPES:
+            raise ValueError(f"prediction_type must be one of {PREDICTION_TYPES}")
+        upload = await self._prepare(image, prediction_type, filename)
+        future = asyncio.get_running_loop().create_future()
+        group = self._pending.setdefault(prediction_type, [])
+        group.append((upload, future))
+        if len(group) >= self.batch_size:
+            self._flush(prediction_type)
+        elif len(group) == 1:
+            asyncio.get_running_loop().call_later(self.batch_wait, self._flush_group, prediction_type, group)
+        return await future
+
+    def _flush_group(self, prediction_type: str, group: List):
+        # The timer only flushes the group it was started for
+        if self._pending.get(prediction_type) is group:
+            self._flush(prediction_type)
+
+    def _flush(self, prediction_type: str):
+        group = self._pending.pop(prediction_type, None)
+        if group:
+            task = asyncio.ensure_future(self._send_batch(prediction_type, group))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def _send_batch(self, prediction_type: str, group: List):
+        try:
+            body = await self._request(
+                "POST", "/predict-batch",
+                files=[("files", upload) for upload, _ in group],
+                params={"prediction_type": prediction_type}
+            )
+            for (_, future), result in zip(group, body["results"]):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+
+async def run_cli(args) -> int:
+    """Score every image and print per-image results and a summary"""
+    downscale = None
+    if args.downscale != "none":
+        downscale = "auto" if args.downscale == "auto" else parse_size(args.downscale)
+
+    failed = 0
+    start = time.perf_counter()
+    async with DisasterClient(args.url, max_concurrency=args.concurrency, retries=args.retries,
+                              downscale=downscale, image_format=args.format, quality=args.quality,
+                              batch_size=args.batch_size) as client:
+        if args.no_batch:
+            calls = [client.predict(path, args.type) for path in args.images]
+        else:
+            calls = [client.submit(path, args.type) for path in args.images]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+
+        for path, result in zip(args.images, results):
+            if isinstance(result, Exception) or not result.get("success", False):
+                failed += 1
+                print(f"  ❌ {path}: {result if isinstance(result, Exception) else result.get('error')}")
+            elif args.verbose:
+                print(f"  ✓ {path}: {result}")
+
+        stats = client.stats
+    ratio = stats["original_bytes"] / max(1, stats["uploaded_bytes"])
+    print(f"✅ {len(args.images) - failed}/{len(args.images)} images in {elapsed:.2f}s "
+          f"({len(args.images) / elapsed:.1f} images/s)")
+    print(f"   {stats['requests']} requests, {stats['retries']} retries | uploaded "
+          f"{stats['uploaded_bytes'] / 1e6:.3f} MB of {stats['original_bytes'] / 1e6:.3f} MB ({ratio:.0f}x smaller)")
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Async client for the disaster detection API")
+    parser.add_argument("images", nargs="+", help="Image files to score")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--type", choices=PREDICTION_TYPES, default="both")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight (and pooled connections)")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_FILES, help="Images per /predict-batch call")
+    parser.add_argument("--no-batch", action="store_true", help="One single-image request per image")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--downscale", default="none",
+                        help="'none', 'auto' (model input size) or WIDTHxHEIGHT before upload")
+    parser.add_argument("--format", choices=["PNG", "JPEG"], default="PNG", help="Encoding of downscaled images")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality of downscaled images")
+    parser.add_argument("--verbose", action="store_true", help="Print every result")
+
+    args = parser.parse_args()
+
+    missing = [path for path in args.images if not os.path.exists(path)]
+    if missing:
+        print(f"❌ Image not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    sys.exit(asyncio.run(run_cli(args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Accuracy versus latency evaluation for every model variant.
+
+Runs registered variants of the disaster and damage models over a labeled
+<Class>/<image> folder. Images go through the service's own preprocessing and
+prediction code. Images in folders named after disaster classes score the
+disaster variants, and folders named after damage classes score the damage
+variants. For every variant the harness reports:
+
+- accuracy (calculate_accuracy) and top-1 agreement with the fp32 reference
+- a confusion matrix with per-class precision and recall
+- batch-1 latency percentiles and batched throughput
+
+Results are written as JSON. With --max-accuracy-drop / --max-p95-ms the
+exit status is 1 when a variant falls short, so the run can gate a rollout.
+A variant that is unavailable or fails to evaluate also fails the gates, so
+pass --variants to gate only on the variants that exist in the deployment.
+
+New variants are added with @register_variant. The factory returns a function
+that maps a list of resized uint8 images to an (N, classes) probability array,
+or raises VariantUnavailable.
+
+Usage:
+    python evaluate_variants.py data/labeled --output eval.json
+    python evaluate_variants.py data/labeled --variants damage-fp32 damage-pruned --max-accuracy-drop 1.0
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+VARIANTS = {}
+
+class VariantUnavailable(Exception):
+    """The variant cannot run here (missing file, package or hardware support)"""
+
+def register_variant(name: str, kind: str, description: str):
+    """Register a variant factory: factory(args, backend) -> predict(list of uint8 images) -> probs"""
+    def decorator(factory):
+        VARIANTS[name] = {"kind": kind, "description": description, "factory": factory}
+        return factory
+    return decorator
+
+def _require_file(path: str):
+    if not path or not os.path.exists(path):
+        raise VariantUnavailable(f"model file not found: {path}")
+
+def _disaster_precision_variant(precision: str):
+    def factory(args, backend):
+        from preprocessing import disaster_input
+        _require_file(args.disaster_model)
+        backend.load_disaster_model(args.disaster_model, precision=precision)
+        if backend.DISASTER_PRECISION != precision:
+            raise VariantUnavailable(f"{precision} is not supported natively on this CPU")
+        model = backend.DISASTER_MODEL
+        return lambda arrays: backend.predict_disaster_probs(disaster_input(arrays), model=model)
+    return factory
+
+def _damage_precision_variant(precision: str, path_arg: str = "damage_model"):
+    def factory(args, backend):
+        import torch
+        from preprocessing import damage_input
+        path = getattr(args, path_arg)
+        _require_file(path)
+        backend.load_damage_model(path, precision=precision)
+        if backend.DAMAGE_PRECISION != precision:
+            raise VariantUnavailable(f"{precision} is not supported natively on this device")
+        model = backend.DAMAGE_MODEL
+        return lambda arrays: backend.predict_damage_probs(torch.from_numpy(damage_input(arrays)), model=model)
+    return factory
+
+for _precision in ("fp32", "bf16", "fp16"):
+    register_variant(f"disaster-{_precision}", "disaster",
+                     f"Keras model, {_precision} policy")(_disaster_precision_variant(_precision))
+    register_variant(f"damage-{_precision}", "damage",
+                     f"DamageCNN, {_precision} autocast")(_damage_precision_variant(_precision))
+
+register_variant("damage-pruned", "damage", "Channel-pruned DamageCNN (prune_damage.py)")(
+    _damage_precision_variant("fp32", "pruned_damage_model"))
+
+@register_variant("damage-int8-dynamic", "damage", "DamageCNN with int8 dynamically quantized Linear layers")
+def _damage_int8_dynamic(args, backend):
+    import torch
+    import torch.nn as nn
+    from damage_model import create_damage_model
+    from preprocessing import damage_input
+    _require_file(args.damage_model)
+
+    checkpoint = torch.load(args.damage_model, map_location="cpu")
+    model = create_damage_model(**checkpoint.get("model_config", {}))
+    model.load_state_dict(checkpoint["model_state_dict"])
+    model = torch.ao.quantization.quantize_dynamic(model.eval(), {nn.Linear}, dtype=torch.qint8)
+
+    def predict(arrays):
+        with torch.no_grad():
+            return torch.softmax(model(torch.from_numpy(damage_input(arrays))), dim=1).numpy()
+    return predict
+
+@register_variant("damage-onnx", "damage", "DamageCNN exported to ONNX, run with onnxruntime")
+def _damage_onnx(args, backend):
+    from preprocessing import damage_input
+    try:
+        import onnxruntime
+    except ImportError:
+        raise VariantUnavailable("onnxruntime is not installed")
+    _require_file(args.damage_onnx)
+
+    session = onnxruntime.InferenceSession(args.damage_onnx, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    def predict(arrays):
+        logits = session.run(None, {input_name: damage_input(arrays)})[0]
+        e = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return e / e.sum(axis=1, keepdims=True)
+    return predict
+
+def load_labeled(root: str, class_names: list, disaster_size, limit: int = None):
+    """Decode the images whose top-level folder is one of class_names. Returns (decoded, labels, errors)"""
+    from bulk_score import list_images
+    from preprocessing import decode_for_models
+
+    decoded, labels, errors = [], [], 0
+    for path in list_images(root):
+        label = path.replace("\\", "/").split("/")[0]
+        if label not in class_names:
+            continue
+        if limit is not None and len(labels) >= limit:
+            break
+        try:
+            with open(os.path.join(root, path), "rb") as f:
+                decoded.append(decode_for_models(f.read(), disaster_size))
+        except Exception:
+            errors += 1
+            continue
+        labels.append(class_names.index(label))
+    return decoded, np.array(labels, dtype=np.int64), errors
+
+def percentiles(values) -> dict:
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {}
+    return {
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p90": round(float(np.percentile(values, 90)), 4),
+        "p95": round(float(np.percentile(values, 95)), 4),
+        "p99": round(float(np.percentile(values, 99)), 4),
+        "max": round(float(values.max()), 4)
+    }
+
+def confusion(labels: np.ndarray, predicted: np.ndarray, num_classes: int) -> np.ndarray:
+    matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(matrix, (labels, predicted), 1)
+    return matrix
+
+def evaluate_variant(predict, arrays: list, labels: np.ndarray, class_names: list, args) -> tuple:
+    """Time and score one variant. Returns (result dict, probabilities)"""
+    import torch
+    from damage_model import calculate_accuracy
+
+    # Warm up once so one-off graph building does not count as latency
+    predict(arrays[:args.batch_size])
+
+    start = time.perf_counter()
+    probs = np.concatenate([
+        np.asarray(predict(arrays[i:i + args.batch_size]), dtype=np.float32)
+        for i in range(0, len(arrays), args.batch_size)
+    ])
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for array in arrays[:args.latency_samples]:
+        t0 = time.perf_counter()
+        predict([array])
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    probs = probs[:, :len(class_names)]
+    predicted = probs.argmax(axis=1)
+    matrix = confusion(labels, predicted, len(class_names))
+    per_class = {}
+    for i, name in enumerate(class_names):
+        support = int(matrix[i].sum())
+        predicted_count = int(matrix[:, i].sum())
+        per_class[name] = {
+            "support": support,
+            "recall": round(matrix[i, i] / support, 4) if support else None,
+            "precision": round(matrix[i, i] / predicted_count, 4) if predicted_count else None
+        }
+
+    result = {
+        "images": len(labels),
+        "accuracy": round(calculate_accuracy(torch.from_numpy(probs), torch.from_numpy(labels)), 6),
+        "confusion_matrix": matrix.tolist(),
+        "per_class": per_class,
+        "throughput_images_per_s": round(len(labels) / elapsed, 2) if elapsed else None,
+        "batch_size": args.batch_size,
+        "latency_ms": percentiles(latencies)
+    }
+    return result, probs
+
+def run(args) -> dict:
+    import fastapi_backend as backend
+
+    names = args.variants or list(VARIANTS)
+    unknown = [name for name in names if name not in VARIANTS]
+    if unknown:
+        print(f"❌ Unknown variants: {unknown}. Registered: {list(VARIANTS)}")
+        sys.exit(2)
+
+    class_names = {"disaster": backend.DISASTER_CLASSES, "damage": backend.DAMAGE_CLASSES}
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "images_root": os.path.abspath(args.images),
+        "class_names": class_names,
+        "variants": {}
+    }
+    datasets = {}
+    references = {}
+
+    for name in names:
+        kind = VARIANTS[name]["kind"]
+        entry = {"kind": kind, "description": VARIANTS[name]["description"]}
+        report["variants"][name] = entry
+        print(f"\n▶ {name}: {entry['description']}")
+
+        try:
+            predict = VARIANTS[name]["factory"](args, backend)
+        except VariantUnavailable as e:
+            entry["status"] = "unavailable"
+            entry["reason"] = str(e)
+            print(f"  ⏭ Skipped: {e}")
+            continue
+        except Exception as e:
+            entry["status"] = "error"
+            entry["reason"] = str(e)
+            print(f"  ✗ Failed to load: {e}")
+            continue
+
+        # Decode once per model kind with the service's own preprocessing
+        if kind not in datasets:
+            datasets[kind] = load_labeled(args.images, class_names[kind],
+                                          backend.DISASTER_MODEL_INPUT_SIZE, args.limit)
+            print(f"  📁 {len(datasets[kind][1])} labeled {kind} images ({datasets[kind][2]} unreadable)")
+        decoded, labels, _ = datasets[kind]
+        if not len(labels):
+            entry["status"] = "unavailable"
+            entry["reason"] = f"no images in {class_names[kind]} folders"
+            print(f"  ⏭ Skipped: {entry['reason']}")
+            continue
+
+        column = 0 if kind == "disaster" else 1
+        try:
+            result, probs = evaluate_variant(predict, [d[column] for d in decoded], labels, class_names[kind], args)
+        except Exception as e:
+            entry["status"] = "error"
+            entry["reason"] = str(e)
+            print(f"  ✗ Evaluation failed: {e}")
+            continue
+
+        entry.update(result)
+        entry["status"] = "ok"
+        reference = references.setdefault(kind, (name, probs, result["accuracy"]))
+        entry["reference"] = reference[0]
+        entry["agreement_with_reference"] = round(float((probs.argmax(1) == reference[1].argmax(1)).mean()), 6)
+        entry["accuracy_delta_pts"] = round((result["accuracy"] - reference[2]) * 100, 4)
+        print(f"  accuracy {result['accuracy'] * 100:.2f}% ({entry['accuracy_delta_pts']:+.2f} pts vs {reference[0]}) | "
+              f"agreement {entry['agreement_with_reference'] * 100:.2f}% | "
+              f"p50 {result['latency_ms'].get('p50', 0):.2f} ms | p95 {result['latency_ms'].get('p95', 0):.2f} ms | "
+              f"{result['throughput_images_per_s']} img/s")
+
+    return report
+
+def apply_gates(report: dict, args) -> list:
+    """Mark each variant pass/fail against the gates and return the failures.
+    With any gate set, a variant that could not be evaluated fails with its status as the reason."""
+    gating = args.max_accuracy_drop is not None or args.max_p95_ms is not None
+    failures = []
+    for name, entry in report["variants"].items():
+        if entry.get("status") != "ok":
+            if gating:
+                reasons = [f"{entry.get('status', 'not evaluated')}: {entry.get('reason', 'no result')}"]
+                entry["gate"] = {"passed": False, "reasons": reasons}
+                failures.append((name, reasons))
+            continue
+        reasons = []
+        if args.max_accuracy_drop is not None and -entry["accuracy_delta_pts"] > args.max_accuracy_drop:
+            reasons.append(f"accuracy {entry['accuracy_delta_pts']:+.2f} pts vs {entry['reference']}")
+        p95 = entry["latency_ms"].get("p95")
+        if args.max_p95_ms is not None and p95 is not None and p95 > args.max_p95_ms:
+            reasons.append(f"p95 latency {p95:.2f} ms > {args.max_p95_ms} ms")
+        entry["gate"] = {"passed": not reasons, "reasons": reasons}
+        if reasons:
+            failures.append((name, reasons))
+    report["gates"] = {
+        "max_accuracy_drop_pts": args.max_accuracy_drop,
+        "max_p95_ms": args.max_p95_ms,
+        "passed": not failures
+    }
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy vs latency evaluation of model variants")
+    parser.add_argument("images", help="Labeled folder: <Class>/<image> with disaster and/or damage class names")
+    parser.add_argument("--variants", nargs="+", default=None,
+                        help="Variants to evaluate (default: all). The first of each kind is the reference")
+    parser.add_argument("--list", action="store_true", help="List registered variants and exit")
+    parser.add_argument("--output", default="evaluation.json", help="JSON report path (default: evaluation.json)")
+    parser.add_argument("--disaster-model", default="disaster.h5")
+    parser.add_argument("--damage-model", default="best_damage.pth")
+    parser.add_argument("--pruned-damage-model", default="best_damage_pruned.pth")
+    parser.add_argument("--damage-onnx", default="best_damage.onnx")
+    parser.add_argument("--batch-size", type=int, default=32, help="Batch size for the throughput pass")
+    parser.add_argument("--latency-samples", type=int, default=200, help="Images timed one at a time")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum labeled images per model kind")
+    parser.add_argument("--max-accuracy-drop", type=float, default=None,
+                        help="Fail if a variant loses more than this many accuracy points vs its reference")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="Fail if batch-1 p95 latency exceeds this")
+
+    args = parser.parse_args()
+
+    if args.list:
+        for name, variant in VARIANTS.items():
+            print(f"{name:22s} {variant['kind']:9s} {variant['description']}")
+        return
+
+    if not os.path.isdir(args.images):
+        print(f"❌ Folder not found: {args.images}")
+        sys.exit(2)
+
+    report = run(args)
+    failures = apply_gates(report, args)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Report written to {args.output}")
+
+    if failures:
+        for name, reasons in failures:
+            print(f"❌ {name}: {'; '.join(reasons)}")
+        sys.exit(1)
+    if args.max_accuracy_drop is not None or args.max_p95_ms is not None:
+        print("✅ All variants pass the gates")
+
+if __name__ == "__main__":
+    main()
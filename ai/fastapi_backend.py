@@ -1,17 +1,47 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import numpy as np
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
 import torch
-from torchvision import transforms
 import os
-import io
 from PIL import Image
 import uvicorn
 from typing import Dict, List, Optional
-from damage_model import create_damage_model
+from damage_weights import build_damage_model
+from precision import resolve_precision, convert_keras_model, torch_autocast
+from thread_config import apply_thread_config
+from model_cache import (
+    CacheEntry, cache_enabled, load_damage_artifact, store_damage_artifact,
+    load_disaster_artifact, store_disaster_artifact
+)
+from request_profiler import ProfileMiddleware, profiling_active, profiling_enabled
+from preprocessing import (
+    load_rgb_image, resize_for_disaster, resize_for_damage,
+    decode_for_models, disaster_input, damage_input
+)
+from serialization import negotiate, render, pack_probabilities, RESPONSE_LAYOUTS
+from archive_ingest import QueueReader, iter_archive, ARCHIVE_CONTENT_TYPES, ARCHIVE_FORMATS
+import asyncio
+import tempfile
+from video_analysis import analyze_frames, iter_video_frames, iter_sequence_frames
+from replica_pool import ReplicaPool, ReplicaError, REPLICAS, REPLICA_CORES
+from model_registry import ModelRegistry, parse_spec, MODEL_REGISTRY_FILE
+from traffic_capture import TrafficCaptureMiddleware, TrafficCapture, capture_enabled
+from inference_pipeline import (
+    InferencePipeline, PipelineStage, StageError, PIPELINE_ENABLED, PIPELINE_DECODE_WORKERS,
+    PIPELINE_INFER_WORKERS, PIPELINE_QUEUE_SIZE, PIPELINE_BATCH_SIZE, PIPELINE_BATCH_WAIT_MS
+)
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from runtime_stats import process_stats, start_tracing
+from similarity_index import SimilarityIndex
+
+# Size the TensorFlow and PyTorch thread pools together before either runs an op
+THREAD_CONFIG = apply_thread_config()
+
+# Allocation tracing for soak tests (RUNTIME_TRACEMALLOC=<frames>; off by default)
+start_tracing()
 
 app = FastAPI(title="Disaster Detection & Damage Assessment API", version="2.0.0")
 
@@ -24,68 +54,222 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Sampled traffic capture for replay_traffic.py (off unless CAPTURE_DIR is set)
+TRAFFIC_CAPTURE = TrafficCapture() if capture_enabled() else None
+if TRAFFIC_CAPTURE is not None:
+    app.add_middleware(TrafficCaptureMiddleware, capture=TRAFFIC_CAPTURE)
+    print(f"Capturing {TRAFFIC_CAPTURE.sample_rate:.0%} of requests to {TRAFFIC_CAPTURE.log_path}")
+
+# Per-request profiling for admins (installed only when PROFILE_TOKEN is set)
+if profiling_enabled():
+    app.add_middleware(ProfileMiddleware)
+
 # Global variables for disaster detection
 DISASTER_MODEL = None
 DISASTER_CLASSES = ["Cyclone", "Earthquake", "Flood", "Wildfire"]
 DISASTER_MODEL_INPUT_SIZE = (64, 64)  # Default size
+DISASTER_PRECISION = "fp32"
 
 # Global variables for damage assessment
 DAMAGE_MODEL = None
 DAMAGE_CLASSES = ["No-damage", "Minor-damage", "Major-damage", "Destroyed"]
 DAMAGE_DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+DAMAGE_PRECISION = "fp32"
+DAMAGE_MODEL_PATH = os.environ.get("DAMAGE_MODEL_PATH", "best_damage.pth")  # e.g. best_damage.weights.pt
+# Serve memory-mapped checkpoint weights (shared page cache) instead of the frozen artifact (faster, private copy)
+DAMAGE_MMAP_WEIGHTS = os.environ.get("DAMAGE_MMAP_WEIGHTS", "1").lower() not in ("0", "false", "no")
 
-def load_disaster_model(model_path: str = "disaster.h5"):
-    """Load the disaster detection model"""
-    global DISASTER_MODEL, DISASTER_MODEL_INPUT_SIZE
-    
+# Archive ingestion settings for /predict-archive
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "64"))
+ARCHIVE_MAX_MEMBERS = int(os.environ.get("ARCHIVE_MAX_MEMBERS", "20000"))
+ARCHIVE_QUEUE_CHUNKS = int(os.environ.get("ARCHIVE_QUEUE_CHUNKS", "16"))
+ARCHIVE_WORKERS = int(os.environ.get("ARCHIVE_WORKERS", "2"))  # archives parsed and scored at once
+# Archive scorers block on their upload, so they get their own threads instead of the default executor
+ARCHIVE_EXECUTOR = ThreadPoolExecutor(ARCHIVE_WORKERS, thread_name_prefix="archive")
+
+# Video analysis defaults for /analyze-video (overridable per request)
+VIDEO_SAMPLE_FPS = float(os.environ.get("VIDEO_SAMPLE_FPS", "2.0"))
+VIDEO_CHANGE_THRESHOLD = float(os.environ.get("VIDEO_CHANGE_THRESHOLD", "0.04"))
+VIDEO_MAX_SKIP_SECONDS = float(os.environ.get("VIDEO_MAX_SKIP_SECONDS", "10.0"))
+VIDEO_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", "32"))
+VIDEO_MAX_BYTES = int(os.environ.get("VIDEO_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Cascade defaults for /predict-both (overridable per request)
+CASCADE_POLICIES = ["disaster-first", "damage-first"]
+CASCADE_MIN_DISASTER_CONFIDENCE = float(os.environ.get("CASCADE_MIN_DISASTER_CONFIDENCE", "0.5"))
+CASCADE_NO_DAMAGE_CONFIDENCE = float(os.environ.get("CASCADE_NO_DAMAGE_CONFIDENCE", "0.9"))
+
+# Model replica processes (REPLICAS > 0); None means models run in this process
+REPLICA_POOL = None
+
+# Decode -> infer pipeline for in-process serving (see inference_pipeline.py)
+INFERENCE_PIPELINE = None
+
+# DamageCNN embedding index for /similar (lives in this process, also with replicas)
+EMBEDDING_INDEX = None
+EMBEDDING_INDEX_PATH = os.environ.get("EMBEDDING_INDEX_PATH")  # e.g. embeddings.npz; in memory only if unset
+EMBEDDING_INDEX_DTYPE = os.environ.get("EMBEDDING_INDEX_DTYPE", "float32")  # or "int8" (a quarter of the memory)
+EMBEDDING_INDEX_NLIST = int(os.environ.get("EMBEDDING_INDEX_NLIST", "0"))  # IVF lists; 0 = exact search
+EMBEDDING_INDEX_NPROBE = int(os.environ.get("EMBEDDING_INDEX_NPROBE", "8"))
+EMBED_MAX_FILES = int(os.environ.get("EMBED_MAX_FILES", "64"))
+
+def prepare_disaster_model(model_path: str, precision: Optional[str] = None):
+    """Load a disaster model without installing it. Returns (model, precision, input_size)"""
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Disaster model file not found: {model_path}")
     
-    DISASTER_MODEL = load_model(model_path)
+    resolved = resolve_precision(precision or os.environ.get("DISASTER_PRECISION", "fp32"), "cpu")
+    
+    # Reuse the converted model from the artifact cache when the weights are unchanged
+    entry = CacheEntry("disaster", model_path, resolved) if cache_enabled() else None
+    model = None
+    if entry is not None and entry.exists():
+        try:
+            model = load_disaster_artifact(entry)
+            entry.touch()
+            print(f"Disaster model loaded from artifact cache: {entry.artifact_path}")
+        except Exception as e:
+            print(f"⚠ Warning: Ignoring unreadable disaster model artifact: {e}")
+    if model is None:
+        model = convert_keras_model(load_model(model_path), resolved)
+        if entry is not None:
+            try:
+                store_disaster_artifact(entry, model)
+            except Exception as e:
+                print(f"⚠ Warning: Could not cache disaster model artifact: {e}")
     
     # Get the model's expected input size
-    inp = DISASTER_MODEL.input_shape
+    input_size = DISASTER_MODEL_INPUT_SIZE
+    inp = model.input_shape
     if inp and len(inp) == 4 and inp[1] and inp[2]:
-        DISASTER_MODEL_INPUT_SIZE = (inp[1], inp[2])
+        input_size = (inp[1], inp[2])
+    return model, resolved, input_size
+
+def load_disaster_model(model_path: str = "disaster.h5", precision: Optional[str] = None):
+    """Load the disaster detection model (precision defaults to $DISASTER_PRECISION or fp32)"""
+    global DISASTER_MODEL, DISASTER_MODEL_INPUT_SIZE, DISASTER_PRECISION
+    
+    DISASTER_MODEL, DISASTER_PRECISION, DISASTER_MODEL_INPUT_SIZE = prepare_disaster_model(model_path, precision)
     
     print(f"Disaster model loaded successfully. Input shape: {DISASTER_MODEL.input_shape}")
     print(f"Using input size: {DISASTER_MODEL_INPUT_SIZE}")
+    print(f"Using precision: {DISASTER_PRECISION}")
 
-def load_damage_model(model_path: str = "best_damage.pth"):
-    """Load the damage assessment model"""
-    global DAMAGE_MODEL
-    
+def prepare_damage_model(model_path: str, precision: Optional[str] = None):
+    """Load a damage model without installing it. Returns (model, precision)"""
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Damage model file not found: {model_path}")
     
-    DAMAGE_MODEL = create_damage_model().to(DAMAGE_DEVICE)
-    checkpoint = torch.load(model_path, map_location=DAMAGE_DEVICE)
-    DAMAGE_MODEL.load_state_dict(checkpoint['model_state_dict'])
-    DAMAGE_MODEL.eval()
+    resolved = resolve_precision(precision or os.environ.get("DAMAGE_PRECISION", "fp32"), DAMAGE_DEVICE.type)
+    
+    model, mapped = None, False
+    if DAMAGE_MMAP_WEIGHTS:
+        # Memory-mapped weights are served as is so processes share the file's pages;
+        # a frozen artifact would copy them, so the artifact cache is skipped for them
+        model, mapped = build_damage_model(model_path, DAMAGE_DEVICE)
+        # Weights copied to a GPU no longer share host pages
+        mapped = mapped and DAMAGE_DEVICE.type == "cpu"
+        if mapped:
+            print(f"Damage model weights memory-mapped from: {model_path} (artifact cache not used)")
+    
+    # Otherwise reuse the frozen TorchScript module from the artifact cache when the weights are unchanged
+    entry = CacheEntry("damage", model_path, resolved, DAMAGE_DEVICE.type) if cache_enabled() and not mapped else None
+    cached = False
+    if entry is not None and entry.exists():
+        try:
+            model = load_damage_artifact(entry, DAMAGE_DEVICE)
+            entry.touch()
+            cached = True
+            print(f"Damage model loaded from artifact cache: {entry.artifact_path}")
+        except Exception as e:
+            print(f"⚠ Warning: Ignoring unreadable damage model artifact: {e}")
+    if not cached:
+        if model is None:
+            # Pruned checkpoints carry their widths
+            model, _ = build_damage_model(model_path, DAMAGE_DEVICE)
+        if entry is not None:
+            try:
+                model = store_damage_artifact(entry, model)
+            except Exception as e:
+                print(f"⚠ Warning: Could not cache damage model artifact: {e}")
+    # Weights stay in fp32; predict_damage_probs runs the forward pass under autocast
+    model.inference_precision = resolved
+    return model, resolved
+
+def load_damage_model(model_path: str = DAMAGE_MODEL_PATH, precision: Optional[str] = None):
+    """Load the damage assessment model (precision defaults to $DAMAGE_PRECISION or fp32)"""
+    global DAMAGE_MODEL, DAMAGE_PRECISION
+    
+    DAMAGE_MODEL, DAMAGE_PRECISION = prepare_damage_model(model_path, precision)
     
     print(f"Damage model loaded successfully from: {model_path}")
     print(f"Using device: {DAMAGE_DEVICE}")
+    print(f"Using precision: {DAMAGE_PRECISION}")
+
+def registry_disaster_loader(model_path: str, precision: Optional[str]):
+    model, resolved, input_size = prepare_disaster_model(model_path, precision)
+    return model, {"precision": resolved, "input_size": input_size}
+
+def registry_damage_loader(model_path: str, precision: Optional[str]):
+    model, resolved = prepare_damage_model(model_path, precision)
+    return model, {"precision": resolved}
+
+# Named, versioned models that load on first use (see model_registry.py)
+MODEL_REGISTRY = ModelRegistry({"disaster": registry_disaster_loader, "damage": registry_damage_loader})
+if os.path.exists(MODEL_REGISTRY_FILE):
+    try:
+        print(f"Registered {MODEL_REGISTRY.load_manifest(MODEL_REGISTRY_FILE)} models from {MODEL_REGISTRY_FILE}")
+    except Exception as e:
+        print(f"⚠ Warning: Could not read model registry {MODEL_REGISTRY_FILE}: {e}")
+
+def check_model_spec(kind: str, spec: Optional[str]):
+    """Reject an unknown registry model with 404 before any work is done"""
+    if spec is None or spec == "default":
+        return
+    try:
+        MODEL_REGISTRY.lookup(kind, *parse_spec(spec))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+def resolve_model(kind: str, spec: Optional[str]):
+    """Return (model, info) for a registry model; (None, {}) selects the default model"""
+    if spec is None or spec == "default":
+        return None, {}
+    try:
+        return MODEL_REGISTRY.get(kind, spec)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+def model_status() -> Dict:
+    """Loaded models, input size and precision (as reported by a replica when a pool is running)"""
+    if REPLICA_POOL is not None:
+        status = REPLICA_POOL.status()
+        return {key: status.get(key) for key in (
+            "disaster_model_loaded", "damage_model_loaded", "disaster_model_input_size",
+            "disaster_precision", "damage_precision"
+        )}
+    return {
+        "disaster_model_loaded": DISASTER_MODEL is not None,
+        "damage_model_loaded": DAMAGE_MODEL is not None,
+        "disaster_model_input_size": DISASTER_MODEL_INPUT_SIZE,
+        "disaster_precision": DISASTER_PRECISION,
+        "damage_precision": DAMAGE_PRECISION
+    }
 
-def preprocess_image_for_disaster(image_bytes: bytes) -> np.ndarray:
+def reload_model(kind: str, model_path: str, precision: Optional[str] = None) -> Dict:
+    """Load or reload one model and return the resulting model status"""
+    if kind == "disaster":
+        load_disaster_model(model_path, precision)
+    else:
+        load_damage_model(model_path, precision)
+    return model_status()
+
+def preprocess_image_for_disaster(image_bytes: bytes, input_size=None) -> np.ndarray:
     """Preprocess the uploaded image for disaster model prediction"""
     try:
-        # Convert bytes to PIL Image
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to RGB if necessary
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize to model's expected size
-        img = img.resize(DISASTER_MODEL_INPUT_SIZE)
-        
-        # Convert to array and normalize
-        img_array = np.array(img).astype("float32") / 255.0
-        
-        # Add batch dimension
-        img_array = np.expand_dims(img_array, 0)
-        
-        return img_array
+        # Decode, resize to model's expected size and normalize with a batch dimension
+        img = load_rgb_image(image_bytes)
+        return disaster_input([resize_for_disaster(img, input_size or DISASTER_MODEL_INPUT_SIZE)])
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image for disaster detection: {str(e)}")
@@ -93,19 +277,10 @@ def preprocess_image_for_disaster(image_bytes: bytes) -> np.ndarray:
 def preprocess_image_for_damage(image_bytes: bytes) -> torch.Tensor:
     """Preprocess the uploaded image for damage model prediction"""
     try:
-        # Convert bytes to PIL Image
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        
-        # PyTorch transforms for damage model
-        transform = transforms.Compose([
-            transforms.Resize((64, 64)),
-            transforms.ToTensor()
-        ])
-        
-        # Apply transforms and add batch dimension
-        img_tensor = transform(img).unsqueeze(0).to(DAMAGE_DEVICE)
-        
-        return img_tensor
+        # Same result as transforms.Resize((64, 64)) followed by transforms.ToTensor()
+        img = load_rgb_image(image_bytes)
+        batch = damage_input([resize_for_damage(img)])
+        return torch.from_numpy(batch).to(DAMAGE_DEVICE)
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image for damage assessment: {str(e)}")
@@ -115,66 +290,78 @@ def softmax(v: np.ndarray) -> np.ndarray:
     e = np.exp(v - np.max(v))
     return e / e.sum()
 
-def make_disaster_prediction(img_array: np.ndarray) -> Dict:
-    """Make disaster prediction using the loaded model"""
-    if DISASTER_MODEL is None:
+def format_prediction(probs: np.ndarray, class_names: List[str], top_k: Optional[int] = None) -> Dict:
+    """Build the prediction dict for one row of class probabilities"""
+    top_idx = int(np.argmax(probs))
+    predicted_class = class_names[top_idx] if top_idx < len(class_names) else f"class_{top_idx}"
+    
+    # Create probability dictionary (classes the model does not output get 0.0)
+    values = np.asarray(probs).tolist()
+    values += [0.0] * (len(class_names) - len(values))
+    if top_k is None:
+        probabilities = dict(zip(class_names, values))
+    else:
+        probabilities = {
+            class_names[i]: values[i] for i in np.argsort(-np.asarray(probs))[:top_k] if i < len(class_names)
+        }
+    
+    return {
+        "predicted_class": predicted_class,
+        "confidence": values[top_idx],
+        "probabilities": probabilities
+    }
+
+def predict_disaster_probs(img_batch: np.ndarray, model=None) -> np.ndarray:
+    """Run the disaster model on an NHWC batch and return an (N, classes) probability array"""
+    model = model if model is not None else DISASTER_MODEL
+    if model is None:
         raise HTTPException(status_code=500, detail="Disaster model not loaded")
     
-    try:
-        # Get model predictions
-        preds = DISASTER_MODEL.predict(img_array)
-        preds = preds.flatten()
-        
-        # Convert to probabilities if needed
-        if preds.max() > 1.0 or preds.min() < 0.0 or not np.isclose(preds.sum(), 1.0):
-            probs = softmax(preds)
+    preds = np.asarray(model.predict(img_batch, verbose=0), dtype=np.float32)
+    preds = preds.reshape(len(img_batch), -1)
+    
+    # Convert to probabilities if needed
+    probs = np.empty(preds.shape, dtype=np.float64)
+    for i, row in enumerate(preds):
+        if row.max() > 1.0 or row.min() < 0.0 or not np.isclose(row.sum(), 1.0):
+            probs[i] = softmax(row)
         else:
-            probs = preds / preds.sum()
-        
-        # Get the top prediction
-        top_idx = int(np.argmax(probs))
-        predicted_class = DISASTER_CLASSES[top_idx] if top_idx < len(DISASTER_CLASSES) else f"class_{top_idx}"
-        confidence = float(probs[top_idx])
-        
-        # Create probability dictionary
-        probabilities = {}
-        for i, class_name in enumerate(DISASTER_CLASSES):
-            prob = float(probs[i]) if i < len(probs) else 0.0
-            probabilities[class_name] = prob
-        
-        return {
-            "predicted_class": predicted_class,
-            "confidence": confidence,
-            "probabilities": probabilities
-        }
+            probs[i] = row / row.sum()
+    return probs
+
+def predict_damage_probs(img_batch: torch.Tensor, model=None) -> np.ndarray:
+    """Run the damage model on an NCHW batch and return an (N, classes) probability array"""
+    model = model if model is not None else DAMAGE_MODEL
+    if model is None:
+        raise HTTPException(status_code=500, detail="Damage model not loaded")
+    
+    precision = getattr(model, "inference_precision", "fp32")
+    with torch.no_grad(), torch_autocast(precision, DAMAGE_DEVICE.type):
+        outputs = model(img_batch.to(DAMAGE_DEVICE))
+    return torch.softmax(outputs.float(), dim=1).cpu().numpy()
+
+def make_disaster_prediction(img_array: np.ndarray, model=None) -> Dict:
+    """Make disaster prediction using the loaded (or the given) model"""
+    model = model if model is not None else DISASTER_MODEL
+    if model is None:
+        raise HTTPException(status_code=500, detail="Disaster model not loaded")
+    
+    try:
+        probs = predict_disaster_probs(img_array, model)[0]
+        return format_prediction(probs, DISASTER_CLASSES)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error making disaster prediction: {str(e)}")
 
-def make_damage_prediction(img_tensor: torch.Tensor) -> Dict:
-    """Make damage assessment prediction using the loaded model"""
-    if DAMAGE_MODEL is None:
+def make_damage_prediction(img_tensor: torch.Tensor, model=None) -> Dict:
+    """Make damage assessment prediction using the loaded (or the given) model"""
+    model = model if model is not None else DAMAGE_MODEL
+    if model is None:
         raise HTTPException(status_code=500, detail="Damage model not loaded")
     
     try:
-        with torch.no_grad():
-            outputs = DAMAGE_MODEL(img_tensor)
-            probs = torch.softmax(outputs, dim=1).cpu().numpy()[0]
-            pred_idx = int(probs.argmax())
-            predicted_class = DAMAGE_CLASSES[pred_idx]
-            confidence = float(probs[pred_idx])
-            
-            # Create probability dictionary
-            probabilities = {}
-            for i, class_name in enumerate(DAMAGE_CLASSES):
-                prob = float(probs[i]) if i < len(probs) else 0.0
-                probabilities[class_name] = prob
-            
-            return {
-                "predicted_class": predicted_class,
-                "confidence": confidence,
-                "probabilities": probabilities
-            }
+        probs = predict_damage_probs(img_tensor, model)[0]
+        return format_prediction(probs, DAMAGE_CLASSES)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error making damage prediction: {str(e)}")
@@ -182,6 +369,20 @@ def make_damage_prediction(img_tensor: torch.Tensor) -> Dict:
 @app.on_event("startup")
 async def startup_event():
     """Load both models when the app starts"""
+    global REPLICA_POOL, DISASTER_MODEL_INPUT_SIZE, INFERENCE_PIPELINE
+    load_embedding_index()
+
+    if REPLICAS > 0:
+        # Models live in the replica processes; this process only routes requests
+        loop = asyncio.get_running_loop()
+        REPLICA_POOL = await loop.run_in_executor(None, ReplicaPool(REPLICAS, REPLICA_CORES, damage_model_path=DAMAGE_MODEL_PATH).start)
+        DISASTER_MODEL_INPUT_SIZE = tuple(REPLICA_POOL.status()["disaster_model_input_size"])
+        print(f"✓ {REPLICAS} model replicas running")
+        return
+    
+    if PIPELINE_ENABLED:
+        INFERENCE_PIPELINE = create_inference_pipeline().start()
+    
     try:
         load_disaster_model()
         print("✓ Disaster detection model loaded successfully")
@@ -197,13 +398,25 @@ async def startup_event():
     if DISASTER_MODEL is None and DAMAGE_MODEL is None:
         print("⚠ Warning: No models loaded. Use /load-models endpoint to load them manually")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the model replicas and the inference pipeline"""
+    if REPLICA_POOL is not None:
+        REPLICA_POOL.close()
+    if INFERENCE_PIPELINE is not None:
+        INFERENCE_PIPELINE.close()
+    if EMBEDDING_INDEX_PATH and EMBEDDING_INDEX is not None and EMBEDDING_INDEX.size:
+        EMBEDDING_INDEX.save(EMBEDDING_INDEX_PATH)
+        print(f"✓ Saved {EMBEDDING_INDEX.size} embeddings to {EMBEDDING_INDEX_PATH}")
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
+    status = model_status()
     return {
         "message": "Disaster Detection & Damage Assessment API is running",
-        "disaster_model_loaded": DISASTER_MODEL is not None,
-        "damage_model_loaded": DAMAGE_MODEL is not None,
+        "disaster_model_loaded": status["disaster_model_loaded"],
+        "damage_model_loaded": status["damage_model_loaded"],
         "disaster_classes": DISASTER_CLASSES,
         "damage_classes": DAMAGE_CLASSES
     }
@@ -211,47 +424,111 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Detailed health check"""
+    status = model_status()
     return {
         "status": "healthy",
-        "disaster_model_loaded": DISASTER_MODEL is not None,
-        "damage_model_loaded": DAMAGE_MODEL is not None,
-        "disaster_model_input_size": DISASTER_MODEL_INPUT_SIZE,
+        "disaster_model_loaded": status["disaster_model_loaded"],
+        "damage_model_loaded": status["damage_model_loaded"],
+        "disaster_model_input_size": status["disaster_model_input_size"],
         "damage_device": str(DAMAGE_DEVICE),
+        "disaster_precision": status["disaster_precision"],
+        "damage_precision": status["damage_precision"],
+        "thread_config": THREAD_CONFIG,
+        "replicas": REPLICA_POOL.stats() if REPLICA_POOL is not None else None,
+        "pipeline": INFERENCE_PIPELINE.stats() if INFERENCE_PIPELINE is not None else None,
         "supported_disaster_classes": DISASTER_CLASSES,
         "supported_damage_classes": DAMAGE_CLASSES
     }
 
+@app.get("/models")
+async def list_models():
+    """Default models plus registry residency and load statistics (per replica when a pool is running)"""
+    status = model_status()
+    if REPLICA_POOL is None:
+        registry = MODEL_REGISTRY.stats()
+    else:
+        registry = {"replicas": await REPLICA_POOL.broadcast_async("registry_stats")}
+    return {
+        "default": {
+            "disaster": {"loaded": status["disaster_model_loaded"], "precision": status["disaster_precision"]},
+            "damage": {"loaded": status["damage_model_loaded"], "precision": status["damage_precision"]}
+        },
+        "registry": registry
+    }
+
+def runtime_snapshot(include_objects: bool = False, top_allocations: int = 0) -> Dict:
+    """process_stats() plus the size of this process's model registry"""
+    stats = process_stats(include_objects, top_allocations)
+    registry = MODEL_REGISTRY.stats()
+    stats["registry_resident_mb"] = registry["resident_mb"]
+    stats["registry_resident_models"] = sum(1 for model in registry["models"] if model["resident"])
+    return stats
+
+@app.get("/runtime-stats")
+async def runtime_stats(objects: bool = False, top: int = 0):
+    """
+    Memory, file descriptor, thread and Python heap statistics (per replica when a pool is running)
+    
+    Args:
+        objects: Also count GC-tracked objects (slow on a large heap)
+        top: Include the N source lines with the most allocation growth (needs RUNTIME_TRACEMALLOC)
+    """
+    loop = asyncio.get_running_loop()
+    process = await loop.run_in_executor(None, runtime_snapshot, objects, top)
+    replicas = None
+    if REPLICA_POOL is not None:
+        replicas = await REPLICA_POOL.broadcast_async("runtime_stats", objects, top)
+    pipeline_queued = None
+    if INFERENCE_PIPELINE is not None:
+        pipeline_queued = sum(stage.queue.qsize() for stage in INFERENCE_PIPELINE.stages)
+    return {"process": process, "replicas": replicas, "pipeline_queued": pipeline_queued}
+
+async def reload_everywhere(kind: str, model_path: str, precision: Optional[str]) -> Dict:
+    """Reload a model in this process, or in every replica when a pool is running"""
+    global DISASTER_MODEL_INPUT_SIZE
+    if REPLICA_POOL is None:
+        return reload_model(kind, model_path, precision)
+    statuses = await REPLICA_POOL.broadcast_async("reload_model", kind, model_path, precision)
+    for replica, status in zip([r for r in REPLICA_POOL.replicas if r.alive], statuses):
+        replica.status.update(status)
+    # Archive and video frames are resized here before being sent to the replicas
+    DISASTER_MODEL_INPUT_SIZE = tuple(statuses[0]["disaster_model_input_size"])
+    return statuses[0]
+
 @app.post("/load-disaster-model")
-async def load_disaster_model_endpoint(model_path: str = "disaster.h5"):
+async def load_disaster_model_endpoint(model_path: str = "disaster.h5", precision: Optional[str] = None):
     """Manually load or reload the disaster detection model"""
     try:
-        load_disaster_model(model_path)
+        status = await reload_everywhere("disaster", model_path, precision)
         return {
             "message": "Disaster model loaded successfully",
-            "model_input_size": DISASTER_MODEL_INPUT_SIZE
+            "model_input_size": status["disaster_model_input_size"],
+            "precision": status["disaster_precision"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to load disaster model: {str(e)}")
 
 @app.post("/load-damage-model")
-async def load_damage_model_endpoint(model_path: str = "best_damage.pth"):
+async def load_damage_model_endpoint(model_path: str = DAMAGE_MODEL_PATH, precision: Optional[str] = None):
     """Manually load or reload the damage assessment model"""
     try:
-        load_damage_model(model_path)
+        status = await reload_everywhere("damage", model_path, precision)
         return {
             "message": "Damage model loaded successfully",
-            "device": str(DAMAGE_DEVICE)
+            "device": str(DAMAGE_DEVICE),
+            "precision": status["damage_precision"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to load damage model: {str(e)}")
 
 @app.post("/predict-disaster")
-async def predict_disaster(file: UploadFile = File(...)):
+async def predict_disaster(file: UploadFile = File(...), model: Optional[str] = None):
     """
     Predict disaster type from uploaded image
     
     Args:
         file: Image file (jpg, jpeg, png)
+        model: Registry model as "name" or "name@version" (default: the startup model)
     
     Returns:
         JSON with disaster prediction results
@@ -263,15 +540,17 @@ async def predict_disaster(file: UploadFile = File(...)):
             detail="File must be an image (jpg, jpeg, png)"
         )
     
+    check_model_spec("disaster", model)
+    
     try:
         # Read image bytes
         image_bytes = await file.read()
         
-        # Preprocess image
-        img_array = preprocess_image_for_disaster(image_bytes)
-        
-        # Make prediction
-        result = make_disaster_prediction(img_array)
+        # Preprocess and predict (pipelined, or on the least-loaded replica when a pool is running)
+        if pipeline_enabled() and model is None:
+            result = await pipeline_prediction("disaster", image_bytes)
+        else:
+            result = await dispatch("predict_disaster_bytes", image_bytes, model)
         
         return JSONResponse(content={
             "success": True,
@@ -286,12 +565,13 @@ async def predict_disaster(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Disaster prediction failed: {str(e)}")
 
 @app.post("/predict-damage")
-async def predict_damage(file: UploadFile = File(...)):
+async def predict_damage(file: UploadFile = File(...), model: Optional[str] = None):
     """
     Predict damage level from uploaded image
     
     Args:
         file: Image file (jpg, jpeg, png)
+        model: Registry model as "name" or "name@version" (default: the startup model)
     
     Returns:
         JSON with damage assessment results
@@ -303,15 +583,17 @@ async def predict_damage(file: UploadFile = File(...)):
             detail="File must be an image (jpg, jpeg, png)"
         )
     
+    check_model_spec("damage", model)
+    
     try:
         # Read image bytes
         image_bytes = await file.read()
         
-        # Preprocess image
-        img_tensor = preprocess_image_for_damage(image_bytes)
-        
-        # Make prediction
-        result = make_damage_prediction(img_tensor)
+        # Preprocess and predict (pipelined, or on the least-loaded replica when a pool is running)
+        if pipeline_enabled() and model is None:
+            result = await pipeline_prediction("damage", image_bytes)
+        else:
+            result = await dispatch("predict_damage_bytes", image_bytes, model)
         
         return JSONResponse(content={
             "success": True,
@@ -325,13 +607,96 @@ async def predict_damage(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Damage prediction failed: {str(e)}")
 
+def predict_disaster_bytes(image_bytes: bytes, model_spec: Optional[str] = None) -> Dict:
+    """Decode one image and run disaster detection on it (with a registry model if model_spec is given)"""
+    model, info = resolve_model("disaster", model_spec)
+    result = make_disaster_prediction(preprocess_image_for_disaster(image_bytes, info.get("input_size")), model)
+    if model is not None:
+        result["model"] = info["model"]
+    return result
+
+def predict_damage_bytes(image_bytes: bytes, model_spec: Optional[str] = None) -> Dict:
+    """Decode one image and run damage assessment on it (with a registry model if model_spec is given)"""
+    model, info = resolve_model("damage", model_spec)
+    result = make_damage_prediction(preprocess_image_for_damage(image_bytes), model)
+    if model is not None:
+        result["model"] = info["model"]
+    return result
+
+def run_disaster_stage(image_bytes: bytes, include_probabilities: bool = True,
+                       model_spec: Optional[str] = None) -> Dict:
+    """Run disaster detection for combined analysis, capturing failures in the result"""
+    try:
+        disaster_result = predict_disaster_bytes(image_bytes, model_spec)
+        if not include_probabilities:
+            disaster_result.pop("probabilities")
+        return {
+            "success": True,
+            "prediction": disaster_result
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+def run_damage_stage(image_bytes: bytes, include_probabilities: bool = True,
+                     model_spec: Optional[str] = None) -> Dict:
+    """Run damage assessment for combined analysis, capturing failures in the result"""
+    try:
+        damage_result = predict_damage_bytes(image_bytes, model_spec)
+        if not include_probabilities:
+            damage_result.pop("probabilities")
+        return {
+            "success": True,
+            "prediction": damage_result
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+def cascade_skip_reason(policy: str, first_stage: Dict,
+                        min_disaster_confidence: float, no_damage_confidence: float) -> Optional[str]:
+    """Return why the second cascade stage can be skipped, or None if it must run"""
+    # Never skip on a failed first stage; the second model is all the caller gets
+    if not first_stage["success"]:
+        return None
+    
+    prediction = first_stage["prediction"]
+    if policy == "disaster-first" and prediction["confidence"] < min_disaster_confidence:
+        return (f"disaster confidence {prediction['confidence']:.4f} below "
+                f"min_disaster_confidence {min_disaster_confidence}")
+    if (policy == "damage-first" and prediction["predicted_class"] == "No-damage"
+            and prediction["confidence"] >= no_damage_confidence):
+        return (f"No-damage confidence {prediction['confidence']:.4f} at or above "
+                f"no_damage_confidence {no_damage_confidence}")
+    return None
+
 @app.post("/predict-both")
-async def predict_both(file: UploadFile = File(...)):
+async def predict_both(
+    file: UploadFile = File(...),
+    cascade: Optional[str] = None,  # None, "disaster-first" or "damage-first"
+    min_disaster_confidence: float = CASCADE_MIN_DISASTER_CONFIDENCE,
+    no_damage_confidence: float = CASCADE_NO_DAMAGE_CONFIDENCE,
+    include_probabilities: bool = True,
+    disaster_model: Optional[str] = None,
+    damage_model: Optional[str] = None
+):
     """
     Predict both disaster type and damage level from uploaded image
     
     Args:
         file: Image file (jpg, jpeg, png)
+        cascade: Optional cascade policy. "disaster-first" skips damage assessment when
+            the disaster model is not confident the image shows a disaster scene;
+            "damage-first" skips disaster detection when the image is confidently No-damage
+        min_disaster_confidence: Disaster confidence needed to run damage assessment
+        no_damage_confidence: No-damage confidence at which disaster detection is skipped
+        include_probabilities: Include the full per-class probabilities
+        disaster_model: Registry disaster model as "name" or "name@version"
+        damage_model: Registry damage model as "name" or "name@version"
     
     Returns:
         JSON with both disaster and damage predictions
@@ -343,45 +708,70 @@ async def predict_both(file: UploadFile = File(...)):
             detail="File must be an image (jpg, jpeg, png)"
         )
     
+    if cascade is not None and cascade not in CASCADE_POLICIES:
+        raise HTTPException(status_code=400, detail=f"cascade must be one of {CASCADE_POLICIES}")
+    
+    check_model_spec("disaster", disaster_model)
+    check_model_spec("damage", damage_model)
+    model_specs = {"run_disaster_stage": disaster_model, "run_damage_stage": damage_model}
+    
     try:
         # Read image bytes
         image_bytes = await file.read()
         
-        results = {}
-        
-        # Try disaster prediction
-        try:
-            img_array = preprocess_image_for_disaster(image_bytes)
-            disaster_result = make_disaster_prediction(img_array)
-            results["disaster_detection"] = {
+        if cascade is None:
+            if pipeline_enabled() and disaster_model is None and damage_model is None:
+                # One decode feeds both models
+                results = await pipeline_both_stages(image_bytes, include_probabilities)
+            else:
+                # With a replica pool the two models run on different replicas at the same time
+                disaster_result, damage_result = await asyncio.gather(
+                    dispatch("run_disaster_stage", image_bytes, include_probabilities, disaster_model),
+                    dispatch("run_damage_stage", image_bytes, include_probabilities, damage_model)
+                )
+                results = {
+                    "disaster_detection": disaster_result,
+                    "damage_assessment": damage_result
+                }
+            return JSONResponse(content={
                 "success": True,
-                "prediction": disaster_result
-            }
-        except Exception as e:
-            results["disaster_detection"] = {
-                "success": False,
-                "error": str(e)
-            }
+                "filename": file.filename,
+                "type": "combined_analysis",
+                "results": results
+            })
         
-        # Try damage prediction
-        try:
-            img_tensor = preprocess_image_for_damage(image_bytes)
-            damage_result = make_damage_prediction(img_tensor)
-            results["damage_assessment"] = {
-                "success": True,
-                "prediction": damage_result
-            }
-        except Exception as e:
-            results["damage_assessment"] = {
+        if cascade == "disaster-first":
+            stages = [("disaster_detection", "run_disaster_stage"), ("damage_assessment", "run_damage_stage")]
+        else:
+            stages = [("damage_assessment", "run_damage_stage"), ("disaster_detection", "run_disaster_stage")]
+        
+        (first_name, first_stage), (second_name, second_stage) = stages
+        results = {first_name: await dispatch(first_stage, image_bytes, include_probabilities, model_specs[first_stage])}
+        stages_run = [first_name]
+        
+        skip_reason = cascade_skip_reason(cascade, results[first_name],
+                                          min_disaster_confidence, no_damage_confidence)
+        if skip_reason is None:
+            results[second_name] = await dispatch(second_stage, image_bytes, include_probabilities,
+                                                  model_specs[second_stage])
+            stages_run.append(second_name)
+        else:
+            results[second_name] = {
                 "success": False,
-                "error": str(e)
+                "skipped": True,
+                "error": f"Skipped by cascade: {skip_reason}"
             }
         
         return JSONResponse(content={
             "success": True,
             "filename": file.filename,
             "type": "combined_analysis",
-            "results": results
+            "results": results,
+            "cascade": {
+                "policy": cascade,
+                "stages_run": stages_run,
+                "skip_reason": skip_reason
+            }
         })
     
     except HTTPException:
@@ -389,10 +779,169 @@ async def predict_both(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Combined prediction failed: {str(e)}")
 
+def run_batch_stage(predict, indices: List[int]):
+    """Run one model over the decodable images of a batch. Returns (probs, error)"""
+    if not indices:
+        return np.zeros((0, 0), dtype=np.float32), None
+    try:
+        return predict(), None
+    except Exception as e:
+        return None, str(e)
+
+def predict_stage_arrays(name: str, arrays: List[np.ndarray]) -> np.ndarray:
+    """Run the disaster or damage model on a list of resized uint8 images"""
+    if name == "disaster":
+        return predict_disaster_probs(disaster_input(arrays))
+    return predict_damage_probs(torch.from_numpy(damage_input(arrays)))
+
+def score_images(images: Dict[int, bytes], prediction_type: str):
+    """Decode every image once, then run one batched forward pass per model.
+    Returns (decode_errors, ok, stages) for build_batch_content"""
+    decode_errors = {}
+    decoded = {}
+    for i, image_bytes in images.items():
+        try:
+            decoded[i] = decode_for_models(image_bytes, DISASTER_MODEL_INPUT_SIZE)
+        except Exception as e:
+            decode_errors[i] = str(e)
+    
+    ok = sorted(decoded)
+    stages = {}
+    if prediction_type in ["disaster", "both"]:
+        stages["disaster"] = run_batch_stage(
+            lambda: predict_stage_arrays("disaster", [decoded[i][0] for i in ok]), ok)
+    if prediction_type in ["damage", "both"]:
+        stages["damage"] = run_batch_stage(
+            lambda: predict_stage_arrays("damage", [decoded[i][1] for i in ok]), ok)
+    return decode_errors, ok, stages
+
+def pipeline_stage_names(prediction_type: str) -> tuple:
+    return tuple(name for name in ("disaster", "damage") if prediction_type in (name, "both"))
+
+def pipeline_decode(payloads: List) -> List:
+    """Decode stage: (image bytes, stage names) -> resized uint8 arrays by stage name"""
+    results = []
+    for image_bytes, stage_names in payloads:
+        try:
+            img = load_rgb_image(image_bytes)
+            arrays = {}
+            if "disaster" in stage_names:
+                arrays["disaster"] = resize_for_disaster(img, DISASTER_MODEL_INPUT_SIZE)
+            if "damage" in stage_names:
+                arrays["damage"] = resize_for_damage(img)
+            results.append(arrays)
+        except Exception as e:
+            results.append(e)
+    return results
+
+def pipeline_infer(payloads: List[Dict]) -> List[Dict]:
+    """Inference stage: one forward pass per model over every image in the batch.
+    Each result maps stage name -> (probability row, error)"""
+    results = [{} for _ in payloads]
+    for name in ("disaster", "damage"):
+        rows = [i for i, arrays in enumerate(payloads) if name in arrays]
+        if not rows:
+            continue
+        try:
+            probs = predict_stage_arrays(name, [payloads[i][name] for i in rows])
+            for row, i in enumerate(rows):
+                results[i][name] = (probs[row], None)
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+            for i in rows:
+                results[i][name] = (None, error)
+    return results
+
+def create_inference_pipeline() -> InferencePipeline:
+    return InferencePipeline([
+        PipelineStage("decode", pipeline_decode, PIPELINE_DECODE_WORKERS, PIPELINE_QUEUE_SIZE),
+        PipelineStage("infer", pipeline_infer, PIPELINE_INFER_WORKERS, PIPELINE_QUEUE_SIZE,
+                      PIPELINE_BATCH_SIZE, PIPELINE_BATCH_WAIT_MS)
+    ])
+
+def pipeline_enabled() -> bool:
+    """Whether default-model requests go through INFERENCE_PIPELINE
+    
+    A profiled request is scored in-line instead: the pipeline's worker threads are
+    invisible to the profiler and batch the request with unrelated ones.
+    """
+    return INFERENCE_PIPELINE is not None and not profiling_active()
+
+async def pipeline_score(image_bytes: bytes, stage_names: tuple) -> Dict:
+    """Decode and score one image through INFERENCE_PIPELINE (StageError if it cannot be decoded)"""
+    payload = (image_bytes, stage_names)
+    # Wait for queue space with an awaited backoff; a blocking submit would hold an executor thread
+    delay = 0.001
+    while True:
+        try:
+            future = INFERENCE_PIPELINE.submit(payload, block=False)
+            break
+        except queue.Full:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    return await asyncio.wrap_future(future)
+
+async def pipeline_prediction(name: str, image_bytes: bytes) -> Dict:
+    """predict_disaster_bytes / predict_damage_bytes through the pipeline"""
+    task = "disaster detection" if name == "disaster" else "damage assessment"
+    try:
+        outputs = await pipeline_score(image_bytes, (name,))
+    except StageError as e:
+        raise HTTPException(status_code=400, detail=f"Error processing image for {task}: {str(e)}")
+    probs, error = outputs[name]
+    if error is not None:
+        raise HTTPException(status_code=500, detail=f"Error making {name} prediction: {error}")
+    return format_prediction(probs, DISASTER_CLASSES if name == "disaster" else DAMAGE_CLASSES)
+
+async def pipeline_both_stages(image_bytes: bytes, include_probabilities: bool) -> Dict:
+    """Both /predict-both stage results from a single decode"""
+    try:
+        outputs = await pipeline_score(image_bytes, ("disaster", "damage"))
+    except StageError as e:
+        error = {"success": False, "error": f"Error processing image: {str(e)}"}
+        return {"disaster_detection": dict(error), "damage_assessment": dict(error)}
+    
+    results = {}
+    for name, key in (("disaster", "disaster_detection"), ("damage", "damage_assessment")):
+        probs, error = outputs[name]
+        if error is not None:
+            results[key] = {"success": False, "error": error}
+            continue
+        prediction = format_prediction(probs, DISASTER_CLASSES if name == "disaster" else DAMAGE_CLASSES)
+        if not include_probabilities:
+            prediction.pop("probabilities")
+        results[key] = {"success": True, "prediction": prediction}
+    return results
+
+async def pipeline_score_images(tasks: Dict[int, asyncio.Future]):
+    """Gather pipeline_score tasks into score_images' (decode_errors, ok, stages)"""
+    indices = sorted(tasks)
+    outcomes = await asyncio.gather(*[tasks[i] for i in indices], return_exceptions=True)
+    decode_errors, ok, rows = {}, [], {}
+    for i, outcome in zip(indices, outcomes):
+        if isinstance(outcome, Exception):
+            decode_errors[i] = str(outcome)
+        else:
+            ok.append(i)
+            rows[i] = outcome
+    
+    stages = {}
+    for name in {name for outcome in rows.values() for name in outcome}:
+        errors = [rows[i][name][1] for i in ok if rows[i][name][1] is not None]
+        if errors:
+            # A model failure fails that model's column, as with one batched call
+            stages[name] = (None, errors[0])
+        else:
+            stages[name] = (np.stack([rows[i][name][0] for i in ok]), None)
+    return decode_errors, ok, stages
+
 @app.post("/predict-batch")
 async def predict_batch(
+    request: Request,
     files: List[UploadFile] = File(...),
-    prediction_type: str = "both"  # "disaster", "damage", or "both"
+    prediction_type: str = "both",  # "disaster", "damage", or "both"
+    layout: str = "records",  # "records" or "packed"
+    top_k: Optional[int] = None
 ):
     """
     Predict disaster types and/or damage levels for multiple images
@@ -400,9 +949,12 @@ async def predict_batch(
     Args:
         files: List of image files
         prediction_type: Type of prediction ("disaster", "damage", or "both")
+        layout: "records" for one result object per image, "packed" for class names
+            sent once and one probability row per image
+        top_k: Only return the k most likely classes per image
     
     Returns:
-        JSON with prediction results for each image
+        JSON (or MessagePack, per the Accept header) with prediction results for each image
     """
     if len(files) > 10:  # Limit batch size
         raise HTTPException(status_code=400, detail="Maximum 10 files allowed per batch")
@@ -410,54 +962,517 @@ async def predict_batch(
     if prediction_type not in ["disaster", "damage", "both"]:
         raise HTTPException(status_code=400, detail="prediction_type must be 'disaster', 'damage', or 'both'")
     
-    results = []
+    if layout not in RESPONSE_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of {RESPONSE_LAYOUTS}")
     
-    for file in files:
+    if top_k is not None and top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1")
+    
+    encoding = negotiate(request.headers.get("accept"))
+    
+    pipelined = pipeline_enabled()
+    filenames = []
+    file_errors = []
+    images = {}
+    for i, file in enumerate(files):
+        filenames.append(file.filename)
+        file_errors.append(None)
         try:
             # Validate file type
             if not file.content_type.startswith('image/'):
-                results.append({
-                    "filename": file.filename,
-                    "success": False,
-                    "error": "File must be an image"
-                })
+                file_errors[i] = "File must be an image"
                 continue
             
-            # Read image bytes
-            image_bytes = await file.read()
-            file_result = {"filename": file.filename, "success": True}
-            
-            if prediction_type in ["disaster", "both"]:
-                try:
-                    img_array = preprocess_image_for_disaster(image_bytes)
-                    disaster_pred = make_disaster_prediction(img_array)
-                    file_result["disaster_prediction"] = disaster_pred
-                except Exception as e:
-                    file_result["disaster_error"] = str(e)
-            
-            if prediction_type in ["damage", "both"]:
-                try:
-                    img_tensor = preprocess_image_for_damage(image_bytes)
-                    damage_pred = make_damage_prediction(img_tensor)
-                    file_result["damage_prediction"] = damage_pred
-                except Exception as e:
-                    file_result["damage_error"] = str(e)
-            
-            results.append(file_result)
-        
+            images[i] = await file.read()
+            if pipelined:
+                # Start decoding this file while the next one is read
+                images[i] = asyncio.ensure_future(pipeline_score(images[i], pipeline_stage_names(prediction_type)))
         except Exception as e:
+            file_errors[i] = str(e)
+    
+    if pipelined:
+        decode_errors, ok, stages = await pipeline_score_images(images)
+        for name in pipeline_stage_names(prediction_type):
+            stages.setdefault(name, (np.zeros((0, 0), dtype=np.float32), None))
+    else:
+        decode_errors, ok, stages = await dispatch("score_images", images, prediction_type)
+    content = build_batch_content(prediction_type, layout, encoding, top_k,
+                                  filenames, file_errors, decode_errors, ok, stages)
+    return render(content, encoding)
+
+def build_batch_content(prediction_type: str, layout: str, encoding: str, top_k: Optional[int],
+                        filenames: List[str], file_errors: List[Optional[str]], decode_errors: Dict[int, str],
+                        ok: List[int], stages: Dict) -> Dict:
+    """Build a batch response body in the records or packed layout"""
+    class_names = {"disaster": DISASTER_CLASSES, "damage": DAMAGE_CLASSES}
+    
+    if layout == "packed":
+        file_errors = list(file_errors)
+        for i, message in decode_errors.items():
+            file_errors[i] = f"Error processing image: {message}"
+        content = {
+            "success": True,
+            "prediction_type": prediction_type,
+            "layout": "packed",
+            "filenames": filenames,
+            "errors": file_errors
+        }
+        for name, (probs, error) in stages.items():
+            content[f"{name}_classes"] = class_names[name]
+            if error is not None:
+                content[name] = {"error": error}
+            else:
+                content[name] = {"rows": ok, **pack_probabilities(probs, encoding, top_k)}
+        return content
+    
+    results = []
+    row_of = {file_index: row for row, file_index in enumerate(ok)}
+    for i, filename in enumerate(filenames):
+        if file_errors[i] is not None:
             results.append({
-                "filename": file.filename,
+                "filename": filename,
                 "success": False,
-                "error": str(e)
+                "error": file_errors[i]
             })
+            continue
+        
+        file_result = {"filename": filename, "success": True}
+        for name, (probs, error) in stages.items():
+            if i in decode_errors:
+                file_result[f"{name}_error"] = f"Error processing image for {name} model: {decode_errors[i]}"
+            elif error is not None:
+                file_result[f"{name}_error"] = error
+            else:
+                file_result[f"{name}_prediction"] = format_prediction(probs[row_of[i]], class_names[name], top_k)
+        results.append(file_result)
+    
+    return {
+        "success": True,
+        "prediction_type": prediction_type,
+        "results": results
+    }
+
+def decode_archive_member(data) -> tuple:
+    """Turn an archive member (encoded bytes or an HxWx3 uint8 frame) into model inputs"""
+    if isinstance(data, np.ndarray):
+        img = Image.fromarray(data)
+        disaster_arr = data if data.shape[:2] == tuple(DISASTER_MODEL_INPUT_SIZE) else resize_for_disaster(img, DISASTER_MODEL_INPUT_SIZE)
+        damage_arr = data if data.shape[:2] == (64, 64) else resize_for_damage(img)
+        return disaster_arr, damage_arr
+    return decode_for_models(data, DISASTER_MODEL_INPUT_SIZE)
+
+def score_archive_stream(reader: QueueReader, archive_format: str, prediction_type: str):
+    """Read archive members from the stream and run batched inference as they arrive.
+    Runs in a worker thread; only one batch of decoded images is held at a time."""
+    filenames, file_errors, decode_errors, ok = [], [], {}, []
+    stage_names = [name for name in ("disaster", "damage") if prediction_type in (name, "both")]
+    stage_probs = {name: [] for name in stage_names}
+    stage_errors = {name: None for name in stage_names}
+    batch_index, batch = [], []
+    
+    def flush():
+        if not batch:
+            return
+        for name in stage_names:
+            if stage_errors[name] is not None:
+                continue
+            try:
+                column = 0 if name == "disaster" else 1
+                probs = dispatch_sync("predict_stage_arrays", name, [b[column] for b in batch])
+                stage_probs[name].append(np.asarray(probs, dtype=np.float32))
+            except Exception as e:
+                stage_errors[name] = str(e)
+        ok.extend(batch_index)
+        batch_index.clear()
+        batch.clear()
+    
+    try:
+        for name, data in iter_archive(reader, archive_format):
+            if len(filenames) >= ARCHIVE_MAX_MEMBERS:
+                raise HTTPException(status_code=400, detail=f"Archive has more than {ARCHIVE_MAX_MEMBERS} images")
+            index = len(filenames)
+            filenames.append(name)
+            file_errors.append(None)
+            try:
+                batch.append(decode_archive_member(data))
+                batch_index.append(index)
+            except Exception as e:
+                decode_errors[index] = str(e)
+            if len(batch) >= ARCHIVE_BATCH_SIZE:
+                flush()
+        flush()
+    finally:
+        reader.abandon()
+    
+    stages = {}
+    for name in stage_names:
+        if stage_errors[name] is not None:
+            stages[name] = (None, stage_errors[name])
+        elif stage_probs[name]:
+            stages[name] = (np.concatenate(stage_probs[name]), None)
+        else:
+            stages[name] = (np.zeros((0, 0), dtype=np.float32), None)
+    return filenames, file_errors, decode_errors, ok, stages
+
+@app.post("/predict-archive")
+async def predict_archive(
+    request: Request,
+    archive_format: Optional[str] = None,  # "tar", "zip" or "npy"; defaults from Content-Type
+    prediction_type: str = "both",
+    layout: str = "records",
+    top_k: Optional[int] = None
+):
+    """
+    Predict disaster types and/or damage levels for every image in a tar/zip archive
+    or an (N, 64, 64, 3) uint8 NPY stack sent as the raw request body
+    
+    Args:
+        archive_format: "tar", "zip" or "npy" (inferred from Content-Type if omitted)
+        prediction_type: Type of prediction ("disaster", "damage", or "both")
+        layout: "records" or "packed" (as for /predict-batch)
+        top_k: Only return the k most likely classes per image
+    
+    Returns:
+        JSON (or MessagePack, per the Accept header) with prediction results for each member
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    archive_format = archive_format or ARCHIVE_CONTENT_TYPES.get(content_type)
+    if archive_format not in ARCHIVE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"archive_format must be one of {ARCHIVE_FORMATS} "
+                                                    f"or set by a matching Content-Type")
     
+    if prediction_type not in ["disaster", "damage", "both"]:
+        raise HTTPException(status_code=400, detail="prediction_type must be 'disaster', 'damage', or 'both'")
+    
+    if layout not in RESPONSE_LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of {RESPONSE_LAYOUTS}")
+    
+    if top_k is not None and top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1")
+    
+    encoding = negotiate(request.headers.get("accept"))
+    
+    # Parse and score in a worker thread while the body is still arriving
+    loop = asyncio.get_running_loop()
+    reader = QueueReader(ARCHIVE_QUEUE_CHUNKS)
+    worker = loop.run_in_executor(ARCHIVE_EXECUTOR, score_archive_stream, reader, archive_format, prediction_type)
+    try:
+        async for chunk in request.stream():
+            if chunk and not await reader.feed_async(chunk):
+                break
+    finally:
+        await reader.feed_async(None)
+    
+    try:
+        filenames, file_errors, decode_errors, ok, stages = await worker
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=408, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading {archive_format} archive: {str(e)}")
+    
+    content = build_batch_content(prediction_type, layout, encoding, top_k,
+                                  filenames, file_errors, decode_errors, ok, stages)
+    content["archive_format"] = archive_format
+    content["count"] = len(filenames)
+    return render(content, encoding)
+
+def predict_frames(frames: List[np.ndarray], prediction_type: str) -> Dict:
+    """Run the selected models on a batch of RGB frames"""
+    decoded = [decode_archive_member(np.ascontiguousarray(frame)) for frame in frames]
+    outputs = {}
+    if prediction_type in ["disaster", "both"]:
+        outputs["disaster"] = dispatch_sync("predict_stage_arrays", "disaster", [d[0] for d in decoded])
+    if prediction_type in ["damage", "both"]:
+        outputs["damage"] = dispatch_sync("predict_stage_arrays", "damage", [d[1] for d in decoded])
+    return outputs
+
+def iter_archive_members(fileobj, archive_format: str):
+    """Yield the undecoded members (image bytes, or arrays for an NPY stack) of a frame archive, in order"""
+    for name, data in iter_archive(fileobj, archive_format):
+        yield data
+
+def decode_archive_frame(data) -> np.ndarray:
+    return data if isinstance(data, np.ndarray) else np.asarray(load_rgb_image(data))
+
+@app.post("/analyze-video")
+async def analyze_video(
+    file: UploadFile = File(...),
+    prediction_type: str = "both",  # "disaster", "damage", or "both"
+    sample_fps: float = VIDEO_SAMPLE_FPS,
+    change_threshold: float = VIDEO_CHANGE_THRESHOLD,
+    max_skip_seconds: float = VIDEO_MAX_SKIP_SECONDS,
+    source_fps: float = 1.0
+):
+    """
+    Analyze a video clip or an ordered frame sequence and return a per-segment timeline
+    
+    Args:
+        file: Video file (mp4, avi, mov, ...) or a tar/zip/npy frame sequence
+        prediction_type: Type of prediction ("disaster", "damage", or "both")
+        sample_fps: Frames per second to sample from the source
+        change_threshold: Minimum change score (0-1) for a sampled frame to be re-analyzed
+        max_skip_seconds: Re-analyze at least this often even when nothing changed
+        source_fps: Frame rate of a frame sequence (ignored for video files)
+    
+    Returns:
+        JSON with timeline segments and sampling statistics
+    """
+    if prediction_type not in ["disaster", "damage", "both"]:
+        raise HTTPException(status_code=400, detail="prediction_type must be 'disaster', 'damage', or 'both'")
+    
+    if sample_fps <= 0 or source_fps <= 0:
+        raise HTTPException(status_code=400, detail="sample_fps and source_fps must be positive")
+    
+    content_type = (file.content_type or "").lower()
+    archive_format = ARCHIVE_CONTENT_TYPES.get(content_type)
+    if archive_format is None and not content_type.startswith("video/"):
+        raise HTTPException(
+            status_code=400,
+            detail="File must be a video or a tar/zip/npy frame sequence"
+        )
+    
+    class_names = {}
+    if prediction_type in ["disaster", "both"]:
+        class_names["disaster"] = DISASTER_CLASSES
+    if prediction_type in ["damage", "both"]:
+        class_names["damage"] = DAMAGE_CLASSES
+    
+    def run(frames):
+        return analyze_frames(
+            frames,
+            lambda batch: predict_frames(batch, prediction_type),
+            class_names,
+            change_threshold=change_threshold,
+            max_skip_seconds=max_skip_seconds,
+            batch_size=VIDEO_BATCH_SIZE
+        )
+    
+    loop = asyncio.get_running_loop()
+    temp_path = None
+    try:
+        if archive_format is not None:
+            # Pick the sampled members by timestamp first so skipped frames are never decoded
+            frames = iter_sequence_frames(iter_archive_members(file.file, archive_format), source_fps, sample_fps,
+                                          decode=decode_archive_frame)
+            timeline = await loop.run_in_executor(None, run, frames)
+        else:
+            # OpenCV decodes from a path, so copy the upload to a temporary file in chunks
+            suffix = os.path.splitext(file.filename or "")[1] or ".mp4"
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp:
+                temp_path = temp.name
+                written = 0
+                while True:
+                    chunk = await file.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > VIDEO_MAX_BYTES:
+                        raise HTTPException(status_code=413, detail=f"Video larger than {VIDEO_MAX_BYTES} bytes")
+                    temp.write(chunk)
+            timeline = await loop.run_in_executor(None, run, iter_video_frames(temp_path, sample_fps))
+    except HTTPException:
+        raise
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Video analysis failed: {str(e)}")
+    finally:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.unlink(temp_path)
+    
+    segments = timeline["segments"]
     return JSONResponse(content={
         "success": True,
+        "filename": file.filename,
+        "type": "video_analysis",
         "prediction_type": prediction_type,
+        "duration_s": segments[-1]["end_s"] if segments else 0.0,
+        "sample_fps": sample_fps,
+        "frames_sampled": timeline["frames_sampled"],
+        "frames_analyzed": timeline["frames_analyzed"],
+        "frames_skipped_unchanged": timeline["frames_skipped_unchanged"],
+        "segments": segments
+    })
+
+def load_embedding_index():
+    """Open EMBEDDING_INDEX_PATH if it exists, otherwise start an empty index"""
+    global EMBEDDING_INDEX
+    if EMBEDDING_INDEX_PATH and os.path.exists(EMBEDDING_INDEX_PATH):
+        try:
+            EMBEDDING_INDEX = SimilarityIndex.load(EMBEDDING_INDEX_PATH, EMBEDDING_INDEX_NLIST or None,
+                                                   EMBEDDING_INDEX_NPROBE)
+            print(f"✓ Loaded {EMBEDDING_INDEX.size} embeddings from {EMBEDDING_INDEX_PATH}")
+            return
+        except Exception as e:
+            print(f"⚠ Warning: Could not load embedding index: {e}")
+    EMBEDDING_INDEX = SimilarityIndex(dtype=EMBEDDING_INDEX_DTYPE, nlist=EMBEDDING_INDEX_NLIST,
+                                      nprobe=EMBEDDING_INDEX_NPROBE)
+
+def embed_images(images: Dict[int, bytes], model_spec: Optional[str] = None) -> Dict[int, Dict]:
+    """Decode a batch and return the DamageCNN embedding (pooled features) and damage prediction per image"""
+    model, info = resolve_model("damage", model_spec)
+    model = model if model is not None else DAMAGE_MODEL
+    if model is None:
+        raise HTTPException(status_code=500, detail="Damage model not loaded")
+
+    results = {}
+    arrays = {}
+    for i, image_bytes in images.items():
+        try:
+            arrays[i] = resize_for_damage(load_rgb_image(image_bytes))
+        except Exception as e:
+            results[i] = {"error": f"Error processing image: {str(e)}"}
+    if not arrays:
+        return results
+
+    ok = sorted(arrays)
+    batch = torch.from_numpy(damage_input([arrays[i] for i in ok])).to(DAMAGE_DEVICE)
+    precision = getattr(model, "inference_precision", "fp32")
+    with torch.no_grad(), torch_autocast(precision, DAMAGE_DEVICE.type):
+        features, logits = model.embed(batch)
+    features = features.float().cpu().numpy()
+    probs = torch.softmax(logits.float(), dim=1).cpu().numpy()
+    for row, i in enumerate(ok):
+        results[i] = {"embedding": features[row], "damage": format_prediction(probs[row], DAMAGE_CLASSES)}
+        if info:
+            results[i]["damage"]["model"] = info["model"]
+    return results
+
+def embedding_item_id(filename: str, incident: Optional[str]) -> str:
+    return f"{incident}/{filename}" if incident else filename
+
+async def run_index(method, *args):
+    """Run an EMBEDDING_INDEX method in a worker thread; a dimension mismatch is a 409"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, method, *args)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/embed")
+async def embed(
+    files: List[UploadFile] = File(...),
+    add: bool = False,
+    incident: Optional[str] = None,
+    include_vectors: bool = True,
+    model: Optional[str] = None
+):
+    """
+    Extract DamageCNN embeddings (the 512-d pooled features the classifier sees)
+
+    Args:
+        files: Image files
+        add: Also insert the embeddings into the similarity index (re-adding an id replaces it)
+        incident: Incident name stored with added images; ids are "<incident>/<filename>"
+        include_vectors: Return the embedding vectors (off for add-only uploads)
+        model: Registry damage model as "name" or "name@version" (not combinable with add)
+
+    Returns:
+        JSON with one result per image: id, predicted damage and the embedding
+    """
+    if len(files) > EMBED_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Maximum {EMBED_MAX_FILES} files allowed per request")
+
+    if add and model is not None:
+        # Vectors from different models are not comparable
+        raise HTTPException(status_code=400, detail="Indexed embeddings must come from the default damage model")
+
+    check_model_spec("damage", model)
+
+    images = {}
+    results = []
+    for i, file in enumerate(files):
+        results.append({"filename": file.filename, "id": embedding_item_id(file.filename, incident)})
+        if not file.content_type.startswith('image/'):
+            results[i]["error"] = "File must be an image"
+            continue
+        images[i] = await file.read()
+
+    embedded = await dispatch("embed_images", images, model)
+    ids, vectors, metadata = [], [], []
+    for i, result in embedded.items():
+        if "error" in result:
+            results[i]["error"] = result["error"]
+            continue
+        results[i]["damage"] = result["damage"]
+        if include_vectors:
+            results[i]["embedding"] = result["embedding"].tolist()
+        ids.append(results[i]["id"])
+        vectors.append(result["embedding"])
+        metadata.append({"filename": results[i]["filename"], "incident": incident,
+                         "predicted_damage": result["damage"]["predicted_class"]})
+
+    if add and ids:
+        await run_index(EMBEDDING_INDEX.add, ids, np.stack(vectors), metadata)
+
+    return JSONResponse(content={
+        "success": True,
+        "dimension": len(vectors[0]) if vectors else None,
+        # A filename repeated in one upload is one index entry (the last copy wins)
+        "added": len(set(ids)) if add else 0,
+        "index_size": EMBEDDING_INDEX.size,
         "results": results
     })
 
+def check_search_args(k: int, nprobe: Optional[int]):
+    if k < 1 or k > 1000:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 1000")
+    if nprobe is not None and nprobe < 1:
+        raise HTTPException(status_code=400, detail="nprobe must be at least 1")
+
+@app.post("/similar")
+async def similar(file: UploadFile = File(...), k: int = 10, incident: Optional[str] = None,
+                  nprobe: Optional[int] = None):
+    """
+    Find the indexed images most similar to an uploaded image
+
+    Args:
+        file: Image file
+        k: Number of results
+        incident: Only return images from this incident
+        nprobe: IVF lists to search (partitioned indexes only; higher is slower and more exact)
+
+    Returns:
+        JSON with the query's damage prediction and the k nearest images by cosine similarity
+    """
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image (jpg, jpeg, png)")
+    check_search_args(k, nprobe)
+
+    embedded = (await dispatch("embed_images", {0: await file.read()}, None))[0]
+    if "error" in embedded:
+        raise HTTPException(status_code=400, detail=embedded["error"])
+    where = {"incident": incident} if incident else None
+    hits = await run_index(EMBEDDING_INDEX.search, embedded["embedding"][None, :], k, nprobe, where)
+    return {
+        "success": True,
+        "filename": file.filename,
+        "damage": embedded["damage"],
+        "results": hits[0]
+    }
+
+@app.get("/similar/{item_id:path}")
+async def similar_to_indexed(item_id: str, k: int = 10, incident: Optional[str] = None,
+                             nprobe: Optional[int] = None):
+    """Find the images most similar to an already indexed image (the image itself is excluded)"""
+    check_search_args(k, nprobe)
+    try:
+        query = EMBEDDING_INDEX.vector(item_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"'{item_id}' is not in the index")
+    where = {"incident": incident} if incident else None
+    hits = await run_index(EMBEDDING_INDEX.search, query[None, :], k, nprobe, where, [item_id])
+    return {"success": True, "id": item_id, "results": hits[0]}
+
+@app.get("/index")
+async def index_stats():
+    """Size, storage type, memory and partitioning of the similarity index"""
+    stats = EMBEDDING_INDEX.stats()
+    stats["path"] = EMBEDDING_INDEX_PATH
+    return stats
+
 @app.get("/classes")
 async def get_classes():
     """Get list of supported classes for both models"""
@@ -484,6 +1499,41 @@ async def get_damage_classes():
         "count": len(DAMAGE_CLASSES)
     }
 
+# Functions a replica process may run on behalf of the front-end
+REPLICA_FUNCTIONS = {
+    "predict_disaster_bytes": predict_disaster_bytes,
+    "predict_damage_bytes": predict_damage_bytes,
+    "run_disaster_stage": run_disaster_stage,
+    "run_damage_stage": run_damage_stage,
+    "score_images": score_images,
+    "predict_stage_arrays": predict_stage_arrays,
+    "reload_model": reload_model,
+    "embed_images": embed_images,
+    "registry_stats": MODEL_REGISTRY.stats,
+    "runtime_stats": runtime_snapshot
+}
+
+def _replica_http_error(e: ReplicaError) -> HTTPException:
+    return HTTPException(status_code=e.status_code or 500, detail=str(e))
+
+async def dispatch(name: str, *args):
+    """Run a REPLICA_FUNCTIONS entry on the least-loaded replica, or in this process without a pool"""
+    if REPLICA_POOL is None:
+        return REPLICA_FUNCTIONS[name](*args)
+    try:
+        return await REPLICA_POOL.call_async(name, *args)
+    except ReplicaError as e:
+        raise _replica_http_error(e)
+
+def dispatch_sync(name: str, *args):
+    """dispatch() for worker threads"""
+    if REPLICA_POOL is None:
+        return REPLICA_FUNCTIONS[name](*args)
+    try:
+        return REPLICA_POOL.call(name, *args)
+    except ReplicaError as e:
+        raise _replica_http_error(e)
+
 if __name__ == "__main__":
     # Run the server
     uvicorn.run(
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Staged decode -> infer pipeline connected by bounded queues.
+
+Each stage has its own worker threads and an input queue of fixed size. A
+worker takes up to batch_size items from its queue, runs the stage function on
+them, and passes each result on to the next stage's queue. The last stage
+resolves the item's future. When a queue is full, the stage feeding it waits,
+so a slow stage holds back the ones before it instead of letting work pile up
+in memory.
+
+In the backend, decode workers turn uploaded bytes into resized uint8 arrays.
+PIL releases the GIL while decoding and resizing, so this overlaps with model
+compute. The inference stage groups arrays from any number of requests into
+one forward pass per model. Throughput is then set by the slowest stage, not
+by the sum of all stages.
+
+Per stage, stats() reports:
+
+- workers and queue depth (current, maximum, capacity)
+- items, batches and mean batch size
+- items skipped because their caller cancelled (e.g. a disconnected request)
+- mean queue wait and service time per item
+- utilization, and time spent blocked on a full downstream queue
+
+Usage:
+    python inference_pipeline.py bench photos/ --type both --requests 200
+"""
+
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Dict, List
+
+PIPELINE_ENABLED = os.environ.get("PIPELINE_ENABLED", "1").lower() not in ("0", "false", "no")
+PIPELINE_DECODE_WORKERS = int(os.environ.get("PIPELINE_DECODE_WORKERS", "2"))
+PIPELINE_INFER_WORKERS = int(os.environ.get("PIPELINE_INFER_WORKERS", "1"))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "64"))
+PIPELINE_BATCH_SIZE = int(os.environ.get("PIPELINE_BATCH_SIZE", "32"))
+PIPELINE_BATCH_WAIT_MS = float(os.environ.get("PIPELINE_BATCH_WAIT_MS", "2"))
+
+class StageError(Exception):
+    """An item failed in the named stage"""
+
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+
+class _Job:
+    __slots__ = ("payload", "future", "enqueued")
+
+    def __init__(self, payload, future: Future):
+        self.payload = payload
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+class PipelineStage:
+    """One stage: fn(list of payloads) -> list of results (an Exception result fails just that item)"""
+
+    def __init__(self, name: str, fn: Callable[[List], List], workers: int = 1,
+                 queue_size: int = PIPELINE_QUEUE_SIZE, batch_size: int = 1, batch_wait_ms: float = 0.0):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.next_stage = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self.items = 0
+        self.batches = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.busy_s = 0.0
+        self.wait_s = 0.0
+        self.blocked_s = 0.0
+        self.max_depth = 0
+
+    def put(self, job: _Job, block: bool = True):
+        job.enqueued = time.perf_counter()
+        self.queue.put(job, block=block)
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"pipeline-{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _take_batch(self) -> List[_Job]:
+        job = self.queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                job = self.queue.get(block=timeout > 0, timeout=timeout if timeout > 0 else None)
+            except queue.Empty:
+                break
+            if job is None:
+                # Leave the stop marker for the next worker
+                self.queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        # Only the stop marker ends a worker; a failure to deliver one result must not stop the stage
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                self.queue.put(None)
+                return
+
+            # Callers that gave up (a cancelled request) cancel their future; skip their work
+            live = [job for job in batch if not job.future.cancelled()]
+            cancelled = len(batch) - len(live)
+            batch = live
+            if not batch:
+                with self._lock:
+                    self.cancelled += cancelled
+                continue
+
+            start = time.perf_counter()
+            waited = sum(start - job.enqueued for job in batch)
+            try:
+                results = self.fn([job.payload for job in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                results = [e] * len(batch)
+            busy = time.perf_counter() - start
+
+            blocked = 0.0
+            failed = 0
+            for job, result in zip(batch, results):
+                try:
+                    if isinstance(result, Exception):
+                        failed += 1
+                        job.future.set_exception(StageError(self.name, getattr(result, "detail", None) or str(result)))
+                    elif self.next_stage is None:
+                        job.future.set_result(result)
+                    else:
+                        job.payload = result
+                        put_start = time.perf_counter()
+                        self.next_stage.put(job)
+                        blocked += time.perf_counter() - put_start
+                except InvalidStateError:
+                    # Cancelled while the batch was running
+                    cancelled += 1
+                except Exception as e:
+                    try:
+                        job.future.set_exception(StageError(self.name, str(e)))
+                    except InvalidStateError:
+                        pass
+
+            with self._lock:
+                self.items += len(batch)
+                self.batches += 1
+                self.failed += failed
+                self.cancelled += cancelled
+                self.busy_s += busy
+                self.wait_s += waited
+                self.blocked_s += blocked
+
+    def stop(self):
+        self.queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=10)
+        self._threads = []
+
+    def stats(self, elapsed_s: float) -> Dict:
+        with self._lock:
+            items, batches = self.items, self.batches
+            return {
+                "name": self.name,
+                "workers": self.workers,
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_depth,
+                "queue_capacity": self.queue.maxsize,
+                "items": items,
+                "batches": batches,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "mean_batch_size": round(items / batches, 2) if batches else None,
+                "mean_wait_ms": round(self.wait_s / items * 1000.0, 3) if items else None,
+                "mean_service_ms": round(self.busy_s / items * 1000.0, 3) if items else None,
+                "utilization": round(self.busy_s / (elapsed_s * self.workers), 3) if elapsed_s > 0 else None,
+                "blocked_on_next_stage_ms": round(self.blocked_s * 1000.0, 1)
+            }
+
+class InferencePipeline:
+    """Chain of PipelineStages; submit() returns a Future for the last stage's result"""
+
+    def __init__(self, stages: List[PipelineStage]):
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def submit(self, payload, block: bool = True) -> Future:
+        """Queue a payload; with block=False raises queue.Full instead of waiting for space"""
+        future = Future()
+        self.stages[0].put(_Job(payload, future), block=block)
+        return future
+
+    def close(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def stats(self) -> Dict:
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        stages = [stage.stats(elapsed) for stage in self.stages]
+        busiest = max(stages, key=lambda s: s["utilization"] or 0.0) if stages else None
+        return {
+            "uptime_s": round(elapsed, 1),
+            "stages": stages,
+            "bottleneck": busiest["name"] if busiest and busiest["items"] else None
+        }
+
+def benchmark(args):
+    """Time the same requests scored one at a time and through the pipeline"""
+    import fastapi_backend as backend
+    from concurrent.futures import ThreadPoolExecutor
+
+    paths = sorted(os.path.join(args.images, name) for name in os.listdir(args.images))
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    images = [images[i % len(images)] for i in range(args.requests)]
+
+    for loader, path in ((backend.load_disaster_model, args.disaster_model),
+                         (backend.load_damage_model, args.damage_model)):
+        try:
+            loader(path)
+        except Exception as e:
+            print(f"⚠ Warning: Could not load {path}: {e}")
+    stage_names = backend.pipeline_stage_names(args.type)
+
+    # Sequential: each request decodes then runs the models before the next starts
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(lambda image: backend.score_images({0: image}, args.type), images))
+    sequential = time.perf_counter() - start
+
+    pipeline = backend.create_inference_pipeline().start()
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            futures = list(pool.map(lambda image: pipeline.submit((image, stage_names)), images))
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+        pipelined = time.perf_counter() - start
+        stats = pipeline.stats()
+    finally:
+        pipeline.close()
+
+    print(f"  sequential: {len(images) / sequential:8.1f} images/s")
+    print(f"  pipelined:  {len(images) / pipelined:8.1f} images/s ({sequential / pipelined:.2f}x)")
+    for stage in stats["stages"]:
+        print(f"    {stage['name']:8s} workers {stage['workers']} | service {stage['mean_service_ms']} ms/item | "
+              f"wait {stage['mean_wait_ms']} ms | batch {stage['mean_batch_size']} | "
+              f"max depth {stage['max_queue_depth']}/{stage['queue_capacity']} | utilization {stage['utilization']}")
+    print(f"  bottleneck: {stats['bottleneck']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Staged decode/infer pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="Compare sequential and pipelined scoring")
+    bench_parser.add_argument("images", help="Folder of images to send")
+    bench_parser.add_argument("--type", choices=["disaster", "damage", "both"], default="both")
+    bench_parser.add_argument("--requests", type=int, default=200, help="Single-image requests to score")
+    bench_parser.add_argument("--concurrency", type=int, default=16, help="Simultaneous requests")
+    bench_parser.add_argument("--disaster-model", default="disaster.h5")
+    bench_parser.add_argument("--damage-model", default="best_damage.pth")
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.images):
+        print(f"❌ Image folder not found: {args.images}")
+        sys.exit(1)
+
+    print(f"🏁 Scoring {args.requests} requests ({args.type}) with {args.concurrency} clients")
+    benchmark(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Persistent cache of optimized, ready-to-load model artifacts.
+
+Entries are keyed by a SHA-256 of the source weight file together with the
+artifact kind, precision, framework/runtime versions and CACHE_FORMAT_VERSION,
+so changed weights or an upgraded runtime never pick up a stale artifact.
+
+- damage: the DamageCNN after load_state_dict, scripted and frozen with
+  torch.jit.freeze (BatchNorm folded into the convolutions, embed() kept),
+  saved with torch.jit.save and loaded with torch.jit.load
+- disaster: the Keras model after precision conversion, exported as a
+  SavedModel serving function and loaded with tf.saved_model.load
+
+Each entry has a JSON metadata file. Entries for the same source file with a
+different key are evicted when a new entry is stored, as are entries unused for
+MODEL_CACHE_MAX_AGE_DAYS; beyond MODEL_CACHE_MAX_ENTRIES the least recently used
+entries go first. Set MODEL_CACHE_DIR to an empty string to disable the cache.
+
+Several processes (e.g. replicas) may share one cache directory. Artifacts
+and metadata are written under unique temporary names and renamed into place,
+and building, publishing and eviction run under an exclusive lock on
+MODEL_CACHE_DIR/.lock (flock, where available). A process that gets the lock
+after another one published the same entry uses that entry instead of
+publishing its own.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): unique temporary names still keep writers from clobbering each other
+    fcntl = None
+
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", ".model_cache")
+MODEL_CACHE_MAX_ENTRIES = int(os.environ.get("MODEL_CACHE_MAX_ENTRIES", "8"))
+MODEL_CACHE_MAX_AGE_DAYS = float(os.environ.get("MODEL_CACHE_MAX_AGE_DAYS", "30"))
+
+CACHE_FORMAT_VERSION = 2  # 2: frozen damage modules keep embed()
+STALE_TEMP_SECONDS = 3600  # temporary files older than this were left by a crashed writer
+
+def cache_enabled() -> bool:
+    return bool(MODEL_CACHE_DIR)
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in 1 MB chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def runtime_version(kind: str) -> str:
+    """Framework versions that an artifact of this kind depends on"""
+    if kind == "damage":
+        import torch
+        framework = f"torch-{torch.__version__}"
+    else:
+        import tensorflow as tf
+        framework = f"tensorflow-{tf.__version__}"
+    return f"{framework}-python-{platform.python_version()}-format-{CACHE_FORMAT_VERSION}"
+
+def cache_key(kind: str, source_digest: str, precision: str, extra: str = "") -> str:
+    material = "|".join([kind, source_digest, precision, runtime_version(kind), extra])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class CacheEntry:
+    """Location and metadata of one cached artifact"""
+
+    def __init__(self, kind: str, source_path: str, precision: str, extra: str = ""):
+        self.kind = kind
+        self.source_path = os.path.abspath(source_path)
+        self.precision = precision
+        self.extra = extra
+        self.source_digest = file_digest(source_path)
+        self.key = cache_key(kind, self.source_digest, precision, extra)
+        name = f"{kind}-{self.key[:24]}"
+        self.artifact_path = os.path.join(MODEL_CACHE_DIR, name + (".pt" if kind == "damage" else ""))
+        self.meta_path = os.path.join(MODEL_CACHE_DIR, name + ".json")
+
+    def variant(self) -> tuple:
+        """Everything in the key except the source digest (an entry with the same variant is superseded)"""
+        return (self.kind, self.source_path, self.precision, runtime_version(self.kind), self.extra)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path) and os.path.exists(self.artifact_path)
+
+    def read_meta(self) -> dict:
+        with open(self.meta_path, "r") as f:
+            return json.load(f)
+
+    def touch(self):
+        """Record a cache hit for LRU eviction"""
+        meta = self.read_meta()
+        meta["last_used"] = time.time()
+        _write_json(self.meta_path, meta)
+
+    def write_meta(self, **extra):
+        meta = {
+            "kind": self.kind,
+            "key": self.key,
+            "source_path": self.source_path,
+            "source_digest": self.source_digest,
+            "precision": self.precision,
+            "runtime": runtime_version(self.kind),
+            "extra": self.extra,
+            "artifact": os.path.basename(self.artifact_path),
+            "created": time.time(),
+            "last_used": time.time()
+        }
+        meta.update(extra)
+        _write_json(self.meta_path, meta)
+
+def _temp_path(final_path: str, directory: bool = False) -> str:
+    """A new, uniquely named temporary file (or directory) next to final_path"""
+    parent, name = os.path.split(final_path)
+    if directory:
+        return tempfile.mkdtemp(prefix=name + ".", suffix=".tmp", dir=parent)
+    fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=parent)
+    os.close(fd)
+    # mkstemp creates the file as owner-only; cached artifacts are shared like regular files
+    os.chmod(tmp_path, 0o644)
+    return tmp_path
+
+@contextmanager
+def cache_lock():
+    """Exclusive lock on the cache directory, held while an entry is built, published or evicted"""
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(MODEL_CACHE_DIR, ".lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _write_json(path: str, data: dict):
+    tmp_path = _temp_path(path)
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _remove_entry(meta_path: str, meta: dict):
+    artifact = os.path.join(os.path.dirname(meta_path), meta.get("artifact", ""))
+    if os.path.isdir(artifact):
+        shutil.rmtree(artifact, ignore_errors=True)
+    elif os.path.exists(artifact):
+        os.remove(artifact)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+def evict(keep: CacheEntry = None):
+    """Drop stale, expired and least recently used entries"""
+    if not os.path.isdir(MODEL_CACHE_DIR):
+        return
+    entries = []
+    now = time.time()
+    for name in os.listdir(MODEL_CACHE_DIR):
+        path = os.path.join(MODEL_CACHE_DIR, name)
+        if name.endswith(".tmp"):
+            try:
+                if now - os.path.getmtime(path) > STALE_TEMP_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True) if os.path.isdir(path) else os.remove(path)
+            except OSError:
+                pass
+            continue
+        if not name.endswith(".json"):
+            continue
+        meta_path = os.path.join(MODEL_CACHE_DIR, name)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        entries.append((meta_path, meta))
+
+    survivors = []
+    for meta_path, meta in entries:
+        if keep is not None and meta.get("key") == keep.key:
+            survivors.append((meta_path, meta))
+            continue
+        # Same checkpoint, precision, runtime and device as `keep` but older weights; a CPU and a CUDA
+        # artifact of one checkpoint are different variants and both stay
+        variant = (meta.get("kind"), meta.get("source_path"), meta.get("precision"),
+                   meta.get("runtime"), meta.get("extra", ""))
+        stale = keep is not None and variant == keep.variant()
+        expired = now - meta.get("last_used", 0) > MODEL_CACHE_MAX_AGE_DAYS * 86400
+        outdated = meta.get("runtime") != runtime_version(meta.get("kind", "damage"))
+        if stale or expired or outdated:
+            print(f"🧹 Evicting cached model artifact {meta.get('artifact')}")
+            _remove_entry(meta_path, meta)
+        else:
+            survivors.append((meta_path, meta))
+
+    survivors.sort(key=lambda item: item[1].get("last_used", 0), reverse=True)
+    for meta_path, meta in survivors[MODEL_CACHE_MAX_ENTRIES:]:
+        print(f"🧹 Evicting least recently used artifact {meta.get('artifact')}")
+        _remove_entry(meta_path, meta)
+
+class SavedModelPredictor:
+    """Keras-style predict() over a cached SavedModel serving function"""
+
+    def __init__(self, loaded, input_shape):
+        self._loaded = loaded
+        self._serve = loaded.serve
+        self.input_shape = tuple(input_shape)
+
+    def predict(self, x, verbose=0):
+        return self._serve(x).numpy()
+
+def load_damage_artifact(entry: CacheEntry, device):
+    import torch
+    return torch.jit.load(entry.artifact_path, map_location=device)
+
+def store_damage_artifact(entry: CacheEntry, model):
+    """Script and freeze an eval-mode DamageCNN and save it; returns the frozen module
+
+    If another process published this entry meanwhile, its artifact is loaded and returned instead.
+    """
+    import torch
+    with cache_lock():
+        if entry.exists():
+            device = next(model.parameters()).device
+            return load_damage_artifact(entry, device)
+        frozen = torch.jit.freeze(torch.jit.script(model.eval()), preserved_attrs=["embed"])
+        tmp_path = _temp_path(entry.artifact_path)
+        try:
+            torch.jit.save(frozen, tmp_path)
+            os.replace(tmp_path, entry.artifact_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        entry.write_meta()
+        evict(keep=entry)
+    return frozen
+
+def load_disaster_artifact(entry: CacheEntry):
+    import tensorflow as tf
+    meta = entry.read_meta()
+    return SavedModelPredictor(tf.saved_model.load(entry.artifact_path), meta["input_shape"])
+
+def store_disaster_artifact(entry: CacheEntry, model):
+    """Export a (precision-converted) Keras model's inference function as a SavedModel"""
+    import tensorflow as tf
+    input_shape = [None] + list(model.input_shape[1:])
+
+    module = tf.Module()
+    module.model = model
+    module.serve = tf.function(
+        lambda x: model(x, training=False),
+        input_signature=[tf.TensorSpec(input_shape, tf.float32)],
+        autograph=False
+    )
+    with cache_lock():
+        if entry.exists():
+            return
+        tmp_path = _temp_path(entry.artifact_path, directory=True)
+        try:
+            tf.saved_model.save(module, tmp_path)
+            shutil.rmtree(entry.artifact_path, ignore_errors=True)
+            os.replace(tmp_path, entry.artifact_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        entry.write_meta(input_shape=input_shape)
+        evict(keep=entry)
@@ -0,0 +1,206 @@
+"""
+Registry of named, versioned models that load on first use.
+
+Models are listed in a JSON manifest (MODEL_REGISTRY_FILE, default models.json):
+
+    [
+      {"kind": "disaster", "name": "coastal-flood", "version": "2", "path": "models/coastal_flood_v2.h5"},
+      {"kind": "damage", "name": "pruned", "version": "1", "path": "best_damage_pruned.pth", "precision": "bf16"}
+    ]
+
+Requests name a model as "name" or "name@version"; without a version the entry
+listed last for that name is used. A model is loaded the first time it is asked
+for and stays resident until evicted. When the resident models together exceed
+MODEL_MEMORY_BUDGET_MB, the least recently used ones are dropped, except the
+model that was just loaded. The default models loaded at startup are not part
+of the registry and are never evicted.
+
+Model size is the bytes of its parameters, buffers or variables, or the size
+of its weight file when those are not visible (e.g. frozen TorchScript).
+"""
+
+import gc
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+MODEL_REGISTRY_FILE = os.environ.get("MODEL_REGISTRY_FILE", "models.json")
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", "2048"))
+
+MODEL_KINDS = ["disaster", "damage"]
+
+def parse_spec(spec: str) -> Tuple[str, Optional[str]]:
+    """Split "name@version" into (name, version); version is None when omitted"""
+    name, _, version = spec.partition("@")
+    return name, version or None
+
+def estimate_model_bytes(model, source_path: str) -> int:
+    """Bytes held by a model's tensors, falling back to the weight file size"""
+    total = 0
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        # PyTorch module (TorchScript too, though freezing turns weights into constants)
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    else:
+        # Keras model, or the SavedModel wrapper from the artifact cache
+        variables = getattr(model, "weights", None) or getattr(getattr(model, "_loaded", None), "variables", None) or []
+        for variable in variables:
+            total += int(variable.shape.num_elements() or 0) * variable.dtype.size
+    if total == 0 and os.path.exists(source_path):
+        total = os.path.getsize(source_path)
+    return total
+
+class RegisteredModel:
+    """One manifest entry, its residency and load statistics"""
+
+    def __init__(self, kind: str, name: str, version: str, path: str, precision: Optional[str] = None):
+        self.kind = kind
+        self.name = name
+        self.version = version
+        self.path = path
+        self.precision = precision
+        self.model = None
+        self.info = {}  # loader extras, e.g. the disaster model's input size
+        self.bytes = 0
+        self.loads = 0
+        self.evictions = 0
+        self.hits = 0
+        self.last_load_ms = None
+        self.total_load_ms = 0.0
+        self.last_used = None
+        self.load_lock = threading.Lock()
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    @property
+    def resident(self) -> bool:
+        return self.model is not None
+
+    def stats(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "version": self.version,
+            "path": self.path,
+            "precision": self.info.get("precision", self.precision),
+            "resident": self.resident,
+            "memory_mb": round(self.bytes / (1024 * 1024), 2) if self.resident else 0.0,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "last_load_ms": round(self.last_load_ms, 2) if self.last_load_ms is not None else None,
+            "mean_load_ms": round(self.total_load_ms / self.loads, 2) if self.loads else None,
+            "last_used": self.last_used
+        }
+
+class ModelRegistry:
+    """Load-on-first-use models with a least-recently-used memory budget"""
+
+    def __init__(self, loaders: Dict[str, Callable], budget_mb: float = MODEL_MEMORY_BUDGET_MB):
+        # loaders[kind](path, precision) -> (model, info dict)
+        self.loaders = loaders
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.entries = {}  # (kind, name, version) -> RegisteredModel
+        self.resident = OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+
+    def register(self, kind: str, name: str, version: str, path: str, precision: Optional[str] = None) -> RegisteredModel:
+        if kind not in MODEL_KINDS:
+            raise ValueError(f"Model kind must be one of {MODEL_KINDS}, got {kind!r}")
+        if not name or "@" in name:
+            raise ValueError(f"Invalid model name: {name!r}")
+        entry = RegisteredModel(kind, name, str(version), path, precision)
+        with self._lock:
+            self.entries[(kind, name, entry.version)] = entry
+        return entry
+
+    def load_manifest(self, path: str = MODEL_REGISTRY_FILE) -> int:
+        """Register every entry of a JSON manifest; returns the number registered"""
+        with open(path, "r") as f:
+            manifest = json.load(f)
+        for item in manifest:
+            self.register(item["kind"], item["name"], item.get("version", "1"), item["path"], item.get("precision"))
+        return len(manifest)
+
+    def lookup(self, kind: str, name: str, version: Optional[str] = None) -> RegisteredModel:
+        with self._lock:
+            if version is not None:
+                entry = self.entries.get((kind, name, str(version)))
+            else:
+                # Registration order: the last version listed wins
+                matches = [e for (k, n, _), e in self.entries.items() if k == kind and n == name]
+                entry = matches[-1] if matches else None
+        if entry is None:
+            label = name if version is None else f"{name}@{version}"
+            raise KeyError(f"Unknown {kind} model: {label}")
+        return entry
+
+    def get(self, kind: str, spec: str) -> Tuple[object, Dict]:
+        """Return (model, info) for "name[@version]", loading the model on first use.
+        The caller keeps its own reference, so a later eviction cannot pull the model away mid-request"""
+        entry = self.lookup(kind, *parse_spec(spec))
+        with entry.load_lock:
+            if entry.model is None:
+                self._load(entry)
+            else:
+                entry.hits += 1
+            with self._lock:
+                entry.last_used = time.time()
+                self.resident[entry] = True
+                self.resident.move_to_end(entry)
+            return entry.model, dict(entry.info, model=entry.label)
+
+    def _load(self, entry: RegisteredModel):
+        start = time.perf_counter()
+        model, info = self.loaders[entry.kind](entry.path, entry.precision)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        entry.model = model
+        entry.info = info
+        entry.bytes = estimate_model_bytes(model, entry.path)
+        entry.loads += 1
+        entry.last_load_ms = elapsed
+        entry.total_load_ms += elapsed
+        print(f"📦 Loaded {entry.kind} model {entry.label} in {elapsed:.0f} ms "
+              f"({entry.bytes / (1024 * 1024):.1f} MB)")
+        self._evict(keep=entry)
+
+    def _evict(self, keep: RegisteredModel):
+        """Drop least recently used models until the rest fit the budget"""
+        evicted = []
+        with self._lock:
+            total = sum(e.bytes for e in self.resident) + (0 if keep in self.resident else keep.bytes)
+            for entry in list(self.resident):
+                if total <= self.budget_bytes:
+                    break
+                if entry is keep:
+                    continue
+                del self.resident[entry]
+                total -= entry.bytes
+                evicted.append(entry)
+        for entry in evicted:
+            # Wait for a load or lookup of this entry in progress before dropping it
+            with entry.load_lock:
+                entry.model = None
+                entry.info = {}
+                entry.evictions += 1
+            print(f"🧹 Evicted {entry.kind} model {entry.label} ({entry.bytes / (1024 * 1024):.1f} MB)")
+        if evicted:
+            gc.collect()
+        if total > self.budget_bytes:
+            print(f"⚠ Warning: {keep.kind} model {keep.label} alone exceeds the "
+                  f"{self.budget_bytes / (1024 * 1024):.0f} MB model memory budget")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = list(self.entries.values())
+            resident_bytes = sum(e.bytes for e in self.resident)
+        return {
+            "budget_mb": round(self.budget_bytes / (1024 * 1024), 2),
+            "resident_mb": round(resident_bytes / (1024 * 1024), 2),
+            "models": [entry.stats() for entry in entries]
+        }
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Reduced-precision inference support for the disaster (Keras) and damage (PyTorch) models.
+
+Precision settings are "fp32", "bf16", "fp16" or "auto". "auto" picks bf16 when the
+CPU (or GPU) supports it natively and falls back to fp32 otherwise. Explicit low
+precision requests on hardware without native support also fall back to fp32 with a
+warning, since emulated bf16/fp16 is slower than fp32 on CPU.
+
+Usage:
+    python precision.py detect
+    python precision.py compare path/to/images --precision bf16
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+import numpy as np
+
+PRECISIONS = ["fp32", "bf16", "fp16", "auto"]
+
+KERAS_POLICIES = {
+    "bf16": "mixed_bfloat16",
+    "fp16": "mixed_float16"
+}
+
+def cpu_flags() -> set:
+    """Return the CPU feature flags reported by /proc/cpuinfo (empty off Linux)"""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+def detect_support(device_type: str = "cpu") -> dict:
+    """Report which reduced precisions run natively on the given device type"""
+    if device_type == "cuda":
+        import torch
+        return {
+            "bf16": bool(torch.cuda.is_available() and torch.cuda.is_bf16_supported()),
+            "fp16": bool(torch.cuda.is_available())
+        }
+
+    flags = cpu_flags()
+    return {
+        "bf16": bool(flags & {"avx512_bf16", "amx_bf16"}),
+        "fp16": bool(flags & {"avx512_fp16", "amx_fp16"}),
+        "amx": "amx_tile" in flags
+    }
+
+def resolve_precision(requested: str, device_type: str = "cpu") -> str:
+    """Turn a requested precision into the one that will actually be used"""
+    requested = (requested or "fp32").lower()
+    if requested not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got '{requested}'")
+    if requested == "fp32":
+        return "fp32"
+
+    support = detect_support(device_type)
+    if requested == "auto":
+        return "bf16" if support["bf16"] else "fp32"
+    if not support[requested]:
+        print(f"⚠ Warning: {requested} is not natively supported on {device_type}; using fp32")
+        return "fp32"
+    return requested
+
+def _set_layer_dtypes(layers: list, policy: str):
+    """Set the dtype policy in serialized layer configs, keeping the input and output layers in float32"""
+    for layer in layers[:-1]:
+        if layer.get("class_name") in ("InputLayer",):
+            continue
+        config = layer.get("config", {})
+        if "layers" in config:
+            _set_layer_dtypes(config["layers"], policy)
+        if "dtype" in config:
+            config["dtype"] = policy
+
+def convert_keras_model(model, precision: str):
+    """Rebuild a loaded Keras model with a mixed-precision dtype policy"""
+    if precision == "fp32":
+        return model
+
+    config = model.get_config()
+    _set_layer_dtypes(config["layers"], KERAS_POLICIES[precision])
+    converted = model.__class__.from_config(config)
+    converted.set_weights(model.get_weights())
+    return converted
+
+def torch_autocast(precision: str, device_type: str = "cpu"):
+    """Context manager that runs PyTorch ops in the requested precision"""
+    if precision == "fp32":
+        return contextlib.nullcontext()
+
+    import torch
+    dtype = torch.bfloat16 if precision == "bf16" else torch.float16
+    return torch.autocast(device_type=device_type, dtype=dtype)
+
+def _labels_for(paths: list, class_names: list):
+    """Map '<Class>/<file>' paths to class indices, or None if the folder is not labeled"""
+    labels = []
+    for path in paths:
+        label = path.replace("\\", "/").split("/")[0]
+        if label not in class_names:
+            return None
+        labels.append(class_names.index(label))
+    return np.array(labels)
+
+def _time_batches(predict, batches: list, repeats: int):
+    """Run predict over every batch `repeats` times, returning (probs, per-image latencies in ms)"""
+    latencies = []
+    probs = None
+    for _ in range(repeats):
+        outputs = []
+        for batch in batches:
+            start = time.perf_counter()
+            outputs.append(predict(batch))
+            latencies.append((time.perf_counter() - start) * 1000.0 / len(batch))
+        probs = np.concatenate(outputs)
+    return probs, np.array(latencies)
+
+def _report(name: str, precision: str, fp32_probs, low_probs, fp32_lat, low_lat, labels):
+    from damage_model import calculate_accuracy
+    import torch
+
+    agreement = float((fp32_probs.argmax(1) == low_probs.argmax(1)).mean())
+    diff = np.abs(fp32_probs - low_probs)
+    print(f"\n=== {name} model: fp32 vs {precision} ===")
+    print(f"  Latency per image (median): fp32 {np.median(fp32_lat):.3f} ms | "
+          f"{precision} {np.median(low_lat):.3f} ms | speedup {np.median(fp32_lat) / np.median(low_lat):.2f}x")
+    print(f"  Top-1 agreement: {agreement * 100:.2f}%")
+    print(f"  Probability diff: mean {diff.mean():.5f} | max {diff.max():.5f}")
+    if labels is not None:
+        target = torch.from_numpy(labels)
+        fp32_acc = calculate_accuracy(torch.from_numpy(fp32_probs), target)
+        low_acc = calculate_accuracy(torch.from_numpy(low_probs), target)
+        print(f"  Accuracy: fp32 {fp32_acc * 100:.2f}% | {precision} {low_acc * 100:.2f}% | "
+              f"delta {(low_acc - fp32_acc) * 100:+.2f} pts")
+
+def compare(args):
+    """Compare fp32 against a reduced precision for the selected models"""
+    import torch
+    import fastapi_backend as backend
+    from bulk_score import list_images
+    from preprocessing import decode_for_models, disaster_input, damage_input
+
+    paths = list_images(args.images)[:args.limit]
+    if not paths:
+        print(f"No images found under {args.images}")
+        sys.exit(1)
+    print(f"📁 Comparing on {len(paths)} images from {args.images}")
+
+    if args.model in ("disaster", "both"):
+        backend.load_disaster_model(args.disaster_model, precision="fp32")
+        fp32_model = backend.DISASTER_MODEL
+        backend.load_disaster_model(args.disaster_model, precision=args.precision)
+        low_model = backend.DISASTER_MODEL
+        low_precision = backend.DISASTER_PRECISION
+
+    if args.model in ("damage", "both"):
+        backend.load_damage_model(args.damage_model, precision="fp32")
+        fp32_damage = backend.DAMAGE_MODEL
+        backend.load_damage_model(args.damage_model, precision=args.precision)
+        low_damage = backend.DAMAGE_MODEL
+
+    decoded = []
+    for path in paths:
+        with open(os.path.join(args.images, path), "rb") as f:
+            decoded.append(decode_for_models(f.read(), backend.DISASTER_MODEL_INPUT_SIZE))
+
+    chunks = [decoded[i:i + args.batch_size] for i in range(0, len(decoded), args.batch_size)]
+
+    if args.model in ("disaster", "both"):
+        batches = [disaster_input([d[0] for d in chunk]) for chunk in chunks]
+        backend.predict_disaster_probs(batches[0], model=fp32_model)
+        backend.predict_disaster_probs(batches[0], model=low_model)
+        fp32_probs, fp32_lat = _time_batches(lambda b: backend.predict_disaster_probs(b, model=fp32_model), batches, args.repeats)
+        low_probs, low_lat = _time_batches(lambda b: backend.predict_disaster_probs(b, model=low_model), batches, args.repeats)
+        _report("Disaster", low_precision, fp32_probs, low_probs, fp32_lat, low_lat,
+                _labels_for(paths, backend.DISASTER_CLASSES))
+
+    if args.model in ("damage", "both"):
+        batches = [torch.from_numpy(damage_input([d[1] for d in chunk])) for chunk in chunks]
+        backend.predict_damage_probs(batches[0], model=fp32_damage)
+        backend.predict_damage_probs(batches[0], model=low_damage)
+        fp32_probs, fp32_lat = _time_batches(lambda b: backend.predict_damage_probs(b, model=fp32_damage), batches, args.repeats)
+        low_probs, low_lat = _time_batches(lambda b: backend.predict_damage_probs(b, model=low_damage), batches, args.repeats)
+        _report("Damage", low_damage.inference_precision, fp32_probs, low_probs, fp32_lat, low_lat,
+                _labels_for(paths, backend.DAMAGE_CLASSES))
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduced-precision inference tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("detect", help="Show native bf16/fp16 support on this machine")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare fp32 with a reduced precision")
+    compare_parser.add_argument("images", help="Image folder; use <Class>/<image> subfolders to also report accuracy")
+    compare_parser.add_argument("--precision", choices=PRECISIONS[1:], default="auto",
+                                help="Reduced precision to compare against fp32 (default: auto)")
+    compare_parser.add_argument("--model", choices=["disaster", "damage", "both"], default="both")
+    compare_parser.add_argument("--disaster-model", default="disaster.h5")
+    compare_parser.add_argument("--damage-model", default="best_damage.pth")
+    compare_parser.add_argument("--batch-size", type=int, default=32)
+    compare_parser.add_argument("--repeats", type=int, default=3, help="Timed passes over the images (default: 3)")
+    compare_parser.add_argument("--limit", type=int, default=2000, help="Maximum images to use (default: 2000)")
+
+    args = parser.parse_args()
+
+    if args.command == "detect":
+        print("CPU:", detect_support("cpu"))
+        print("auto ->", resolve_precision("auto", "cpu"))
+        try:
+            import torch
+            if torch.cuda.is_available():
+                print("CUDA:", detect_support("cuda"))
+        except ImportError:
+            pass
+    else:
+        compare(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Image preprocessing shared by the FastAPI backend and the offline tools.
+
+Only PIL and numpy are imported here so these helpers can run inside worker
+processes without pulling in TensorFlow or PyTorch.
+"""
+
+import io
+import numpy as np
+from PIL import Image
+
+DAMAGE_INPUT_SIZE = (64, 64)
+
+def load_rgb_image(image_bytes: bytes) -> Image.Image:
+    """Decode image bytes into an RGB PIL image"""
+    img = Image.open(io.BytesIO(image_bytes))
+
+    # Convert to RGB if necessary
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    return img
+
+def resize_for_disaster(img: Image.Image, size) -> np.ndarray:
+    """Resize for the disaster model (PIL default resampling) and return HxWx3 uint8"""
+    return np.asarray(img.resize(size), dtype=np.uint8)
+
+def resize_for_damage(img: Image.Image, size=DAMAGE_INPUT_SIZE) -> np.ndarray:
+    """Resize for the damage model (bilinear, as transforms.Resize) and return HxWx3 uint8"""
+    return np.asarray(img.resize((size[1], size[0]), Image.BILINEAR), dtype=np.uint8)
+
+def decode_for_models(image_bytes: bytes, disaster_size, damage_size=DAMAGE_INPUT_SIZE):
+    """Decode once and return the (disaster, damage) uint8 arrays for one image"""
+    img = load_rgb_image(image_bytes)
+    return resize_for_disaster(img, disaster_size), resize_for_damage(img, damage_size)
+
+def disaster_input(arrays) -> np.ndarray:
+    """Stack uint8 HxWx3 arrays into a normalized NHWC float32 batch"""
+    return np.stack(arrays).astype("float32") / 255.0
+
+def damage_input(arrays) -> np.ndarray:
+    """Stack uint8 HxWx3 arrays into a normalized NCHW float32 batch (as transforms.ToTensor)"""
+    batch = np.stack(arrays).astype("float32") / 255.0
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
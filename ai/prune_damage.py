@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Structured channel pruning for the damage assessment model.
+
+Whole channels and hidden units are removed, so the result is an ordinary dense
+DamageCNN (or EarlyExitDamageCNN) with narrower layers. Its checkpoint records the new widths in
+"model_config", which load_damage_model uses to rebuild it. Importance scores:
+
+- conv channels: |gamma| of the BatchNorm after the conv (network slimming)
+- classifier hidden units: norm of incoming weights x norm of outgoing weights
+
+Inside each DamageConvBlock, the channels between the two convs are pruned on
+their own. The block output channels are pruned together with the inputs of
+the next block, or with the first classifier layer after the last block.
+Early-exit heads lose the inputs of the block output channels that are pruned
+and keep their own hidden width and the exit threshold.
+Widths are rounded to multiples of 8 to keep CPU kernels vectorized.
+
+`search` tries keep ratios from the smallest model up. It measures batch-1 CPU
+latency of each candidate as served: the eager model by default, which is what
+the server runs with DAMAGE_MMAP_WEIGHTS=1, or with --frozen the frozen
+TorchScript artifact used with DAMAGE_MMAP_WEIGHTS=0. Candidates within
+--target-ms are optionally fine-tuned, then scored on a labeled folder. The
+first one within --max-accuracy-drop of the original is exported.
+
+Usage:
+    python prune_damage.py prune best_damage.pth --ratio 0.5 --output best_damage_pruned.pth
+    python prune_damage.py search best_damage.pth --val-dir data/val --target-ms 2.0 \\
+        --max-accuracy-drop 1.0 --train-dir data/train --epochs 3 --output best_damage_pruned.pth
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from damage_model import DamageCNN, DamageConvBlock, EarlyExitDamageCNN, create_damage_model, calculate_accuracy
+
+DAMAGE_CLASSES = ["No-damage", "Minor-damage", "Major-damage", "Destroyed"]
+DEFAULT_RATIOS = [0.125, 0.1875, 0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1.0]
+
+def load_checkpoint(path: str):
+    """Return (model, checkpoint) for a DamageCNN checkpoint"""
+    checkpoint = torch.load(path, map_location="cpu")
+    model = create_damage_model(**checkpoint.get("model_config", {}))
+    model.load_state_dict(checkpoint["model_state_dict"])
+    return model.eval(), checkpoint
+
+def save_checkpoint(model: DamageCNN, path: str, **extra):
+    checkpoint = {
+        "model_state_dict": model.state_dict(),
+        "model_config": model.model_config()
+    }
+    checkpoint.update(extra)
+    torch.save(checkpoint, path)
+
+def count_parameters(model: nn.Module) -> int:
+    return sum(p.numel() for p in model.parameters())
+
+def keep_count(width: int, ratio: float, multiple: int = 8) -> int:
+    """Number of channels to keep, rounded to a multiple of 8 (never more than the original)"""
+    if width <= multiple:
+        return width
+    return int(min(width, max(multiple, round(width * ratio / multiple) * multiple)))
+
+def _top_indices(scores: torch.Tensor, k: int) -> torch.Tensor:
+    """Indices of the k highest scores, in their original order"""
+    return torch.sort(torch.argsort(scores, descending=True)[:k]).values
+
+def _copy_conv(src: nn.Conv2d, dst: nn.Conv2d, out_idx, in_idx):
+    dst.weight.data.copy_(src.weight.data[out_idx][:, in_idx])
+    if src.bias is not None:
+        dst.bias.data.copy_(src.bias.data[out_idx])
+
+def _copy_bn(src: nn.BatchNorm2d, dst: nn.BatchNorm2d, idx):
+    dst.weight.data.copy_(src.weight.data[idx])
+    dst.bias.data.copy_(src.bias.data[idx])
+    dst.running_mean.copy_(src.running_mean[idx])
+    dst.running_var.copy_(src.running_var[idx])
+    dst.num_batches_tracked.copy_(src.num_batches_tracked)
+
+def _copy_linear(src: nn.Linear, dst: nn.Linear, out_idx, in_idx):
+    dst.weight.data.copy_(src.weight.data[out_idx][:, in_idx])
+    dst.bias.data.copy_(src.bias.data[out_idx])
+
+def prune_damage_model(model: DamageCNN, ratio: float) -> DamageCNN:
+    """Return a dense model of the same class keeping the most important `ratio` of every layer's channels"""
+    model = model.eval()
+    blocks = [m for m in model.features if isinstance(m, DamageConvBlock)]
+    linears = [m for m in model.classifier if isinstance(m, nn.Linear)]
+
+    block_keep = []
+    for block in blocks:
+        conv1, bn1, _, conv2, bn2, _ = block.conv
+        mid = _top_indices(bn1.weight.detach().abs(), keep_count(conv1.out_channels, ratio))
+        out = _top_indices(bn2.weight.detach().abs(), keep_count(conv2.out_channels, ratio))
+        block_keep.append((mid, out))
+
+    hidden_keep = []
+    for i, linear in enumerate(linears[:-1]):
+        scores = linear.weight.detach().norm(dim=1) * linears[i + 1].weight.detach().norm(dim=0)
+        hidden_keep.append(_top_indices(scores, keep_count(linear.out_features, ratio)))
+
+    config = model.model_config()
+    config.update(channels=[[len(mid), len(out)] for mid, out in block_keep],
+                  hidden=[len(idx) for idx in hidden_keep])
+    pruned = create_damage_model(**config).eval()
+
+    with torch.no_grad():
+        prev = torch.arange(blocks[0].conv[0].in_channels)
+        new_blocks = [m for m in pruned.features if isinstance(m, DamageConvBlock)]
+        for block, new_block, (mid, out) in zip(blocks, new_blocks, block_keep):
+            conv1, bn1, _, conv2, bn2, _ = block.conv
+            new_conv1, new_bn1, _, new_conv2, new_bn2, _ = new_block.conv
+            _copy_conv(conv1, new_conv1, mid, prev)
+            _copy_bn(bn1, new_bn1, mid)
+            _copy_conv(conv2, new_conv2, out, mid)
+            _copy_bn(bn2, new_bn2, out)
+            prev = out
+
+        new_linears = [m for m in pruned.classifier if isinstance(m, nn.Linear)]
+        out_keep = hidden_keep + [torch.arange(linears[-1].out_features)]
+        for linear, new_linear, out in zip(linears, new_linears, out_keep):
+            _copy_linear(linear, new_linear, out, prev)
+            prev = out
+
+        if isinstance(model, EarlyExitDamageCNN):
+            # Each head reads the pooled output of its block, so it keeps the same input channels
+            for head, new_head, (mid, out) in zip(model.exit_heads, pruned.exit_heads, block_keep):
+                head_linears = [m for m in head.classifier if isinstance(m, nn.Linear)]
+                new_linears = [m for m in new_head.classifier if isinstance(m, nn.Linear)]
+                _copy_linear(head_linears[0], new_linears[0], torch.arange(head_linears[0].out_features), out)
+                new_linears[1].load_state_dict(head_linears[1].state_dict())
+
+    return pruned
+
+def measure_latency(model: nn.Module, batch_size: int = 1, repeats: int = 200, warmup: int = 20,
+                    frozen: bool = False) -> float:
+    """Median CPU latency in ms of one forward pass, on the eager model or the frozen TorchScript artifact"""
+    example = torch.rand(batch_size, 3, 64, 64)
+    with torch.no_grad():
+        served = torch.jit.freeze(torch.jit.script(model.eval())) if frozen else model.eval()
+        for _ in range(warmup):
+            served(example)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            served(example)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings))
+
+def load_labeled_images(root: str, limit: int = None):
+    """Load a <Class>/<image> folder of damage images as (NCHW float tensor, label tensor)"""
+    from bulk_score import list_images
+    from preprocessing import load_rgb_image, resize_for_damage, damage_input
+
+    arrays, labels = [], []
+    for path in list_images(root)[:limit]:
+        label = path.replace("\\", "/").split("/")[0]
+        if label not in DAMAGE_CLASSES:
+            continue
+        try:
+            with open(os.path.join(root, path), "rb") as f:
+                arrays.append(resize_for_damage(load_rgb_image(f.read())))
+        except Exception as e:
+            print(f"  ⚠ Skipping {path}: {e}")
+            continue
+        labels.append(DAMAGE_CLASSES.index(label))
+
+    if not arrays:
+        raise ValueError(f"No labeled images found under {root} (expected <Class>/<image> with classes {DAMAGE_CLASSES})")
+    return torch.from_numpy(damage_input(arrays)), torch.tensor(labels)
+
+def evaluate(model: nn.Module, inputs: torch.Tensor, labels: torch.Tensor, batch_size: int = 256) -> float:
+    model.eval()
+    with torch.no_grad():
+        outputs = torch.cat([model(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)])
+    return calculate_accuracy(outputs, labels)
+
+def fine_tune(model: nn.Module, inputs: torch.Tensor, labels: torch.Tensor,
+              epochs: int, lr: float = 1e-4, batch_size: int = 32):
+    """Recover accuracy after pruning with a few epochs of training"""
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    criterion = nn.CrossEntropyLoss()
+    model.train()
+    for epoch in range(epochs):
+        order = torch.randperm(len(inputs))
+        total_loss = 0.0
+        for i in range(0, len(order), batch_size):
+            idx = order[i:i + batch_size]
+            batch = inputs[idx]
+            flip = torch.rand(len(batch)) < 0.5
+            batch[flip] = batch[flip].flip(-1)
+            optimizer.zero_grad()
+            if isinstance(model, EarlyExitDamageCNN):
+                # Keep the exit heads in step with the pruned backbone
+                loss = sum(criterion(logits, labels[idx]) for logits in model.forward_all(batch))
+            else:
+                loss = criterion(model(batch), labels[idx])
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(idx)
+        print(f"    epoch {epoch + 1}/{epochs}: loss {total_loss / len(inputs):.4f}")
+    return model.eval()
+
+def describe(model: DamageCNN) -> str:
+    channels = "/".join(str(out) for mid, out in model.block_widths)
+    return f"channels {channels}, hidden {'/'.join(map(str, model.hidden))}, {count_parameters(model):,} params"
+
+def prune_command(args):
+    model, checkpoint = load_checkpoint(args.checkpoint)
+    pruned = prune_damage_model(model, args.ratio)
+    if args.train_dir and args.epochs > 0:
+        print(f"🏋️ Fine-tuning on {args.train_dir}")
+        inputs, labels = load_labeled_images(args.train_dir)
+        fine_tune(pruned, inputs, labels, args.epochs, args.lr)
+    save_checkpoint(pruned, args.output, keep_ratio=args.ratio, pruned_from=args.checkpoint,
+                    epoch=checkpoint.get("epoch"))
+    print(f"Original: {describe(model)}")
+    print(f"Pruned:   {describe(pruned)}")
+    print(f"✅ Written to {args.output}")
+
+def search_command(args):
+    model, checkpoint = load_checkpoint(args.checkpoint)
+    torch.set_num_threads(args.threads)
+
+    print(f"📁 Loading validation images from {args.val_dir}")
+    val_inputs, val_labels = load_labeled_images(args.val_dir)
+    train_data = load_labeled_images(args.train_dir) if args.train_dir and args.epochs > 0 else None
+
+    base_latency = measure_latency(model, args.batch_size, frozen=args.frozen)
+    base_accuracy = evaluate(model, val_inputs, val_labels)
+    min_accuracy = base_accuracy - args.max_accuracy_drop / 100.0
+    print(f"Original: {describe(model)}")
+    print(f"  latency {base_latency:.3f} ms | accuracy {base_accuracy * 100:.2f}% on {len(val_labels)} images")
+    print(f"🎯 Target: <= {args.target_ms} ms with accuracy >= {min_accuracy * 100:.2f}%\n")
+
+    chosen = None
+    for ratio in sorted(args.ratios):
+        candidate = prune_damage_model(model, ratio)
+        latency = measure_latency(candidate, args.batch_size, frozen=args.frozen)
+        print(f"  ratio {ratio:.4f}: {describe(candidate)} | latency {latency:.3f} ms")
+        if latency > args.target_ms:
+            continue
+
+        if train_data is not None:
+            fine_tune(candidate, train_data[0].clone(), train_data[1], args.epochs, args.lr)
+        accuracy = evaluate(candidate, val_inputs, val_labels)
+        print(f"    accuracy {accuracy * 100:.2f}% ({(accuracy - base_accuracy) * 100:+.2f} pts)")
+        if accuracy >= min_accuracy:
+            chosen = (ratio, candidate, latency, accuracy)
+            break
+
+    if chosen is None:
+        print("\n❌ No candidate meets both the latency target and the accuracy budget")
+        sys.exit(1)
+
+    ratio, candidate, latency, accuracy = chosen
+    save_checkpoint(candidate, args.output, keep_ratio=ratio, pruned_from=args.checkpoint,
+                    epoch=checkpoint.get("epoch"), latency_ms=latency, accuracy=accuracy,
+                    base_latency_ms=base_latency, base_accuracy=base_accuracy)
+    print(f"\n✅ Smallest passing model: ratio {ratio} | {latency:.3f} ms "
+          f"({base_latency / latency:.2f}x faster) | accuracy {accuracy * 100:.2f}%")
+    print(f"   Written to {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Structured channel pruning for DamageCNN")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prune_parser = subparsers.add_parser("prune", help="Prune every layer to a fixed keep ratio")
+    prune_parser.add_argument("--ratio", type=float, required=True, help="Fraction of channels to keep (0-1]")
+
+    search_parser = subparsers.add_parser("search", help="Find the smallest model meeting a latency target")
+    search_parser.add_argument("--val-dir", required=True, help="Labeled <Class>/<image> validation folder")
+    search_parser.add_argument("--target-ms", type=float, required=True, help="Maximum CPU latency per batch")
+    search_parser.add_argument("--max-accuracy-drop", type=float, default=1.0,
+                               help="Allowed accuracy loss in percentage points (default: 1.0)")
+    search_parser.add_argument("--ratios", type=float, nargs="+", default=DEFAULT_RATIOS)
+    search_parser.add_argument("--batch-size", type=int, default=1, help="Batch size for latency (default: 1)")
+    search_parser.add_argument("--threads", type=int, default=1, help="Torch threads for latency (default: 1)")
+    search_parser.add_argument("--frozen", action="store_true",
+                               help="Time the frozen TorchScript artifact (served with DAMAGE_MMAP_WEIGHTS=0)")
+
+    for sub in (prune_parser, search_parser):
+        sub.add_argument("checkpoint", help="Source checkpoint (e.g. best_damage.pth)")
+        sub.add_argument("--output", default="best_damage_pruned.pth")
+        sub.add_argument("--train-dir", default=None, help="Labeled folder for fine-tuning after pruning")
+        sub.add_argument("--epochs", type=int, default=0, help="Fine-tuning epochs (default: 0)")
+        sub.add_argument("--lr", type=float, default=1e-4)
+
+    args = parser.parse_args()
+
+    if args.command == "prune":
+        if not 0 < args.ratio <= 1:
+            parser.error("--ratio must be in (0, 1]")
+        prune_command(args)
+    else:
+        search_command(args)
+
+if __name__ == "__main__":
+    main()
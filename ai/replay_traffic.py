@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Replay captured API traffic against a running build.
+
+Reads capture files written by traffic_capture.py and sends each recorded
+request again, with its stored body and content type, at the recorded arrival
+time (scaled by --speed). Requests are sent open-loop: a slow server does not
+delay later arrivals, just as with real clients. Records whose payload was not
+stored (CAPTURE_PAYLOADS=0 or too large) are skipped and counted.
+
+The same capture files and --speed always give the same request sequence and
+timing, so two builds can be compared on real traffic shapes:
+
+    python replay_traffic.py captures/*.jsonl --url http://localhost:8000 --label before --output before.json
+    python replay_traffic.py captures/*.jsonl --url http://localhost:8001 --label after --output after.json \\
+        --compare before.json --max-regression-pct 10
+
+The report has latency percentiles overall and per path, error and
+status-mismatch counts, the latencies recorded during capture for the same
+requests, and how late the replayer sent requests (a high value means the
+client machine could not keep up). With --compare and a limit, the run also
+fails when the error or status-mismatch rate rises above the baseline's or a
+path has no successful responses, so a build that fails fast cannot pass.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from evaluate_variants import percentiles
+
+# Error and status-mismatch rates may rise this many percentage points over the baseline
+DEFAULT_MAX_ERROR_RATE_INCREASE = 1.0
+
+def load_records(paths: List[str], path_prefixes: List[str] = None, limit: int = 0) -> List[Dict]:
+    """Read capture files, merge them in arrival order and attach each record's payload location"""
+    records = []
+    for capture_path in paths:
+        payload_dir = os.path.join(os.path.dirname(os.path.abspath(capture_path)), "payloads")
+        with open(capture_path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if path_prefixes and not any(record["path"].startswith(p) for p in path_prefixes):
+                    continue
+                record["payload_path"] = os.path.join(payload_dir, record.get("body_sha256", ""))
+                records.append(record)
+
+    records.sort(key=lambda r: r["timestamp"])
+    if limit:
+        records = records[:limit]
+    if records:
+        first = records[0]["timestamp"]
+        for record in records:
+            record["arrival_s"] = record["timestamp"] - first
+    return records
+
+async def send_one(client: httpx.AsyncClient, record: Dict, body: bytes, scheduled: float, start: float) -> Dict:
+    sent = time.perf_counter()
+    result = {
+        "path": record["path"],
+        "recorded_status": record.get("status"),
+        "recorded_latency_ms": record.get("latency_ms"),
+        "lateness_ms": round((sent - start - scheduled) * 1000.0, 3)
+    }
+    headers = {}
+    if record.get("content_type"):
+        headers["content-type"] = record["content_type"]
+    if record.get("accept"):
+        headers["accept"] = record["accept"]
+    url = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    try:
+        response = await client.request(record["method"], url, content=body, headers=headers)
+        await response.aread()
+        result["status"] = response.status_code
+    except httpx.HTTPError as e:
+        result["status"] = None
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency_ms"] = round((time.perf_counter() - sent) * 1000.0, 3)
+    return result
+
+async def replay(records: List[Dict], url: str, speed: float, timeout: float, max_connections: int) -> Dict:
+    """Send every record with a stored payload at its (scaled) arrival time"""
+    bodies = []
+    skipped = 0
+    for record in records:
+        if record.get("payload_stored") and os.path.exists(record["payload_path"]):
+            with open(record["payload_path"], "rb") as f:
+                bodies.append((record, f.read()))
+        elif record.get("body_bytes", 0) == 0:
+            bodies.append((record, b""))
+        else:
+            skipped += 1
+
+    limits = httpx.Limits(max_connections=max_connections or None, max_keepalive_connections=max_connections or None)
+    async with httpx.AsyncClient(base_url=url.rstrip("/"), timeout=timeout, limits=limits) as client:
+        tasks = []
+        start = time.perf_counter()
+        for record, body in bodies:
+            scheduled = record["arrival_s"] / speed
+            delay = start + scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send_one(client, record, body, scheduled, start)))
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return {"results": results, "skipped_no_payload": skipped, "elapsed_s": round(elapsed, 3)}
+
+def summarize(results: List[Dict]) -> Dict:
+    ok = [r for r in results if r["status"] is not None and r["status"] < 400]
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "status_mismatches": sum(1 for r in results if r["status"] != r["recorded_status"]),
+        "latency_ms": percentiles([r["latency_ms"] for r in ok]),
+        "recorded_latency_ms": percentiles([r["recorded_latency_ms"] for r in ok
+                                            if r["recorded_latency_ms"] is not None]),
+        "lateness_ms": percentiles([r["lateness_ms"] for r in results])
+    }
+    return summary
+
+def build_report(label: str, url: str, speed: float, captures: List[str], run: Dict) -> Dict:
+    results = run["results"]
+    by_path = {}
+    for result in results:
+        by_path.setdefault(result["path"], []).append(result)
+    return {
+        "label": label,
+        "url": url,
+        "speed": speed,
+        "captures": captures,
+        "elapsed_s": run["elapsed_s"],
+        "skipped_no_payload": run["skipped_no_payload"],
+        "overall": summarize(results),
+        "paths": {path: summarize(items) for path, items in sorted(by_path.items())}
+    }
+
+def _rate(summary: Dict, key: str):
+    return summary[key] / summary["requests"] * 100.0 if summary.get("requests") else None
+
+def compare_reports(report: Dict, baseline: Dict, max_regression_pct: float = None,
+                    max_error_rate_increase: float = None) -> List[str]:
+    """Print latency and error changes against a baseline report; returns the failures over the limits
+
+    With either limit set, the comparison gates on latency percentiles, on the error and status-mismatch
+    rates (percentage points above the baseline), and fails any section without a successful response.
+    """
+    gating = max_regression_pct is not None or max_error_rate_increase is not None
+    error_limit = max_error_rate_increase if max_error_rate_increase is not None else DEFAULT_MAX_ERROR_RATE_INCREASE
+    failures = []
+    print(f"\n📊 {report['label']} vs {baseline.get('label', 'baseline')}")
+    sections = [("overall", report["overall"], baseline.get("overall", {}))]
+    sections += [(path, summary, baseline.get("paths", {}).get(path, {})) for path, summary in report["paths"].items()]
+    for name, current, previous in sections:
+        if current.get("requests") and not current.get("latency_ms"):
+            print(f"  {name:24s} no successful responses ({current['errors']}/{current['requests']} errors)"
+                  f"{'  ❌' if gating else ''}")
+            if gating:
+                failures.append(f"{name} had no successful responses")
+
+        for key, label in (("errors", "error rate"), ("status_mismatches", "status mismatches")):
+            now, before = _rate(current, key), _rate(previous, key)
+            if now is None or before is None or (now == 0 and before == 0):
+                continue
+            flag = ""
+            if gating and now - before > error_limit:
+                flag = "  ❌"
+                failures.append(f"{name} {label} {before:.1f}% -> {now:.1f}%")
+            print(f"  {name:24s} {label}: {before:6.1f}% -> {now:6.1f}% ({now - before:+.1f} pts){flag}")
+
+        for stat in ("p50", "p95", "p99"):
+            now = current.get("latency_ms", {}).get(stat)
+            before = previous.get("latency_ms", {}).get(stat)
+            if now is None or not before:
+                continue
+            change = (now - before) / before * 100.0
+            flag = ""
+            if max_regression_pct is not None and change > max_regression_pct:
+                flag = "  ❌"
+                failures.append(f"{name} {stat} +{change:.1f}%")
+            print(f"  {name:24s} {stat}: {before:9.2f} ms -> {now:9.2f} ms ({change:+.1f}%){flag}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured API traffic with its recorded arrival pattern")
+    parser.add_argument("captures", nargs="+", help="capture-*.jsonl files written with CAPTURE_DIR")
+    parser.add_argument("--url", default="http://localhost:8000", help="Server to replay against")
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival rate multiplier (2 = twice as fast)")
+    parser.add_argument("--paths", nargs="+", help="Only replay paths starting with these prefixes")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--max-connections", type=int, default=0, help="Connection limit (default: unlimited)")
+    parser.add_argument("--label", default="replay", help="Name of this build in the report")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Baseline report to compare latencies against")
+    parser.add_argument("--max-regression-pct", type=float,
+                        help="With --compare, exit 1 if any p50/p95/p99 is slower by more than this")
+    parser.add_argument("--max-error-rate-increase", type=float,
+                        help="With --compare, exit 1 if the error or status-mismatch rate rises by more than "
+                             f"this many percentage points (default {DEFAULT_MAX_ERROR_RATE_INCREASE} "
+                             "when --max-regression-pct is set)")
+
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        print("❌ --speed must be positive")
+        sys.exit(1)
+
+    records = load_records(args.captures, args.paths, args.limit)
+    if not records:
+        print("❌ No captured requests to replay")
+        sys.exit(1)
+
+    duration = records[-1]["arrival_s"] / args.speed
+    print(f"🔁 Replaying {len(records)} requests over {duration:.1f}s against {args.url}")
+    run = asyncio.run(replay(records, args.url, args.speed, args.timeout, args.max_connections))
+    report = build_report(args.label, args.url, args.speed, args.captures, run)
+
+    overall = report["overall"]
+    latency = overall["latency_ms"]
+    print(f"✅ {overall['requests']} sent, {report['skipped_no_payload']} skipped (no payload), "
+          f"{overall['errors']} errors, {overall['status_mismatches']} status mismatches")
+    if latency:
+        print(f"   latency p50 {latency['p50']:.2f} ms | p95 {latency['p95']:.2f} ms | p99 {latency['p99']:.2f} ms | "
+              f"max lateness {overall['lateness_ms'].get('max', 0):.2f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        failures = compare_reports(report, baseline, args.max_regression_pct, args.max_error_rate_increase)
+        if failures:
+            print(f"❌ Regressions: {', '.join(failures)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Pool of model replica processes pinned to separate core sets.
+
+Each replica is a spawned process that pins itself to its cores, sizes the
+TensorFlow and PyTorch thread pools to that core count, loads both models and
+then serves calls over a multiprocessing Pipe. Decoding, preprocessing and
+inference all happen inside the replica, so requests on different replicas
+never contend for the same GIL.
+
+The front-end sends each call to the replica with the fewest calls in flight
+(ties go round-robin). One reader thread per replica resolves the matching
+future when the reply arrives. If a replica exits, its in-flight calls fail
+and the router skips it from then on.
+
+Enable in the backend with REPLICAS=<n>. REPLICA_CORES sets the cores per
+replica; by default the available cores are split evenly.
+
+Usage:
+    python replica_pool.py bench --replicas 1 2 4 8 --image image1.jpg
+"""
+
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from thread_config import ENV_KEYS, default_plan
+
+REPLICAS = int(os.environ.get("REPLICAS", "0"))
+REPLICA_CORES = int(os.environ.get("REPLICA_CORES", "0"))
+REPLICA_START_TIMEOUT = float(os.environ.get("REPLICA_START_TIMEOUT", "300"))
+
+class ReplicaError(Exception):
+    """A call failed inside a replica. status_code is set for HTTP errors"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def available_cpus() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+def plan_core_sets(replicas: int, cores_per_replica: int = 0, cpus: List[int] = None) -> List[List[int]]:
+    """Give each replica its own contiguous block of CPUs (blocks wrap if there are too few)"""
+    cpus = cpus or available_cpus()
+    if cores_per_replica <= 0:
+        cores_per_replica = max(1, len(cpus) // replicas)
+    return [
+        [cpus[(i * cores_per_replica + j) % len(cpus)] for j in range(cores_per_replica)]
+        for i in range(replicas)
+    ]
+
+def _replica_main(conn, index: int, cores: List[int], disaster_model_path: str, damage_model_path: str):
+    """Entry point of a replica process"""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    # fastapi_backend applies the thread config on import; explicit settings still win
+    for key, value in default_plan(len(cores), 1).items():
+        os.environ.setdefault(ENV_KEYS[key], str(value))
+
+    import fastapi_backend as backend
+
+    for loader, path in ((backend.load_disaster_model, disaster_model_path),
+                         (backend.load_damage_model, damage_model_path)):
+        try:
+            loader(path)
+        except Exception as e:
+            print(f"⚠ Warning: Replica {index} could not load {path}: {e}")
+
+    status = backend.model_status()
+    status.update({"pid": os.getpid(), "thread_config": backend.THREAD_CONFIG})
+    conn.send(("ready", status))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+
+        call_id, name, args = message
+        try:
+            reply = (call_id, True, backend.REPLICA_FUNCTIONS[name](*args))
+        except Exception as e:
+            # Exceptions are not reliably picklable, so send the message and HTTP status only
+            detail = getattr(e, "detail", None) or str(e)
+            reply = (call_id, False, (str(detail), getattr(e, "status_code", None)))
+        conn.send(reply)
+    conn.close()
+
+class Replica:
+    """Front-end handle for one replica process"""
+
+    def __init__(self, index: int, cores: List[int]):
+        self.index = index
+        self.cores = cores
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.pending = {}  # call id -> (future, start time)
+        self.alive = False
+        self.status = {}
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_ms = 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process is not None else None,
+            "cores": self.cores,
+            "alive": self.alive,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "mean_ms": round(self.busy_ms / self.completed, 3) if self.completed else None
+        }
+
+class ReplicaPool:
+    """Core-pinned replica processes behind a least-loaded router"""
+
+    def __init__(self, replicas: int, cores_per_replica: int = 0,
+                 disaster_model_path: str = "disaster.h5", damage_model_path: str = "best_damage.pth"):
+        self.replicas = [Replica(i, cores) for i, cores in enumerate(plan_core_sets(replicas, cores_per_replica))]
+        self.disaster_model_path = disaster_model_path
+        self.damage_model_path = damage_model_path
+        self._lock = threading.Lock()
+        self._call_ids = itertools.count()
+        self._round_robin = itertools.count()
+
+    def start(self, timeout: float = REPLICA_START_TIMEOUT):
+        """Start every replica and wait until all have loaded their models"""
+        assigned = [cpu for replica in self.replicas for cpu in replica.cores]
+        if len(set(assigned)) < len(assigned):
+            print("⚠ Warning: More replica cores requested than available; some replicas share cores")
+
+        context = multiprocessing.get_context("spawn")
+        for replica in self.replicas:
+            parent_conn, child_conn = context.Pipe()
+            replica.process = context.Process(
+                target=_replica_main,
+                args=(child_conn, replica.index, replica.cores, self.disaster_model_path, self.damage_model_path),
+                daemon=True
+            )
+            replica.process.start()
+            child_conn.close()
+            replica.conn = parent_conn
+
+        for replica in self.replicas:
+            try:
+                if not replica.conn.poll(timeout):
+                    raise RuntimeError(f"Replica {replica.index} did not start within {timeout:.0f}s")
+                kind, status = replica.conn.recv()
+            except EOFError:
+                self.close()
+                raise RuntimeError(f"Replica {replica.index} exited during startup")
+            except RuntimeError:
+                self.close()
+                raise
+            replica.status = status
+            replica.alive = True
+            threading.Thread(target=self._read_replies, args=(replica,), daemon=True).start()
+            print(f"✓ Replica {replica.index} ready (pid {status['pid']}, cores {replica.cores})")
+        return self
+
+    def _pick(self) -> Replica:
+        alive = [replica for replica in self.replicas if replica.alive]
+        if not alive:
+            raise ReplicaError("No model replicas are running", status_code=503)
+        offset = next(self._round_robin)
+        return min(alive, key=lambda r: (r.in_flight, (r.index - offset) % len(self.replicas)))
+
+    def submit(self, name: str, *args, replica: Replica = None) -> Future:
+        """Send a call to the given replica (default: the least-loaded one)"""
+        future = Future()
+        with self._lock:
+            replica = replica or self._pick()
+            call_id = next(self._call_ids)
+            replica.pending[call_id] = (future, time.perf_counter())
+            replica.in_flight += 1
+        try:
+            with replica.send_lock:
+                replica.conn.send((call_id, name, args))
+        except (OSError, ValueError) as e:
+            self._finish(replica, call_id, False, (f"Replica {replica.index} unavailable: {e}", 503))
+        return future
+
+    def call(self, name: str, *args):
+        """Blocking call, for worker threads"""
+        return self.submit(name, *args).result()
+
+    async def call_async(self, name: str, *args):
+        return await asyncio.wrap_future(self.submit(name, *args))
+
+    async def broadcast_async(self, name: str, *args) -> List:
+        """Run the same call on every live replica and return the results in replica order"""
+        futures = [self.submit(name, *args, replica=r) for r in self.replicas if r.alive]
+        return await asyncio.gather(*[asyncio.wrap_future(f) for f in futures])
+
+    def _finish(self, replica: Replica, call_id: int, ok: bool, value):
+        with self._lock:
+            entry = replica.pending.pop(call_id, None)
+            if entry is None:
+                return
+            future, start = entry
+            replica.in_flight -= 1
+            replica.completed += 1
+            replica.busy_ms += (time.perf_counter() - start) * 1000.0
+            if not ok:
+                replica.failed += 1
+        if ok:
+            future.set_result(value)
+        else:
+            message, status_code = value
+            future.set_exception(ReplicaError(message, status_code))
+
+    def _read_replies(self, replica: Replica):
+        while True:
+            try:
+                call_id, ok, value = replica.conn.recv()
+            except (EOFError, OSError):
+                break
+            self._finish(replica, call_id, ok, value)
+
+        replica.alive = False
+        print(f"⚠ Warning: Replica {replica.index} exited")
+        for call_id in list(replica.pending):
+            self._finish(replica, call_id, False, (f"Replica {replica.index} exited", 503))
+
+    def status(self) -> Dict:
+        """Model status reported by the first live replica"""
+        for replica in self.replicas:
+            if replica.alive:
+                return replica.status
+        return {}
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            return [replica.stats() for replica in self.replicas]
+
+    def close(self):
+        for replica in self.replicas:
+            if replica.conn is None:
+                continue
+            try:
+                with replica.send_lock:
+                    replica.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for replica in self.replicas:
+            if replica.process is not None:
+                replica.process.join(timeout=10)
+                if replica.process.is_alive():
+                    replica.process.terminate()
+            replica.alive = False
+
+def benchmark(args):
+    """Measure single-image throughput for each replica count"""
+    with open(args.image, "rb") as f:
+        image_bytes = f.read()
+
+    # Same cores per replica at every count, so ideal throughput grows linearly
+    cores_per_replica = args.cores_per_replica or max(1, len(available_cpus()) // max(args.replicas))
+    print(f"  {cores_per_replica} core(s) per replica")
+
+    results = []
+    for count in args.replicas:
+        pool = ReplicaPool(count, cores_per_replica, args.disaster_model, args.damage_model).start()
+        try:
+            for _ in range(args.warmup * count):
+                pool.call("run_damage_stage", image_bytes, True)
+
+            # Keep `concurrency` calls in flight, like that many simultaneous clients
+            latencies = []
+            lock = threading.Lock()
+            remaining = itertools.count()
+
+            def client():
+                while next(remaining) < args.requests:
+                    start = time.perf_counter()
+                    for name in ("run_disaster_stage", "run_damage_stage"):
+                        pool.call(name, image_bytes, True)
+                    with lock:
+                        latencies.append((time.perf_counter() - start) * 1000.0)
+
+            threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            pool.close()
+
+        latencies.sort()
+        throughput = len(latencies) / elapsed
+        results.append((count, throughput))
+        scaling = throughput / (results[0][1] / results[0][0]) / count
+        print(f"  {count} replica(s): {throughput:.1f} req/s | p50 {latencies[len(latencies) // 2]:.1f} ms | "
+              f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.1f} ms | "
+              f"scaling efficiency {scaling * 100:.0f}%")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Core-pinned model replica pool")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="Measure throughput scaling with the replica count")
+    bench_parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4], help="Replica counts to try")
+    bench_parser.add_argument("--cores-per-replica", type=int, default=REPLICA_CORES,
+                              help="Cores per replica (default: available cores / largest replica count)")
+    bench_parser.add_argument("--image", default="image1.jpg", help="Image sent with every request")
+    bench_parser.add_argument("--requests", type=int, default=200, help="Combined predictions per replica count")
+    bench_parser.add_argument("--concurrency", type=int, default=16, help="Simultaneous client threads")
+    bench_parser.add_argument("--warmup", type=int, default=3, help="Warm-up calls per replica")
+    bench_parser.add_argument("--disaster-model", default="disaster.h5")
+    bench_parser.add_argument("--damage-model", default="best_damage.pth")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.image):
+        print(f"❌ Image not found: {args.image}")
+        sys.exit(1)
+
+    print(f"🏁 Benchmarking replica counts {args.replicas} on {len(available_cpus())} cores")
+    benchmark(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+On-demand profiling of a single API request.
+
+Profiling is off unless PROFILE_TOKEN is set, and then only runs for requests that
+send the token in the X-Profile header or the `profile` query parameter. A profiled
+request collects:
+
+- a cProfile summary of Python functions (sorted by cumulative time)
+- a torch.profiler summary of PyTorch operators
+- optionally (X-Profile-Dump: 1 or `profile_dump=1`) a folded-stack flame graph
+  file from a stack sampler, a Chrome trace of the PyTorch ops and a TensorFlow
+  trace for TensorBoard, written under PROFILE_DIR
+
+Only one request is profiled at a time because cProfile and the framework
+profilers are process-wide. Three limits follow from profiling the event-loop
+thread and the whole process:
+
+- Other requests running on the event loop while a request is profiled show up
+  in its cProfile and stack samples. The summary reports how many overlapped
+  (`concurrent_requests`); profile an otherwise idle instance for clean numbers.
+- Work handed to other threads is not in cProfile or the stack samples, so
+  handlers check profiling_active() and score a profiled request in-line
+  instead of through the inference pipeline's worker threads.
+- TensorFlow operators have no summary in the response. Only the dumped trace
+  covers them, so use profile_dump and open it in TensorBoard.
+
+ProfileMiddleware is a pure ASGI middleware and is only installed when
+PROFILE_TOKEN is set, so unprofiled deployments pay nothing for it.
+"""
+
+import contextvars
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from starlette.datastructures import Headers, QueryParams
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "25"))
+
+_profile_lock = threading.Lock()
+_profiling_active = contextvars.ContextVar("profiling_active", default=False)
+
+def profiling_enabled() -> bool:
+    return bool(PROFILE_TOKEN)
+
+def profiling_active() -> bool:
+    """True inside a request that is being profiled"""
+    return _profiling_active.get()
+
+def profiling_requested(headers, query_params) -> bool:
+    """True when the request carries a valid profiling token"""
+    if not PROFILE_TOKEN:
+        return False
+    token = headers.get("x-profile") or query_params.get("profile")
+    return bool(token) and hmac.compare_digest(token, PROFILE_TOKEN)
+
+def dump_requested(headers, query_params) -> bool:
+    """True when the request also asks for profile files on disk"""
+    value = headers.get("x-profile-dump") or query_params.get("profile_dump") or ""
+    return value.lower() in ("1", "true", "yes")
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval and counts folded stacks"""
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_folded(self, path: str):
+        """Write stacks in the folded format read by flamegraph.pl and speedscope"""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+class RequestProfile:
+    """Profiles everything that runs on the calling thread between start() and stop()"""
+
+    def __init__(self, label: str, dump: bool = False):
+        self.label = label
+        self.dump = dump
+        self.acquired = False
+        self.summary = {}
+        self._profiler = None
+        self._torch_profiler = None
+        self._sampler = None
+        self._tf_logdir = None
+        self._start = None
+        self._running = set()  # collectors to stop: "sampler", "torch", "tf"
+
+    def start(self) -> bool:
+        """Start profiling; returns False if another request is already being profiled
+
+        If a collector fails to start, the ones already running are stopped and the lock is
+        released before the error is raised, so later requests can still be profiled.
+        """
+        self.acquired = _profile_lock.acquire(blocking=False)
+        if not self.acquired:
+            return False
+
+        try:
+            self._start_collectors()
+        except Exception:
+            try:
+                self._stop_collectors()
+            except Exception:
+                pass
+            _profile_lock.release()
+            self.acquired = False
+            raise
+        return True
+
+    def _start_collectors(self):
+        try:
+            import torch
+            self._torch_profiler = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU],
+                record_shapes=True
+            )
+            self._torch_profiler.__enter__()
+            self._running.add("torch")
+        except ImportError:
+            self._torch_profiler = None
+
+        if self.dump:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            self._base_path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.label}")
+            self._sampler = StackSampler(threading.get_ident())
+            self._sampler.start()
+            self._running.add("sampler")
+            try:
+                import tensorflow as tf
+                self._tf_logdir = self._base_path + "-tf"
+                tf.profiler.experimental.start(self._tf_logdir)
+                self._running.add("tf")
+            except Exception:
+                self._tf_logdir = None
+
+        self._profiler = cProfile.Profile()
+        self._start = time.perf_counter()
+        self._profiler.enable()
+
+    def _stop_collectors(self):
+        """Stop the collectors still running, each even if another fails; re-raises the first error"""
+        error = None
+        for name in ("sampler", "torch", "tf"):
+            if name not in self._running:
+                continue
+            self._running.discard(name)
+            try:
+                if name == "sampler":
+                    self._sampler.stop()
+                elif name == "torch":
+                    self._torch_profiler.__exit__(None, None, None)
+                else:
+                    import tensorflow as tf
+                    tf.profiler.experimental.stop()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def stop(self) -> dict:
+        """Stop profiling and return the per-function / per-operator summary"""
+        try:
+            self._profiler.disable()
+            wall_ms = (time.perf_counter() - self._start) * 1000.0
+            # Stop every collector first: a failing summary or export must not leave one running
+            self._stop_collectors()
+
+            self.summary = {
+                "wall_ms": round(wall_ms, 3),
+                "python": self._python_summary(),
+                "torch_ops": self._torch_summary()
+            }
+
+            if self.dump:
+                files = {}
+                files["flamegraph"] = self._base_path + ".folded"
+                self._sampler.write_folded(files["flamegraph"])
+                files["pstats"] = self._base_path + ".pstats"
+                self._profiler.dump_stats(files["pstats"])
+                if self._torch_profiler is not None:
+                    files["torch_trace"] = self._base_path + "-torch.json"
+                    self._torch_profiler.export_chrome_trace(files["torch_trace"])
+                if self._tf_logdir is not None:
+                    files["tf_trace"] = self._tf_logdir
+                self.summary["files"] = files
+        finally:
+            _profile_lock.release()
+            self.acquired = False
+
+        return self.summary
+
+    def _python_summary(self) -> list:
+        stats = pstats.Stats(self._profiler)
+        rows = []
+        for (filename, line, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": nc,
+                "self_ms": round(tt * 1000.0, 3),
+                "cumulative_ms": round(ct * 1000.0, 3)
+            })
+        rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+        return rows[:PROFILE_TOP_N]
+
+    def _torch_summary(self) -> list:
+        if self._torch_profiler is None:
+            return []
+        rows = []
+        for event in self._torch_profiler.key_averages():
+            rows.append({
+                "op": event.key,
+                "calls": event.count,
+                "self_cpu_ms": round(event.self_cpu_time_total / 1000.0, 3),
+                "cpu_total_ms": round(event.cpu_time_total / 1000.0, 3)
+            })
+        rows.sort(key=lambda r: r["self_cpu_ms"], reverse=True)
+        return rows[:PROFILE_TOP_N]
+
+class ProfileMiddleware:
+    """ASGI middleware that profiles requests carrying the PROFILE_TOKEN"""
+
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+        self.active = None  # summary counters of the request being profiled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        query_params = QueryParams(scope.get("query_string", b""))
+        self.in_flight += 1
+        try:
+            if self.active is not None:
+                self.active["concurrent_requests"] += 1
+            if not profiling_requested(headers, query_params):
+                await self.app(scope, receive, send)
+                return
+            await self._profile(scope, receive, send, headers, query_params)
+        finally:
+            self.in_flight -= 1
+
+    async def _profile(self, scope, receive, send, headers, query_params):
+        label = scope["path"].strip("/").replace("/", "_") or "root"
+        profile = RequestProfile(label, dump=dump_requested(headers, query_params))
+        try:
+            status = None if profile.start() else b"busy"
+        except Exception as e:
+            print(f"⚠ Warning: Could not start profiling: {e}")
+            status = b"error"
+        if status is not None:
+            # Serve the request unprofiled and say why
+            async def status_send(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-status", status)]
+                await send(message)
+            await self.app(scope, receive, status_send)
+            return
+
+        counters = {"concurrent_requests": self.in_flight - 1}
+        self.active = counters
+        start = {}
+        chunks = []
+
+        async def buffer_send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        token = _profiling_active.set(True)
+        try:
+            await self.app(scope, receive, buffer_send)
+        finally:
+            _profiling_active.reset(token)
+            self.active = None
+            try:
+                summary = profile.stop()
+            except Exception as e:
+                print(f"⚠ Warning: Profiling failed: {e}")
+                summary = {"error": str(e)}
+            summary.update(counters)
+
+        body = b"".join(chunks)
+        response_headers = [(k, v) for k, v in start.get("headers", []) if k.lower() != b"content-length"]
+        content_type = Headers(raw=response_headers).get("content-type", "")
+        content = None
+        if content_type.startswith("application/json"):
+            try:
+                content = json.loads(body)
+            except ValueError:
+                content = None
+        if isinstance(content, dict):
+            content["profile"] = summary
+            body = json.dumps(content).encode("utf-8")
+        else:
+            # Non-JSON responses keep their body; the summary goes in a header
+            header = {"wall_ms": summary.get("wall_ms"), "concurrent_requests": summary["concurrent_requests"],
+                      "files": summary.get("files", {})}
+            response_headers.append((b"x-profile-summary", json.dumps(header).encode("utf-8")))
+        response_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        await send({"type": "http.response.start", "status": start.get("status", 500), "headers": response_headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,157 @@
+"""
+Process resource statistics for soak testing and leak hunting.
+
+process_stats() reports figures that show slow growth:
+
+- resident, peak and virtual memory (/proc/self/status)
+- glibc malloc arena usage (mallinfo2). When "free" grows alongside RSS, the
+  cause is allocator fragmentation, not live objects.
+- open file descriptors, and OS and Python thread counts
+- Python heap: allocated blocks, GC generation counts and, optionally, the
+  number of tracked objects
+
+With RUNTIME_TRACEMALLOC=<frames>, tracemalloc runs from startup, and
+allocation_growth() lists the source lines whose allocations grew most since
+its first call. tracemalloc sees Python objects and numpy buffers, but not the
+TensorFlow or PyTorch native allocators. If RSS keeps growing while the traced
+heap stays flat, look at the native side. Tracing slows the service noticeably,
+so enable it for soak runs only.
+
+Figures that cannot be read on this platform are None.
+"""
+
+import ctypes
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+RUNTIME_TRACEMALLOC = int(os.environ.get("RUNTIME_TRACEMALLOC", "0"))
+
+_STARTED = time.time()
+_BASELINE_SNAPSHOT = None
+_SNAPSHOT_LOCK = threading.Lock()
+
+class _MallInfo2(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_size_t) for name in (
+        "arena", "ordblks", "smblks", "hblks", "hblkhd", "usmblks", "fsmblks", "uordblks", "fordblks", "keepcost"
+    )]
+
+try:
+    _libc = ctypes.CDLL("libc.so.6")
+    _mallinfo2 = _libc.mallinfo2
+    _mallinfo2.restype = _MallInfo2
+except (OSError, AttributeError):
+    # Not glibc, or glibc older than 2.33
+    _mallinfo2 = None
+
+def start_tracing(frames: int = RUNTIME_TRACEMALLOC):
+    """Start tracemalloc with this many frames per allocation (0 leaves it off)"""
+    if frames > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def _proc_status() -> Dict[str, int]:
+    """/proc/self/status fields in kB (memory) or counts; empty where /proc is unavailable"""
+    fields = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                parts = value.split()
+                if parts and parts[0].isdigit():
+                    fields[key] = int(parts[0])
+    except OSError:
+        pass
+    return fields
+
+def _mb(kb: Optional[int]) -> Optional[float]:
+    return round(kb / 1024.0, 2) if kb is not None else None
+
+def open_fd_count() -> Optional[int]:
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            # listdir itself holds one descriptor open while it reads the directory
+            return len(os.listdir(fd_dir)) - 1
+        except OSError:
+            continue
+    return None
+
+def malloc_stats() -> Optional[Dict]:
+    """glibc heap: bytes obtained from the OS, in use, and free but not returned"""
+    if _mallinfo2 is None:
+        return None
+    info = _mallinfo2()
+    return {
+        "arena_mb": round(info.arena / (1024 * 1024), 2),
+        "mmapped_mb": round(info.hblkhd / (1024 * 1024), 2),
+        "in_use_mb": round(info.uordblks / (1024 * 1024), 2),
+        "free_mb": round(info.fordblks / (1024 * 1024), 2),
+        "releasable_mb": round(info.keepcost / (1024 * 1024), 2)
+    }
+
+def python_heap_stats(include_objects: bool = False) -> Dict:
+    stats = {
+        "allocated_blocks": sys.getallocatedblocks(),
+        "gc_counts": list(gc.get_count()),
+        "gc_collections": [generation["collections"] for generation in gc.get_stats()],
+        "gc_uncollectable": sum(generation["uncollectable"] for generation in gc.get_stats()),
+        "gc_garbage": len(gc.garbage),
+        # Walking every tracked object takes tens of ms on a loaded process, so it is opt-in
+        "objects": len(gc.get_objects()) if include_objects else None,
+        "tracemalloc_mb": None,
+        "tracemalloc_peak_mb": None
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats["tracemalloc_mb"] = round(current / (1024 * 1024), 2)
+        stats["tracemalloc_peak_mb"] = round(peak / (1024 * 1024), 2)
+    return stats
+
+def allocation_growth(limit: int = 10) -> Optional[List[Dict]]:
+    """Source lines whose traced allocations grew most since the first call (None without tracemalloc)"""
+    global _BASELINE_SNAPSHOT
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")
+    ))
+    with _SNAPSHOT_LOCK:
+        if _BASELINE_SNAPSHOT is None:
+            _BASELINE_SNAPSHOT = snapshot
+            return []
+        baseline = _BASELINE_SNAPSHOT
+    growth = []
+    for diff in snapshot.compare_to(baseline, "lineno")[:limit]:
+        frame = diff.traceback[0]
+        growth.append({
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_mb": round(diff.size / (1024 * 1024), 3),
+            "size_diff_mb": round(diff.size_diff / (1024 * 1024), 3),
+            "count": diff.count,
+            "count_diff": diff.count_diff
+        })
+    return growth
+
+def process_stats(include_objects: bool = False, top_allocations: int = 0) -> Dict:
+    """Memory, descriptor, thread and Python heap figures for this process"""
+    status = _proc_status()
+    stats = {
+        "pid": os.getpid(),
+        "timestamp": time.time(),
+        "uptime_s": round(time.time() - _STARTED, 1),
+        "rss_mb": _mb(status.get("VmRSS")),
+        "peak_rss_mb": _mb(status.get("VmHWM")),
+        "vms_mb": _mb(status.get("VmSize")),
+        "open_fds": open_fd_count(),
+        "threads": status.get("Threads"),
+        "python_threads": threading.active_count(),
+        "malloc": malloc_stats(),
+        "python": python_heap_stats(include_objects)
+    }
+    if top_allocations > 0:
+        stats["allocation_growth"] = allocation_growth(top_allocations)
+    return stats
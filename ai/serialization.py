@@ -0,0 +1,148 @@
+"""
+Response encoding for prediction results.
+
+Clients pick an encoding with the Accept header:
+
+- application/json (default): encoded with orjson when installed, which also
+  serializes numpy arrays natively; stdlib json otherwise
+- application/x-msgpack (or application/msgpack): MessagePack, requires msgpack
+
+Media ranges are matched exactly or by wildcard, and the encoding with the
+highest q-value wins; q=0 excludes an encoding. A request that accepts only
+MessagePack gets 406 Not Acceptable when msgpack is not installed.
+
+The "packed" batch layout sends class names once and the probabilities as one
+row per image. Under MessagePack each probability matrix is sent as raw
+little-endian float32 bytes plus its shape instead of a nested list.
+"""
+
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/msgpack", "application/vnd.msgpack")
+
+RESPONSE_LAYOUTS = ["records", "packed"]
+
+def parse_accept(accept: Optional[str]) -> List[tuple]:
+    """(media range, q) pairs of an Accept header, in header order; malformed q values count as 0"""
+    ranges = []
+    for part in (accept or "").split(","):
+        fields = part.split(";")
+        media_range = fields[0].strip().lower()
+        if not media_range:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = min(max(float(value.strip()), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        ranges.append((media_range, q))
+    return ranges
+
+def _quality(ranges: List[tuple], media_types) -> tuple:
+    """(q, position) of the most specific range matching any of media_types; (None, None) if none matches"""
+    best = (-1, None, None)
+    for position, (media_range, q) in enumerate(ranges):
+        for media_type in media_types:
+            if media_range == media_type:
+                specificity = 2
+            elif media_range == media_type.split("/")[0] + "/*":
+                specificity = 1
+            elif media_range == "*/*":
+                specificity = 0
+            else:
+                continue
+            if specificity > best[0]:
+                best = (specificity, q, position)
+    return best[1], best[2]
+
+def negotiate(accept: Optional[str]) -> str:
+    """Return "msgpack" or "json" for an Accept header value, honouring q-values
+
+    JSON is the default when the header is missing or names neither encoding; on equal q the one listed first wins.
+    A 406 is raised when nothing acceptable can be sent, including a MessagePack-only header without msgpack.
+    """
+    ranges = parse_accept(accept)
+    json_q, json_pos = _quality(ranges, (JSON_MEDIA_TYPE,))
+    msgpack_q, msgpack_pos = _quality(ranges, MSGPACK_MEDIA_TYPES)
+    if json_q is None and msgpack_q is None:
+        return "json"
+
+    # Rank by q, then by position in the header; a missing match never wins
+    def rank(q, position):
+        return (q if q is not None else -1.0, -position if position is not None else float("-inf"))
+
+    prefers_msgpack = msgpack_q and rank(msgpack_q, msgpack_pos) > rank(json_q, json_pos)
+    if prefers_msgpack and msgpack is not None:
+        return "msgpack"
+    if json_q is not None and json_q > 0:
+        return "json"
+    if json_q is None and not msgpack_q:
+        # The header only excludes MessagePack
+        return "json"
+    if msgpack_q:
+        raise HTTPException(status_code=406, detail="MessagePack responses require the msgpack package")
+    raise HTTPException(status_code=406, detail="Responses are available as application/json or application/x-msgpack")
+
+def _to_builtin(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+def render(content: Dict, encoding: str = "json", status_code: int = 200) -> Response:
+    """Encode a response body with the negotiated encoding"""
+    if encoding == "msgpack":
+        body = msgpack.packb(content, default=_to_builtin, use_bin_type=True)
+        return Response(content=body, status_code=status_code, media_type=MSGPACK_MEDIA_TYPE)
+
+    if orjson is not None:
+        body = orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        body = json.dumps(content, default=_to_builtin).encode("utf-8")
+    return Response(content=body, status_code=status_code, media_type=JSON_MEDIA_TYPE)
+
+def pack_probabilities(probs: np.ndarray, encoding: str, top_k: Optional[int] = None) -> Dict:
+    """Packed representation of an (N, classes) probability matrix"""
+    probs = np.asarray(probs, dtype=np.float32)
+    packed = {
+        "predicted": probs.argmax(axis=1).astype(np.int32) if len(probs) else np.zeros(0, dtype=np.int32),
+        "confidence": probs.max(axis=1) if len(probs) else np.zeros(0, dtype=np.float32)
+    }
+
+    if top_k is not None and top_k < probs.shape[1]:
+        indices = np.argsort(-probs, axis=1)[:, :top_k].astype(np.int32)
+        packed["top_k_indices"] = indices
+        packed["top_k_probabilities"] = np.take_along_axis(probs, indices, axis=1)
+    else:
+        packed["probabilities"] = probs
+
+    if encoding == "msgpack":
+        # Raw float32/int32 buffers with their shapes; much smaller than nested lists
+        for key, value in list(packed.items()):
+            packed[key] = {
+                "dtype": "<" + value.dtype.str[1:],
+                "shape": list(value.shape),
+                "data": value.astype(value.dtype.newbyteorder("<")).tobytes()
+            }
+    return packed
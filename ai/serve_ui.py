@@ -1,54 +1,253 @@
 #!/usr/bin/env python3
 """
-Simple HTTP server to serve the disaster analysis UI.
-This serves the HTML file and handles CORS for local development.
+HTTP server to serve the disaster analysis UI.
+Serves the HTML file and handles CORS for local development.
+
+Each connection is handled in its own thread with HTTP/1.1 keep-alive, so one
+slow client does not stall the others. Text assets up to UI_CACHE_MAX_FILE_BYTES
+are served from in-memory gzip (and brotli, if the brotli package is installed)
+variants, with at most UI_CACHE_MAX_BYTES cached in total. Everything else
+(images, model files) is streamed from disk. All files get ETag and
+Last-Modified validators and 304 responses for conditional requests.
 """
 
+import email.utils
+import gzip
+import http.client
 import http.server
-import socketserver
-import webbrowser
 import os
 import sys
+import threading
+import time
+import webbrowser
+from collections import OrderedDict
 from urllib.parse import urlparse
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {".html", ".htm", ".css", ".js", ".json", ".svg", ".txt", ".md"}
+UI_CACHE_MAX_FILE_BYTES = int(os.environ.get("UI_CACHE_MAX_FILE_BYTES", str(1024 * 1024)))
+UI_CACHE_MAX_BYTES = int(os.environ.get("UI_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+def file_validators(stat) -> dict:
+    """ETag and Last-Modified values for a file's stat result"""
+    return {
+        "key": (stat.st_mtime_ns, stat.st_size),
+        "etag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+        "last_modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+        "mtime": int(stat.st_mtime)
+    }
+
+def cacheable(path: str, size: int) -> bool:
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS and size <= UI_CACHE_MAX_FILE_BYTES
+
+class CompressedVariantCache:
+    """In-memory identity/gzip/brotli variants of small text files, refreshed when a file changes"""
+
+    def __init__(self, max_bytes: int = UI_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, stat=None):
+        """Return the cached entry for a cacheable path, (re)building it if the file changed"""
+        stat = stat or os.stat(path)
+        validators = file_validators(stat)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry["key"] == validators["key"]:
+                self._entries.move_to_end(path)
+                return entry
+
+        with open(path, "rb") as f:
+            data = f.read()
+        variants = {"identity": data, "gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(data, quality=11)
+        entry = dict(validators, variants=variants, size=sum(len(v) for v in variants.values()))
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.size_bytes -= old["size"]
+            self._entries[path] = entry
+            self.size_bytes += entry["size"]
+            # Evict the least recently served files beyond the total budget (keeping this one)
+            while self.size_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= evicted["size"]
+        return entry
+
+    def warm(self, directory: str):
+        """Precompress every cacheable file in the directory"""
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and cacheable(path, os.path.getsize(path)):
+                self.get(path)
+
+VARIANT_CACHE = CompressedVariantCache()
+
+def choose_encoding(accept_encoding: str, variants: dict) -> str:
+    """Pick the best available content coding the client accepts"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        pieces = part.strip().split(";")
+        coding = pieces[0].strip().lower()
+        q = 1.0
+        for param in pieces[1:]:
+            if param.strip().startswith("q="):
+                try:
+                    q = float(param.strip()[2:])
+                except ValueError:
+                    q = 0.0
+        if coding:
+            accepted[coding] = q
+    for coding in ("br", "gzip"):
+        if coding in variants and accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return "identity"
+
 class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    """HTTP request handler with CORS headers for local development"""
-    
+    """HTTP request handler with CORS headers, compression and cache validators"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         super().end_headers()
-    
+
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
+    def log_message(self, format, *args):
+        if not getattr(self.server, "quiet", False):
+            super().log_message(format, *args)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or not os.path.isfile(path):
+            # Directory listings, redirects and 404s use the default behaviour
+            return super().send_head()
+
+        try:
+            body = open(path, "rb")
+            stat = os.fstat(body.fileno())
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        if cacheable(path, stat.st_size):
+            body.close()
+            try:
+                entry = VARIANT_CACHE.get(path, stat)
+            except OSError:
+                self.send_error(404, "File not found")
+                return None
+            encoding = choose_encoding(self.headers.get("Accept-Encoding"), entry["variants"])
+            length = len(entry["variants"][encoding])
+        else:
+            # Large or binary files are streamed from disk with the same validators
+            entry = file_validators(stat)
+            encoding = "identity"
+            length = stat.st_size
+
+        if self._not_modified(entry):
+            body.close()
+            self.send_response(304)
+            self.send_header("ETag", entry["etag"])
+            self.send_header("Last-Modified", entry["last_modified"])
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(length))
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("ETag", entry["etag"])
+        self.send_header("Last-Modified", entry["last_modified"])
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if "variants" in entry:
+            return _BytesBody(entry["variants"][encoding])
+        return body
+
+    def _not_modified(self, entry) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or entry["etag"] in tags or f"W/{entry['etag']}" in tags
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return entry["mtime"] <= since
+        return False
+
+class _BytesBody:
+    """Minimal file-like body for SimpleHTTPRequestHandler.copyfile"""
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._sent = False
+
+    def read(self, size=-1):
+        if self._sent:
+            return b""
+        self._sent = True
+        return self._data
+
+    def close(self):
+        pass
+
+class UIServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    quiet = False
+
 def serve_ui(port=3000):
     """Start the HTTP server for the UI"""
-    
+
     # Check if the HTML file exists
     html_file = "disaster_ui.html"
     if not os.path.exists(html_file):
         print(f"Error: {html_file} not found in current directory")
         print("Make sure you're running this script from the AI directory")
         sys.exit(1)
-    
+
+    # Precompress the UI assets before accepting connections
+    VARIANT_CACHE.warm(os.getcwd())
+
     # Start the server
     handler = CORSHTTPRequestHandler
-    
+
     try:
-        with socketserver.TCPServer(("", port), handler) as httpd:
+        with UIServer(("", port), handler) as httpd:
             print(f"🌐 Starting UI server on http://localhost:{port}")
             print(f"📁 Serving files from: {os.getcwd()}")
             print(f"🎯 Main UI: http://localhost:{port}/{html_file}")
+            print(f"🗜️  Compression: gzip{' + brotli' if brotli is not None else ''}, threaded, keep-alive")
             print("\n📋 Instructions:")
             print("1. Make sure your FastAPI backend is running on http://localhost:8000")
             print("2. Open the UI in your browser")
             print("3. Upload an image and select analysis type")
             print("4. Click 'Analyze Image' to get predictions")
             print("\n🛑 Press Ctrl+C to stop the server")
-            
+
             # Try to open browser automatically
             try:
                 webbrowser.open(f"http://localhost:{port}/{html_file}")
@@ -56,12 +255,12 @@ def serve_ui(port=3000):
             except Exception as e:
                 print(f"\n⚠️  Could not open browser automatically: {e}")
                 print(f"Please manually open: http://localhost:{port}/{html_file}")
-            
+
             # Serve forever
             httpd.serve_forever()
-            
+
     except OSError as e:
-        if e.errno == 48:  # Port already in use
+        if e.errno in (48, 98):  # Port already in use (macOS, Linux)
             print(f"❌ Port {port} is already in use. Trying port {port + 1}...")
             serve_ui(port + 1)
         else:
@@ -71,16 +270,94 @@ def serve_ui(port=3000):
         print(f"\n👋 Shutting down UI server...")
         sys.exit(0)
 
+def run_benchmark(clients=50, requests_per_client=100, path="/disaster_ui.html", url=None, conditional=0.5):
+    """Load-test the UI server with many concurrent keep-alive clients"""
+    server = None
+    if url is None:
+        # Benchmark an in-process server on a free port
+        VARIANT_CACHE.warm(os.getcwd())
+        server = UIServer(("127.0.0.1", 0), CORSHTTPRequestHandler)
+        server.quiet = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+    else:
+        parsed = urlparse(url)
+        host, port = parsed.hostname, parsed.port or 80
+        path = parsed.path or path
+
+    latencies = []
+    statuses = {}
+    total_bytes = [0]
+    lock = threading.Lock()
+
+    def client(client_id):
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        etag = None
+        local_latencies = []
+        local_statuses = {}
+        local_bytes = 0
+        for i in range(requests_per_client):
+            headers = {"Accept-Encoding": "br, gzip"}
+            # A share of requests revalidate with the ETag from an earlier response
+            if etag and (i * 7 + client_id) % 100 < conditional * 100:
+                headers["If-None-Match"] = etag
+            start = time.perf_counter()
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            local_latencies.append((time.perf_counter() - start) * 1000.0)
+            etag = response.getheader("ETag") or etag
+            local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+            local_bytes += len(body)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+            total_bytes[0] += local_bytes
+
+    print(f"🏁 Benchmarking http://{host}:{port}{path} with {clients} clients x {requests_per_client} requests")
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+    print(f"  Requests: {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s)")
+    print(f"  Latency: p50 {pct(0.5):.2f} ms | p95 {pct(0.95):.2f} ms | p99 {pct(0.99):.2f} ms | max {latencies[-1]:.2f} ms")
+    print(f"  Status codes: {statuses}")
+    print(f"  Body bytes transferred: {total_bytes[0]}")
+
 if __name__ == "__main__":
     import argparse
-    
+
     parser = argparse.ArgumentParser(description="Serve the Disaster Analysis UI")
-    parser.add_argument('--port', type=int, default=3000, 
+    parser.add_argument('--port', type=int, default=3000,
                        help='Port to serve the UI on (default: 3000)')
-    
+    parser.add_argument('--bench', action='store_true',
+                       help='Benchmark the server with concurrent clients instead of serving')
+    parser.add_argument('--bench-url', default=None,
+                       help='Benchmark an already running server at this URL (default: in-process server)')
+    parser.add_argument('--clients', type=int, default=50,
+                       help='Concurrent benchmark clients (default: 50)')
+    parser.add_argument('--requests', type=int, default=100,
+                       help='Requests per benchmark client (default: 100)')
+
     args = parser.parse_args()
-    
+
     print("🌪️ Disaster Analysis UI Server")
     print("=" * 40)
-    
-    serve_ui(args.port)
\ No newline at end of file
+
+    if args.bench:
+        run_benchmark(args.clients, args.requests, url=args.bench_url)
+    else:
+        serve_ui(args.port)
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+In-memory nearest-neighbour index over DamageCNN embeddings.
+
+Vectors are L2-normalized and kept in one contiguous matrix that doubles its
+capacity as batches are added, so a search is a single matrix product rather
+than a Python loop. Scores are cosine similarities.
+
+- dtype "float32" stores the vectors as is (2 KB per 512-d vector)
+- dtype "int8" stores them scaled by 127, at a quarter of the memory. Scores
+  are then approximate, typically within 0.01 of the float32 score.
+
+With nlist > 0 the index partitions itself once it holds at least
+IVF_MIN_POINTS_PER_LIST * nlist vectors. It runs a few rounds of k-means
+(spherical k-means on the normalized vectors) to place nlist centroids and
+assigns every vector to its nearest one. A query then only scores the vectors
+in its nprobe nearest lists, which trades a little recall for speed on large
+indexes. The partitioning is refreshed whenever the index has grown fourfold
+since the last training.
+
+Every item has a string id (re-adding an id replaces its vector, and within
+one batch the last occurrence wins) and a metadata dict; searches can filter
+on metadata fields such as "incident". save() / load() use a single .npz file
+holding the vectors and JSON strings, and load it without unpickling.
+
+Usage:
+    python similarity_index.py build photos/ --output incident.npz --incident storm-2024
+    python similarity_index.py query incident.npz photos/house_12.jpg --k 5
+    python similarity_index.py bench --size 200000 --nlist 256 --nprobe 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+INDEX_DTYPES = ("float32", "int8")
+IVF_MIN_POINTS_PER_LIST = 39
+IVF_TRAIN_ITERATIONS = 10
+INT8_SCALE = 127.0
+SEARCH_CHUNK_ROWS = 65536
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Row-wise L2 normalization (zero rows stay zero)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = IVF_TRAIN_ITERATIONS,
+                     seed: int = 0) -> np.ndarray:
+    """k unit-length centroids for unit-length vectors (cosine k-means)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        # Re-seed empty lists with random points so every centroid stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+class SimilarityIndex:
+    """Cosine k-NN over a contiguous float32/int8 matrix with optional IVF partitioning"""
+
+    def __init__(self, dim: Optional[int] = None, dtype: str = "float32", nlist: int = 0, nprobe: int = 8):
+        if dtype not in INDEX_DTYPES:
+            raise ValueError(f"dtype must be one of {INDEX_DTYPES}")
+        self.dim = dim
+        self.dtype = dtype
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._vectors = None  # (capacity, dim); rows [0, size) are in use
+        self.size = 0
+        self.ids = []
+        self.metadata = []
+        self._rows = {}  # id -> row
+        self.centroids = None
+        self._lists = []  # per centroid: growable array of rows, and its fill
+        self._list_fill = None
+        self._assignment = None  # row -> list
+        self._trained_size = 0
+        self._lock = threading.RLock()
+
+    # --- storage ---
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return np.clip(np.rint(vectors * INT8_SCALE), -127, 127).astype(np.int8)
+        return vectors
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return rows.astype(np.float32) * (1.0 / INT8_SCALE)
+        return rows
+
+    def _reserve(self, needed: int):
+        capacity = 0 if self._vectors is None else len(self._vectors)
+        if needed <= capacity:
+            return
+        grown = np.empty((max(needed, capacity * 2, 1024), self.dim), dtype=np.dtype(self.dtype))
+        if self.size:
+            grown[:self.size] = self._vectors[:self.size]
+        self._vectors = grown
+        if self._assignment is not None:
+            assignment = np.full(len(grown), -1, dtype=np.int32)
+            assignment[:self.size] = self._assignment[:self.size]
+            self._assignment = assignment
+
+    def add(self, ids: List[str], vectors: np.ndarray, metadata: Optional[List[Dict]] = None) -> int:
+        """Insert or replace a batch of vectors; returns the index size"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("vectors must be (len(ids), dim)")
+        metadata = metadata if metadata is not None else [{} for _ in ids]
+        last = {item_id: i for i, item_id in enumerate(ids)}
+        if len(last) < len(ids):
+            # Repeated ids in one batch would each take a new row; keep the last occurrence like sequential adds
+            keep = sorted(last.values())
+            ids, vectors, metadata = [ids[i] for i in keep], vectors[keep], [metadata[i] for i in keep]
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"vectors have dimension {vectors.shape[1]}, the index holds {self.dim}")
+            encoded = self._encode(normalize(vectors))
+
+            rows = np.empty(len(ids), dtype=np.int64)
+            new = 0
+            for i, item_id in enumerate(ids):
+                row = self._rows.get(item_id)
+                if row is None:
+                    row = self.size + new
+                    new += 1
+                    self._rows[item_id] = row
+                    self.ids.append(item_id)
+                    self.metadata.append(metadata[i])
+                else:
+                    self.metadata[row] = metadata[i]
+                rows[i] = row
+            self._reserve(self.size + new)
+            self._vectors[rows] = encoded
+            replaced = rows[rows < self.size]
+            self.size += new
+
+            if self.centroids is not None:
+                self._assign(rows, replaced)
+            if self.nlist and self.size >= max(self.nlist * IVF_MIN_POINTS_PER_LIST, 4 * self._trained_size):
+                self.train()
+            return self.size
+
+    # --- coarse partitioning ---
+
+    def train(self, sample_size: int = 256):
+        """(Re)build the IVF partitioning from the current vectors"""
+        with self._lock:
+            if not self.nlist or self.size < self.nlist:
+                return
+            rng = np.random.default_rng(self.size)
+            limit = min(self.size, sample_size * self.nlist)
+            sample = rng.choice(self.size, size=limit, replace=False) if limit < self.size else np.arange(self.size)
+            self.centroids = spherical_kmeans(self._decode(self._vectors[sample]), self.nlist)
+            self._assignment = np.full(len(self._vectors), -1, dtype=np.int32)
+            self._lists = [np.empty(64, dtype=np.int64) for _ in range(self.nlist)]
+            self._list_fill = np.zeros(self.nlist, dtype=np.int64)
+            self._assign(np.arange(self.size), np.empty(0, dtype=np.int64))
+            self._trained_size = self.size
+
+    def _assign(self, rows: np.ndarray, replaced: np.ndarray):
+        if len(replaced):
+            # A replaced vector may move to another list; drop its old entry first
+            for row in replaced:
+                old = self._assignment[row]
+                if old >= 0:
+                    members = self._lists[old][:self._list_fill[old]]
+                    keep = members[members != row]
+                    self._lists[old][:len(keep)] = keep
+                    self._list_fill[old] = len(keep)
+        for start in range(0, len(rows), SEARCH_CHUNK_ROWS):
+            chunk = rows[start:start + SEARCH_CHUNK_ROWS]
+            lists = np.argmax(self._decode(self._vectors[chunk]) @ self.centroids.T, axis=1)
+            self._assignment[chunk] = lists
+            for list_id in np.unique(lists):
+                members = chunk[lists == list_id]
+                fill = self._list_fill[list_id]
+                if fill + len(members) > len(self._lists[list_id]):
+                    grown = np.empty(max(2 * len(self._lists[list_id]), fill + len(members)), dtype=np.int64)
+                    grown[:fill] = self._lists[list_id][:fill]
+                    self._lists[list_id] = grown
+                self._lists[list_id][fill:fill + len(members)] = members
+                self._list_fill[list_id] = fill + len(members)
+
+    # --- search ---
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """Rows in the query's nprobe nearest lists (None to scan everything)"""
+        if self.centroids is None:
+            return None
+        probe = np.argsort(-(self.centroids @ query))[:nprobe]
+        return np.concatenate([self._lists[c][:self._list_fill[c]] for c in probe])
+
+    def _top_k(self, queries: np.ndarray, rows: Optional[np.ndarray], k: int):
+        """Best k (scores, rows) per query over the given rows (or all rows), scanning in chunks"""
+        total = self.size if rows is None else len(rows)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, total, SEARCH_CHUNK_ROWS):
+            chunk_rows = np.arange(start, min(start + SEARCH_CHUNK_ROWS, total)) if rows is None \
+                else rows[start:start + SEARCH_CHUNK_ROWS]
+            block = self._vectors[start:start + len(chunk_rows)] if rows is None else self._vectors[chunk_rows]
+            scores = queries @ self._decode(block).T
+            scores = np.concatenate([best_scores, scores], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(chunk_rows, (len(queries), len(chunk_rows)))],
+                                        axis=1)
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                candidates = np.take_along_axis(candidates, keep, axis=1)
+            best_scores, best_rows = scores, candidates
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def search(self, queries: np.ndarray, k: int = 10, nprobe: Optional[int] = None,
+               where: Optional[Dict] = None, exclude: Optional[List[str]] = None) -> List[List[Dict]]:
+        """k nearest items per query as [{"id", "score", "metadata"}], best first
+
+        where keeps only items whose metadata matches every given field. exclude drops ids (e.g. the query itself).
+        """
+        queries = normalize(np.atleast_2d(queries))
+        nprobe = nprobe or self.nprobe
+        with self._lock:
+            if not self.size:
+                return [[] for _ in queries]
+            if queries.shape[1] != self.dim:
+                raise ValueError(f"queries have dimension {queries.shape[1]}, the index holds {self.dim}")
+            allowed = None
+            if where:
+                allowed = np.array([all(m.get(key) == value for key, value in where.items()) for m in self.metadata])
+            excluded = {self._rows[i] for i in exclude or [] if i in self._rows}
+            # Filtered items may be missing from the top k, so fetch extra candidates when filtering
+            fetch = min(self.size, k + len(excluded) if allowed is None else self.size)
+
+            if self.centroids is None:
+                # Exact search scores the whole query batch in one pass over the matrix
+                rows = None if allowed is None else np.flatnonzero(allowed[:self.size])
+                if rows is not None and not len(rows):
+                    return [[] for _ in queries]
+                scores, best = self._top_k(queries, rows, min(fetch, self.size if rows is None else len(rows)))
+            else:
+                scores, best = [], []
+                for query in queries:
+                    rows = self._candidates(query, nprobe)
+                    if allowed is not None:
+                        rows = rows[allowed[rows]]
+                    query_scores, query_best = self._top_k(query[None, :], rows, min(fetch, len(rows)))
+                    scores.append(query_scores[0])
+                    best.append(query_best[0])
+
+            results = []
+            for query_scores, query_best in zip(scores, best):
+                hits = []
+                for score, row in zip(query_scores, query_best):
+                    if row in excluded:
+                        continue
+                    # int8 rounding can push scores slightly past 1
+                    score = round(min(float(score), 1.0), 5)
+                    hits.append({"id": self.ids[row], "score": score, "metadata": self.metadata[row]})
+                    if len(hits) == k:
+                        break
+                results.append(hits)
+            return results
+
+    def vector(self, item_id: str) -> np.ndarray:
+        """The stored (normalized, dequantized) vector of an item"""
+        with self._lock:
+            if item_id not in self._rows:
+                raise KeyError(item_id)
+            return self._decode(self._vectors[self._rows[item_id]][None, :])[0].astype(np.float32)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stored = self.size * (self.dim or 0) * np.dtype(self.dtype).itemsize
+            fill = self._list_fill if self.centroids is not None else None
+            return {
+                "size": self.size,
+                "dim": self.dim,
+                "dtype": self.dtype,
+                "memory_mb": round(stored / (1024 * 1024), 2),
+                "capacity": 0 if self._vectors is None else len(self._vectors),
+                "nlist": self.nlist,
+                "nprobe": self.nprobe,
+                "partitioned": self.centroids is not None,
+                "list_size_mean": round(float(fill.mean()), 1) if fill is not None else None,
+                "list_size_max": int(fill.max()) if fill is not None else None
+            }
+
+    # --- persistence ---
+
+    def save(self, path: str):
+        with self._lock:
+            tmp_path = path + ".tmp.npz"
+            np.savez(tmp_path,
+                     vectors=self._vectors[:self.size] if self.size else np.empty((0, self.dim or 0), self.dtype),
+                     ids=np.array(json.dumps(self.ids)),
+                     metadata=np.array(json.dumps(self.metadata)),
+                     config=np.array(json.dumps({"dim": self.dim, "dtype": self.dtype,
+                                                 "nlist": self.nlist, "nprobe": self.nprobe})))
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, nlist: Optional[int] = None, nprobe: Optional[int] = None) -> "SimilarityIndex":
+        # Everything is stored as plain arrays and JSON strings, so loading never unpickles
+        with np.load(path, allow_pickle=False) as data:
+            config = json.loads(str(data["config"]))
+            index = cls(config["dim"], config["dtype"],
+                        config["nlist"] if nlist is None else nlist, config["nprobe"] if nprobe is None else nprobe)
+            try:
+                ids = json.loads(str(data["ids"]))
+            except ValueError:
+                raise ValueError(f"{path} stores ids as a pickled array; rebuild it with --overwrite")
+            metadata = json.loads(str(data["metadata"]))
+            vectors = data["vectors"]
+        if ids:
+            with index._lock:
+                index._reserve(len(ids))
+                # Stored rows are already normalized and encoded
+                index._vectors[:len(ids)] = vectors
+                index.ids, index.metadata, index.size = ids, metadata, len(ids)
+                index._rows = {item_id: row for row, item_id in enumerate(ids)}
+                if index.nlist and index.size >= index.nlist * IVF_MIN_POINTS_PER_LIST:
+                    index.train()
+        return index
+
+def _embed_files(paths: List[str], damage_model: str, batch_size: int):
+    """(path, embedding, damage prediction) per image, using the backend's damage model"""
+    import fastapi_backend as backend
+    backend.load_damage_model(damage_model)
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        images = {}
+        for i, path in enumerate(chunk):
+            with open(path, "rb") as f:
+                images[i] = f.read()
+        embedded = backend.embed_images(images)
+        for i, path in enumerate(chunk):
+            result = embedded[i]
+            if "error" in result:
+                print(f"⚠ Skipping {path}: {result['error']}")
+                continue
+            yield path, result["embedding"], result["damage"]
+
+def build_command(args):
+    index = SimilarityIndex.load(args.output) if os.path.exists(args.output) and not args.overwrite \
+        else SimilarityIndex(dtype=args.dtype, nlist=args.nlist, nprobe=args.nprobe)
+    paths = [os.path.join(args.images, name) for name in sorted(os.listdir(args.images)) if not name.startswith(".")]
+    ids, vectors, metadata = [], [], []
+    for path, embedding, damage in _embed_files(paths, args.damage_model, args.batch_size):
+        name = os.path.basename(path)
+        ids.append(f"{args.incident}/{name}" if args.incident else name)
+        vectors.append(embedding)
+        metadata.append({"filename": name, "incident": args.incident, "predicted_damage": damage["predicted_class"]})
+    if not ids:
+        print(f"❌ No images could be embedded from {args.images}")
+        sys.exit(1)
+    index.add(ids, np.array(vectors, dtype=np.float32), metadata)
+    index.save(args.output)
+    print(f"✅ Added {len(ids)} images; {args.output} now holds {index.size} ({index.stats()['memory_mb']} MB)")
+
+def query_command(args):
+    index = SimilarityIndex.load(args.index)
+    for path, embedding, damage in _embed_files([args.image], args.damage_model, 1):
+        print(f"🔎 {path} ({damage['predicted_class']})")
+        where = {"incident": args.incident} if args.incident else None
+        for hit in index.search(np.array([embedding]), args.k, where=where)[0]:
+            print(f"   {hit['score']:.4f}  {hit['id']}  {hit['metadata'].get('predicted_damage', '')}")
+        return
+    print(f"❌ Could not embed {args.image}")
+    sys.exit(1)
+
+def bench_command(args):
+    """Search speed and recall of float32/int8 and flat/IVF layouts on clustered random vectors"""
+    rng = np.random.default_rng(0)
+    centers = normalize(rng.standard_normal((max(16, args.size // 500), args.dim)))
+    # Noise of norm ~0.6 around unit centers, roughly as spread out as embeddings of one scene type
+    noise = 0.6 / np.sqrt(args.dim)
+    data = normalize(centers[rng.integers(0, len(centers), args.size)] +
+                     noise * rng.standard_normal((args.size, args.dim)).astype(np.float32))
+    queries = normalize(data[rng.choice(args.size, args.queries, replace=False)] +
+                        0.2 * noise * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+    ids = [str(i) for i in range(args.size)]
+
+    exact = None
+    for dtype in ("float32", "int8"):
+        for nlist in (0, args.nlist):
+            index = SimilarityIndex(args.dim, dtype, nlist=nlist, nprobe=args.nprobe)
+            start = time.perf_counter()
+            for i in range(0, args.size, args.insert_batch):
+                index.add(ids[i:i + args.insert_batch], data[i:i + args.insert_batch])
+            build_s = time.perf_counter() - start
+            start = time.perf_counter()
+            results = index.search(queries, args.k)
+            search_ms = (time.perf_counter() - start) * 1000.0 / len(queries)
+            found = [{hit["id"] for hit in hits} for hits in results]
+            if exact is None:
+                exact = found
+            recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+            layout = f"ivf{nlist}/nprobe{args.nprobe}" if nlist else "flat"
+            print(f"  {dtype:7s} {layout:18s} build {build_s:6.2f} s | {search_ms:7.3f} ms/query | "
+                  f"recall@{args.k} {recall:.3f} | {index.stats()['memory_mb']:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Similarity index over DamageCNN embeddings")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Embed a folder of images and add them to an index file")
+    build_parser.add_argument("images", help="Folder of images")
+    build_parser.add_argument("--output", default="embeddings.npz", help="Index file (extended if it exists)")
+    build_parser.add_argument("--overwrite", action="store_true", help="Start a new index instead of extending")
+    build_parser.add_argument("--incident", help="Incident name stored with every image and used in the ids")
+    build_parser.add_argument("--dtype", choices=INDEX_DTYPES, default="float32")
+    build_parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = exact search)")
+    build_parser.add_argument("--nprobe", type=int, default=8, help="Lists searched per query")
+    build_parser.add_argument("--damage-model", default="best_damage.pth")
+    build_parser.add_argument("--batch-size", type=int, default=64)
+
+    query_parser = subparsers.add_parser("query", help="Nearest indexed images to one image")
+    query_parser.add_argument("index", help="Index file written by build")
+    query_parser.add_argument("image", help="Query image")
+    query_parser.add_argument("--k", type=int, default=10)
+    query_parser.add_argument("--incident", help="Only return images from this incident")
+    query_parser.add_argument("--damage-model", default="best_damage.pth")
+
+    bench_parser = subparsers.add_parser("bench", help="Search speed and recall on synthetic vectors")
+    bench_parser.add_argument("--size", type=int, default=100000)
+    bench_parser.add_argument("--dim", type=int, default=512)
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("--k", type=int, default=10)
+    bench_parser.add_argument("--nlist", type=int, default=256)
+    bench_parser.add_argument("--nprobe", type=int, default=8)
+    bench_parser.add_argument("--insert-batch", type=int, default=1000)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if not os.path.isdir(args.images):
+            print(f"❌ Image folder not found: {args.images}")
+            sys.exit(1)
+        build_command(args)
+    elif args.command == "query":
+        query_command(args)
+    else:
+        print(f"🏁 {args.size} vectors of dimension {args.dim}, {args.queries} queries")
+        bench_command(args)
+
+if __name__ == "__main__":
+    main()
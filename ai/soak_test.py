@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Soak test: drive the service for hours and flag resource growth.
+
+`run` sends a weighted mix of requests (single-image predictions,
+/predict-batch, /predict-archive, /health) from --concurrency clients, capped
+at --rate requests/s if given. Every --sample-interval it reads
+GET /runtime-stats, from the front-end and from each replica, and records:
+
+- RSS, malloc in-use and free memory, Python heap (blocks, tracemalloc)
+- open file descriptors and thread counts
+- model registry residency
+- request latency percentiles, throughput and errors for the interval
+
+Samples before --warmup are ignored, because caches, allocator arenas and
+thread pools fill up there. After that, a metric is flagged when it rises
+steadily and by more than its limit:
+
+- steadily: Kendall's tau of the series against time is at least --min-trend
+- by more than its limit: MB/hour for memory, an absolute count for
+  descriptors and threads, and a percentage for object counts
+
+Latency drift compares the first and last quarter of the run. The report is
+rewritten after every sample, so a run that is cut short still leaves data.
+The exit status is 1 when anything is flagged. `analyze` re-checks a saved
+report with different limits.
+
+Usage:
+    python soak_test.py run photos/ --url http://localhost:8000 --duration 6h --output soak.json
+    python soak_test.py run photos/ --duration 30m --mix disaster=1,both=1 --rate 20 --warmup 5m
+    python soak_test.py analyze soak.json --max-mb-per-hour 5
+"""
+
+import argparse
+import array
+import asyncio
+import io
+import json
+import mimetypes
+import os
+import random
+import sys
+import tarfile
+import time
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+from evaluate_variants import percentiles
+
+DEFAULT_MIX = "disaster=3,damage=3,both=3,batch=1,archive=1,health=1"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+def parse_duration(value: str) -> float:
+    """Seconds from "90", "90s", "30m" or "6h" """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in REQUEST_BUILDERS:
+            raise argparse.ArgumentTypeError(f"unknown request kind {kind!r} (choose from {', '.join(REQUEST_BUILDERS)})")
+        mix[kind] = float(weight or 1)
+    return mix
+
+def _image_part(images, rng):
+    name, data = rng.choice(images)
+    return (name, data, mimetypes.guess_type(name)[0] or "image/jpeg")
+
+def _single(path):
+    return lambda images, rng, batch_size: ("POST", path, {"files": {"file": _image_part(images, rng)}})
+
+def _batch(images, rng, batch_size):
+    return ("POST", "/predict-batch", {"files": [("files", _image_part(images, rng)) for _ in range(batch_size)]})
+
+def _archive(images, rng, batch_size):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for i in range(batch_size):
+            name, data = rng.choice(images)
+            member = tarfile.TarInfo(f"{i:05d}_{name}")
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+    return ("POST", "/predict-archive", {"content": buffer.getvalue(), "headers": {"content-type": "application/x-tar"}})
+
+def _health(images, rng, batch_size):
+    return ("GET", "/health", {})
+
+REQUEST_BUILDERS = {
+    "disaster": _single("/predict-disaster"),
+    "damage": _single("/predict-damage"),
+    "both": _single("/predict-both"),
+    "batch": _batch,
+    "archive": _archive,
+    "health": _health
+}
+
+def load_images(folder: str, limit: int) -> List:
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(folder, name), "rb") as f:
+                images.append((name, f.read()))
+            if len(images) >= limit:
+                break
+    return images
+
+class SoakRecorder:
+    """Request outcomes per sampling window and per request kind for the whole run"""
+
+    def __init__(self, kinds):
+        self.window = []
+        self.kinds = {kind: {"latencies": array.array("d"), "requests": 0, "errors": 0} for kind in kinds}
+
+    def add(self, kind: str, latency_ms: float, ok: bool):
+        self.window.append((latency_ms, ok))
+        totals = self.kinds[kind]
+        totals["requests"] += 1
+        if ok:
+            totals["latencies"].append(latency_ms)
+        else:
+            totals["errors"] += 1
+
+    def take_window(self):
+        window, self.window = self.window, []
+        return window
+
+    def totals(self) -> Dict:
+        by_kind = {kind: {"requests": t["requests"], "errors": t["errors"], "latency_ms": percentiles(t["latencies"])}
+                   for kind, t in self.kinds.items()}
+        return {
+            "requests": sum(t["requests"] for t in by_kind.values()),
+            "errors": sum(t["errors"] for t in by_kind.values()),
+            "by_kind": by_kind
+        }
+
+def flatten_runtime_stats(stats: Dict) -> Dict[str, float]:
+    """Numeric series to track, keyed "server.<metric>" and "replica<i>.<metric>" """
+    metrics = {}
+
+    def add(prefix, process):
+        if not process:
+            return
+        python = process.get("python") or {}
+        malloc = process.get("malloc") or {}
+        for key, value in (
+            ("rss_mb", process.get("rss_mb")),
+            ("malloc_in_use_mb", malloc.get("in_use_mb")),
+            ("malloc_free_mb", malloc.get("free_mb")),
+            ("tracemalloc_mb", python.get("tracemalloc_mb")),
+            ("allocated_blocks", python.get("allocated_blocks")),
+            ("objects", python.get("objects")),
+            ("gc_uncollectable", python.get("gc_uncollectable")),
+            ("open_fds", process.get("open_fds")),
+            ("threads", process.get("threads")),
+            ("python_threads", process.get("python_threads")),
+            ("registry_resident_mb", process.get("registry_resident_mb"))
+        ):
+            if value is not None:
+                metrics[f"{prefix}.{key}"] = value
+
+    add("server", stats.get("process"))
+    for i, replica in enumerate(stats.get("replicas") or []):
+        add(f"replica{i}", replica)
+    if stats.get("pipeline_queued") is not None:
+        metrics["server.pipeline_queued"] = stats["pipeline_queued"]
+    return metrics
+
+def kendall_tau(values, max_points: int = 400) -> float:
+    """Rank correlation of a series with time: 1 = always rising, 0 = no trend"""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) > max_points:
+        # Average into buckets so long runs stay O(max_points^2)
+        values = np.array([bucket.mean() for bucket in np.array_split(values, max_points)])
+    n = len(values)
+    if n < 3:
+        return 0.0
+    upper = np.triu_indices(n, 1)
+    signs = np.sign(values[None, :] - values[:, None])[upper]
+    return float(signs.sum() / len(signs))
+
+def metric_limit(name: str, args):
+    """(kind, limit) of the growth check for a metric, or None for series that are only reported"""
+    metric = name.split(".", 1)[1]
+    if metric.endswith("_mb"):
+        return "mb_per_hour", args.max_mb_per_hour
+    if metric == "open_fds":
+        return "absolute", args.max_fd_growth
+    if metric in ("threads", "python_threads"):
+        return "absolute", args.max_thread_growth
+    if metric in ("allocated_blocks", "objects"):
+        return "percent", args.max_object_growth_pct
+    if metric == "gc_uncollectable":
+        return "absolute", 0
+    return None
+
+def analyze(samples: List[Dict], args) -> Dict:
+    """Trend of every metric after warmup, latency drift and the resulting flags"""
+    steady = [s for s in samples if s["t_s"] >= args.warmup_s]
+    analysis = {"steady_samples": len(steady), "metrics": {}, "latency_drift": {}, "flags": [], "notes": []}
+    if len(steady) < 8:
+        analysis["flags"].append(f"only {len(steady)} samples after warmup; run longer or sample more often")
+        return analysis
+
+    times = np.array([s["t_s"] for s in steady])
+    minutes = (times[-1] - times[0]) / 60.0
+    quarter = max(2, len(steady) // 4)
+    names = sorted({name for s in steady for name in s["metrics"]})
+    for name in names:
+        points = [(s["t_s"], s["metrics"][name]) for s in steady if name in s["metrics"]]
+        if len(points) < 8:
+            continue
+        t, values = np.array(points).T
+        first, last = float(values[:quarter].mean()), float(values[-quarter:].mean())
+        slope = float(np.polyfit(t / 3600.0, values, 1)[0]) if np.ptp(t) > 0 else 0.0
+        tau = kendall_tau(values)
+        entry = {
+            "start": round(first, 3),
+            "end": round(last, 3),
+            "growth": round(last - first, 3),
+            "growth_pct": round((last - first) / first * 100.0, 2) if first else None,
+            "slope_per_hour": round(slope, 3),
+            "trend": round(tau, 3),
+            "flagged": False
+        }
+        limit = metric_limit(name, args)
+        if limit is not None and tau >= args.min_trend:
+            kind, threshold = limit
+            if kind == "mb_per_hour" and slope > threshold:
+                entry["flagged"] = True
+                analysis["flags"].append(f"{name} grows {slope:.2f} MB/hour (trend {tau:.2f}, "
+                                         f"+{last - first:.1f} MB over {minutes:.0f} min)")
+            elif kind == "absolute" and last - first > threshold:
+                entry["flagged"] = True
+                analysis["flags"].append(f"{name} grows by {last - first:.1f} (trend {tau:.2f})")
+            elif kind == "percent" and first and (last - first) / first * 100.0 > threshold:
+                entry["flagged"] = True
+                analysis["flags"].append(f"{name} grows {(last - first) / first * 100.0:.1f}% (trend {tau:.2f})")
+        analysis["metrics"][name] = entry
+
+    for prefix in sorted({name.split(".", 1)[0] for name in analysis["metrics"]}):
+        rss = analysis["metrics"].get(f"{prefix}.rss_mb")
+        free = analysis["metrics"].get(f"{prefix}.malloc_free_mb")
+        in_use = analysis["metrics"].get(f"{prefix}.malloc_in_use_mb")
+        if rss and rss["flagged"] and free and in_use and free["growth"] > max(in_use["growth"], 0.5 * rss["growth"]):
+            analysis["notes"].append(f"{prefix}: most RSS growth is free malloc memory ({free['growth']:+.1f} MB) rather "
+                                     f"than live allocations ({in_use['growth']:+.1f} MB), which points to heap "
+                                     f"fragmentation; try MALLOC_ARENA_MAX=2 or jemalloc")
+
+    for stat in ("p50", "p95"):
+        values = [s["latency_ms"].get(stat) for s in steady if s["latency_ms"]]
+        if len(values) < 2 * quarter:
+            continue
+        first, last = float(np.median(values[:quarter])), float(np.median(values[-quarter:]))
+        drift = (last - first) / first * 100.0 if first else 0.0
+        analysis["latency_drift"][stat] = {"start_ms": round(first, 3), "end_ms": round(last, 3),
+                                           "drift_pct": round(drift, 2), "trend": round(kendall_tau(values), 3)}
+        if drift > args.max_latency_drift_pct:
+            analysis["flags"].append(f"{stat} latency drifted {drift:+.1f}% ({first:.1f} -> {last:.1f} ms)")
+
+    requests = sum(s["requests"] for s in steady)
+    errors = sum(s["errors"] for s in steady)
+    analysis["error_rate"] = round(errors / requests, 5) if requests else None
+    if requests and errors / requests > args.max_error_rate:
+        analysis["flags"].append(f"error rate {errors / requests * 100:.2f}% after warmup")
+    return analysis
+
+def print_analysis(analysis: Dict):
+    print(f"\n📈 Trends over {analysis['steady_samples']} samples after warmup")
+    for name, entry in analysis["metrics"].items():
+        if entry["growth"] == 0 and not entry["flagged"]:
+            continue
+        print(f"  {'❌' if entry['flagged'] else '  '} {name:34s} {entry['start']:>12.2f} -> {entry['end']:>12.2f} "
+              f"| {entry['slope_per_hour']:+10.2f}/h | trend {entry['trend']:+.2f}")
+    for stat, drift in analysis["latency_drift"].items():
+        print(f"     latency {stat}: {drift['start_ms']:.2f} -> {drift['end_ms']:.2f} ms ({drift['drift_pct']:+.1f}%)")
+    for note in analysis.get("notes", []):
+        print(f"💡 {note}")
+    if analysis["flags"]:
+        print("❌ Soak test flagged:")
+        for flag in analysis["flags"]:
+            print(f"   - {flag}")
+    else:
+        print("✅ No steady growth in memory, descriptors, threads or latency")
+
+async def soak(args) -> Dict:
+    images = load_images(args.images, args.max_images)
+    mix = args.mix
+    kinds, weights = list(mix), list(mix.values())
+    recorder = SoakRecorder(kinds)
+    rng = random.Random(args.seed)
+    samples = []
+    report = {
+        "url": args.url,
+        "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": {"duration_s": args.duration_s, "warmup_s": args.warmup_s, "concurrency": args.concurrency,
+                     "rate": args.rate, "mix": mix, "batch_size": args.batch_size,
+                     "sample_interval_s": args.sample_interval_s, "images": len(images)},
+        "samples": samples
+    }
+    start = time.perf_counter()
+    deadline = start + args.duration_s
+    next_slot = [start]
+
+    limits = httpx.Limits(max_connections=args.concurrency + 2, max_keepalive_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout, limits=limits) as client:
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                if args.rate:
+                    now = time.perf_counter()
+                    slot = max(now, next_slot[0])
+                    next_slot[0] = slot + 1.0 / args.rate
+                    if slot > now:
+                        await asyncio.sleep(slot - now)
+                kind = rng.choices(kinds, weights)[0]
+                method, path, kwargs = REQUEST_BUILDERS[kind](images, rng, args.batch_size)
+                sent = time.perf_counter()
+                try:
+                    response = await client.request(method, path, **kwargs)
+                    await response.aread()
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                recorder.add(kind, (time.perf_counter() - sent) * 1000.0, ok)
+
+        async def take_sample(top: int = 0) -> Dict:
+            params = {"objects": "true" if args.count_objects else "false", "top": top}
+            try:
+                response = await client.get("/runtime-stats", params=params)
+                response.raise_for_status()
+                stats = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                print(f"⚠ Could not read /runtime-stats: {e}")
+                stats = {}
+            window = recorder.take_window()
+            elapsed = time.perf_counter() - start
+            interval = elapsed - (samples[-1]["t_s"] if samples else 0.0)
+            sample = {
+                "t_s": round(elapsed, 1),
+                "requests": len(window),
+                "errors": sum(1 for _, ok in window if not ok),
+                "throughput": round(len(window) / interval, 2) if interval > 0 else None,
+                "latency_ms": percentiles([latency for latency, ok in window if ok]),
+                "metrics": flatten_runtime_stats(stats)
+            }
+            samples.append(sample)
+            return stats
+
+        await take_sample()
+        workers = [asyncio.ensure_future(worker()) for _ in range(args.concurrency)]
+        baseline_marked = False
+        try:
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(min(args.sample_interval_s, max(0.0, deadline - time.perf_counter())))
+                # The first call after warmup sets the allocation baseline that the last one is compared with
+                top = args.top_allocations if not baseline_marked and time.perf_counter() - start >= args.warmup_s else 0
+                await take_sample(top)
+                baseline_marked = baseline_marked or bool(top)
+                sample = samples[-1]
+                metrics = sample["metrics"]
+                clock = time.strftime("%H:%M:%S", time.gmtime(sample["t_s"]))
+                print(f"⏱ {clock} rss {metrics.get('server.rss_mb', 0):.1f} MB | fds {metrics.get('server.open_fds')} | "
+                      f"threads {metrics.get('server.threads')} | p95 {sample['latency_ms'].get('p95', 0):.1f} ms | "
+                      f"{sample['throughput']} req/s | {sample['errors']} errors")
+                if args.output:
+                    report["totals"] = recorder.totals()
+                    with open(args.output, "w") as f:
+                        json.dump(report, f, indent=2)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        if baseline_marked:
+            final = await take_sample(args.top_allocations)
+            report["allocation_growth"] = {
+                "server": (final.get("process") or {}).get("allocation_growth"),
+                "replicas": [r.get("allocation_growth") for r in final.get("replicas") or []]
+            }
+
+    report["duration_s"] = round(time.perf_counter() - start, 1)
+    report["totals"] = recorder.totals()
+    return report
+
+def add_threshold_args(parser):
+    parser.add_argument("--warmup", dest="warmup_s", type=parse_duration, default=parse_duration("10m"),
+                        help="Ignore samples before this (default: 10m)")
+    parser.add_argument("--min-trend", type=float, default=0.6,
+                        help="Kendall tau from which growth counts as steady (default: 0.6)")
+    parser.add_argument("--max-mb-per-hour", type=float, default=10.0,
+                        help="Memory growth limit for RSS, malloc and heap series (default: 10)")
+    parser.add_argument("--max-fd-growth", type=float, default=2, help="Open file descriptor growth limit")
+    parser.add_argument("--max-thread-growth", type=float, default=2, help="Thread count growth limit")
+    parser.add_argument("--max-object-growth-pct", type=float, default=5.0,
+                        help="Growth limit for Python allocated blocks and object counts")
+    parser.add_argument("--max-latency-drift-pct", type=float, default=25.0,
+                        help="Limit for p50/p95 latency growth from the first to the last quarter")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Error rate limit after warmup")
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running soak test with resource growth detection")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Drive the service and sample its resource usage")
+    run_parser.add_argument("images", help="Folder of images to send")
+    run_parser.add_argument("--url", default="http://localhost:8000")
+    run_parser.add_argument("--duration", dest="duration_s", type=parse_duration, default=parse_duration("6h"),
+                            help="How long to run, e.g. 90m or 12h (default: 6h)")
+    run_parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                            help=f"Request kinds and weights (default: {DEFAULT_MIX})")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="Simultaneous requests")
+    run_parser.add_argument("--rate", type=float, default=0, help="Cap on requests/s across clients (default: none)")
+    run_parser.add_argument("--batch-size", type=int, default=16, help="Images per batch and archive request")
+    run_parser.add_argument("--sample-interval", dest="sample_interval_s", type=parse_duration, default=30.0,
+                            help="Seconds between /runtime-stats samples (default: 30)")
+    run_parser.add_argument("--count-objects", action="store_true",
+                            help="Also count GC-tracked objects in every sample (slow on a large heap)")
+    run_parser.add_argument("--top-allocations", type=int, default=0,
+                            help="Report the N fastest-growing allocation sites (server needs RUNTIME_TRACEMALLOC)")
+    run_parser.add_argument("--max-images", type=int, default=200, help="Images to load from the folder")
+    run_parser.add_argument("--timeout", type=float, default=120.0)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default="soak_report.json", help="JSON report, rewritten after every sample")
+    add_threshold_args(run_parser)
+
+    analyze_parser = subparsers.add_parser("analyze", help="Re-check a saved soak report")
+    analyze_parser.add_argument("report", help="Report written by `run`")
+    analyze_parser.add_argument("--output", help="Write the report with the new analysis here")
+    add_threshold_args(analyze_parser)
+
+    args = parser.parse_args()
+
+    if args.command == "analyze":
+        with open(args.report, "r") as f:
+            report = json.load(f)
+        if "--warmup" not in sys.argv:
+            args.warmup_s = report.get("settings", {}).get("warmup_s", args.warmup_s)
+    else:
+        if not os.path.isdir(args.images):
+            print(f"❌ Image folder not found: {args.images}")
+            sys.exit(1)
+        if not load_images(args.images, 1):
+            print(f"❌ No images in {args.images}")
+            sys.exit(1)
+        print(f"🏁 Soaking {args.url} for {args.duration_s / 3600.0:.2f} h with {args.concurrency} clients "
+              f"({', '.join(f'{k}={v:g}' for k, v in args.mix.items())})")
+        report = asyncio.run(soak(args))
+
+    report["analysis"] = analyze(report["samples"], args)
+    report["analysis"]["thresholds"] = {key: getattr(args, key) for key in (
+        "warmup_s", "min_trend", "max_mb_per_hour", "max_fd_growth", "max_thread_growth",
+        "max_object_growth_pct", "max_latency_drift_pct", "max_error_rate")}
+    print_analysis(report["analysis"])
+    for location in (report.get("allocation_growth") or {}).get("server") or []:
+        print(f"   {location['size_diff_mb']:+9.3f} MB {location['count_diff']:+8d} blocks  {location['location']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+
+    if report["analysis"]["flags"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Checks for the streaming archive readers: QueueReader backpressure and
+timeouts, and the tar/zip/NPY member readers.
+
+Usage:
+    python test_archive_ingest.py
+"""
+
+import asyncio
+import io
+import sys
+import tarfile
+import threading
+import zipfile
+
+import numpy as np
+
+from archive_ingest import QueueReader, iter_archive, iter_npy_frames
+
+def npy_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+def chunked(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def test_reader_returns_fed_bytes_in_order():
+    data = bytes(range(256)) * 64
+    reader = QueueReader(max_chunks=2, timeout=5)
+
+    def produce():
+        for chunk in chunked(data, 1000):
+            reader.feed(chunk)
+        reader.feed(None)
+
+    thread = threading.Thread(target=produce)
+    thread.start()
+    assert reader.read() == data
+    thread.join(5)
+
+def test_feed_async_waits_for_queue_space():
+    data = b"x" * 10000
+    reader = QueueReader(max_chunks=1, timeout=5)
+    received = []
+    consumer = threading.Thread(target=lambda: received.append(reader.read()))
+    consumer.start()
+
+    async def produce():
+        for chunk in chunked(data, 100):
+            assert await reader.feed_async(chunk)
+        assert await reader.feed_async(None)
+
+    asyncio.run(produce())
+    consumer.join(5)
+    assert received == [data]
+
+def test_feed_async_stops_when_abandoned():
+    reader = QueueReader(max_chunks=1, timeout=5)
+
+    async def produce():
+        assert await reader.feed_async(b"a")
+        asyncio.get_running_loop().call_later(0.05, reader.abandon)
+        return await reader.feed_async(b"b")
+
+    assert asyncio.run(produce()) is False
+
+def test_read_times_out_without_data():
+    reader = QueueReader(timeout=0.05)
+    try:
+        reader.read(10)
+        raise AssertionError("a stalled upload should time out")
+    except TimeoutError:
+        pass
+
+def test_npy_frames_stream_one_at_a_time():
+    frames = np.random.default_rng(0).integers(0, 256, (5, 4, 6, 3), dtype=np.uint8)
+    chunks = chunked(npy_bytes(frames), 7)
+    # Small uneven chunks split the header and the frames across reads
+    reader = QueueReader(max_chunks=len(chunks) + 1, timeout=5)
+    for chunk in chunks:
+        reader.feed(chunk)
+    reader.feed(None)
+    decoded = list(iter_npy_frames(reader))
+    assert [name for name, _ in decoded] == [f"frame_{i:06d}" for i in range(5)]
+    assert all(np.array_equal(frame, frames[i]) for i, (_, frame) in enumerate(decoded))
+
+def test_npy_rejects_wrong_layout_and_truncation():
+    for bad in (np.zeros((2, 4, 4, 3), dtype=np.float32), np.zeros((2, 4, 4), dtype=np.uint8)):
+        try:
+            list(iter_npy_frames(io.BytesIO(npy_bytes(bad))))
+            raise AssertionError(f"{bad.dtype} {bad.shape} should be rejected")
+        except ValueError:
+            pass
+    data = npy_bytes(np.zeros((3, 4, 4, 3), dtype=np.uint8))
+    try:
+        list(iter_npy_frames(io.BytesIO(data[:-10])))
+        raise AssertionError("a truncated stack should be rejected")
+    except ValueError as e:
+        assert "truncated" in str(e)
+
+def test_tar_and_zip_yield_only_images():
+    members = {"a.jpg": b"jpeg", "notes.txt": b"text", "dir/b.PNG": b"png"}
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode="w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+    expected = [("a.jpg", b"jpeg"), ("dir/b.PNG", b"png")]
+    for archive_format, buffer in (("tar", tar_buffer), ("zip", zip_buffer)):
+        buffer.seek(0)
+        assert list(iter_archive(buffer, archive_format)) == expected, archive_format
+
+TESTS = [
+    test_reader_returns_fed_bytes_in_order,
+    test_feed_async_waits_for_queue_space,
+    test_feed_async_stops_when_abandoned,
+    test_read_times_out_without_data,
+    test_npy_frames_stream_one_at_a_time,
+    test_npy_rejects_wrong_layout_and_truncation,
+    test_tar_and_zip_yield_only_images
+]
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -19,8 +19,8 @@ def main():
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     # Create model and load checkpoint
-    model = create_damage_model().to(device)
     checkpoint = torch.load(model_path, map_location=device)
+    model = create_damage_model(**checkpoint.get('model_config', {})).to(device)
     model.load_state_dict(checkpoint['model_state_dict'])
     model.eval()
 
@@ -0,0 +1,144 @@
+"""
+Checks for the staged inference pipeline: results, errors, cancellation and shutdown.
+
+Usage:
+    python test_inference_pipeline.py
+"""
+
+import asyncio
+import queue
+import sys
+import threading
+import time
+
+from inference_pipeline import InferencePipeline, PipelineStage, StageError
+
+def double(items):
+    return [item * 2 for item in items]
+
+def make_pipeline(infer=double, **infer_options) -> InferencePipeline:
+    return InferencePipeline([
+        PipelineStage("decode", lambda items: list(items), workers=1, queue_size=8),
+        PipelineStage("infer", infer, workers=1, queue_size=8, **infer_options)
+    ]).start()
+
+def live_workers(name: str) -> int:
+    return sum(1 for thread in threading.enumerate() if thread.name.startswith(f"pipeline-{name}-"))
+
+def test_results_follow_their_payloads():
+    pipeline = make_pipeline(batch_size=4, batch_wait_ms=5)
+    try:
+        futures = [pipeline.submit(i) for i in range(20)]
+        assert [f.result(timeout=5) for f in futures] == [i * 2 for i in range(20)]
+        stages = pipeline.stats()["stages"]
+        assert stages[1]["items"] == 20 and stages[1]["failed"] == 0
+    finally:
+        pipeline.close()
+
+def test_item_error_fails_only_that_item():
+    pipeline = make_pipeline(lambda items: [ValueError("bad") if item == 3 else item for item in items])
+    try:
+        futures = [pipeline.submit(i) for i in range(5)]
+        for i, future in enumerate(futures):
+            if i == 3:
+                try:
+                    future.result(timeout=5)
+                    raise AssertionError("item 3 should fail")
+                except StageError as e:
+                    assert e.stage == "infer" and "bad" in str(e)
+            else:
+                assert future.result(timeout=5) == i
+    finally:
+        pipeline.close()
+
+def test_wrong_result_count_fails_the_batch():
+    pipeline = make_pipeline(lambda items: items[:1], batch_size=4, batch_wait_ms=50)
+    try:
+        futures = [pipeline.submit(i) for i in range(3)]
+        for future in futures:
+            try:
+                future.result(timeout=5)
+                raise AssertionError("a short result list must not resolve any future")
+            except StageError as e:
+                assert "results" in str(e)
+        # The stage keeps serving after the failed batch
+        assert pipeline.submit(7).result(timeout=5) == 7
+    finally:
+        pipeline.close()
+
+def test_cancelled_request_does_not_stop_the_workers():
+    def slow(items):
+        time.sleep(0.2)
+        return double(items)
+
+    pipeline = make_pipeline(slow)
+    try:
+        async def scenario():
+            try:
+                await asyncio.wait_for(asyncio.wrap_future(pipeline.submit(1)), 0.05)
+                raise AssertionError("the first request should time out")
+            except asyncio.TimeoutError:
+                pass
+            return await asyncio.wait_for(asyncio.wrap_future(pipeline.submit(2)), 5)
+
+        assert asyncio.run(scenario()) == 4
+        assert live_workers("infer") == 1
+        time.sleep(0.3)
+        assert live_workers("infer") == 1
+        assert pipeline.stats()["stages"][1]["cancelled"] == 1
+    finally:
+        pipeline.close()
+
+def test_nonblocking_submit_raises_when_full():
+    gate = threading.Event()
+
+    def blocked(items):
+        gate.wait(5)
+        return items
+
+    pipeline = InferencePipeline([PipelineStage("only", blocked, workers=1, queue_size=1)]).start()
+    try:
+        first = pipeline.submit(0)
+        deadline = time.time() + 5
+        while pipeline.stages[0].queue.qsize() and time.time() < deadline:
+            time.sleep(0.01)  # wait for the worker to take the first item
+        pipeline.submit(1, block=False)
+        try:
+            pipeline.submit(2, block=False)
+            raise AssertionError("a full queue should raise queue.Full")
+        except queue.Full:
+            pass
+        gate.set()
+        assert first.result(timeout=5) == 0
+    finally:
+        gate.set()
+        pipeline.close()
+
+def test_close_stops_every_worker():
+    pipeline = InferencePipeline([PipelineStage("closing", double, workers=3)]).start()
+    assert pipeline.submit(2).result(timeout=5) == 4
+    pipeline.close()
+    assert live_workers("closing") == 0
+
+TESTS = [
+    test_results_follow_their_payloads,
+    test_item_error_fails_only_that_item,
+    test_wrong_result_count_fails_the_batch,
+    test_cancelled_request_does_not_stop_the_workers,
+    test_nonblocking_submit_raises_when_full,
+    test_close_stops_every_worker
+]
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Checks for Accept header negotiation and response encoding.
+
+Usage:
+    python test_serialization.py
+"""
+
+import json
+import sys
+
+import numpy as np
+from fastapi import HTTPException
+
+import serialization
+from serialization import negotiate, parse_accept, render
+
+def negotiated(accept, msgpack_installed: bool):
+    """negotiate() with or without msgpack; the status code instead of raising"""
+    installed = serialization.msgpack
+    serialization.msgpack = installed if msgpack_installed else None
+    try:
+        return negotiate(accept)
+    except HTTPException as e:
+        return e.status_code
+    finally:
+        serialization.msgpack = installed
+
+def test_parse_accept():
+    assert parse_accept("application/json;q=0.5, Application/X-Msgpack, */*;q=bad") == [
+        ("application/json", 0.5), ("application/x-msgpack", 1.0), ("*/*", 0.0)
+    ]
+    assert parse_accept(None) == [] and parse_accept("") == []
+
+def test_json_is_the_default():
+    for accept in (None, "", "*/*", "text/html", "application/json"):
+        assert negotiated(accept, True) == "json", accept
+
+def test_q_values_and_order():
+    assert negotiated("application/json;q=1, application/x-msgpack;q=0.1", True) == "json"
+    assert negotiated("application/json;q=0.1, application/x-msgpack", True) == "msgpack"
+    assert negotiated("application/x-msgpack, application/json", True) == "msgpack"
+    assert negotiated("application/json, application/x-msgpack", True) == "json"
+    # The exact type outranks a wildcard
+    assert negotiated("application/*;q=0.2, application/msgpack;q=0.5", True) == "msgpack"
+
+def test_not_acceptable():
+    assert negotiated("application/json;q=0", True) == 406
+    assert negotiated("application/json;q=0", False) == 406
+    assert negotiated("application/x-msgpack;q=0, application/json;q=0", True) == 406
+
+def test_msgpack_only_without_the_package():
+    assert negotiated("application/x-msgpack", False) == 406
+    assert negotiated("application/vnd.msgpack", False) == 406
+    # A lower-ranked JSON fallback is used instead
+    assert negotiated("application/x-msgpack, */*;q=0.1", False) == "json"
+    assert negotiated("application/x-msgpack;q=0", False) == "json"
+
+def test_render_json_handles_numpy():
+    response = render({"probs": np.array([0.25, 0.75], dtype=np.float32), "n": np.int64(2)})
+    assert response.media_type.startswith("application/json")
+    assert json.loads(response.body) == {"probs": [0.25, 0.75], "n": 2}
+
+TESTS = [
+    test_parse_accept,
+    test_json_is_the_default,
+    test_q_values_and_order,
+    test_not_acceptable,
+    test_msgpack_only_without_the_package,
+    test_render_json_handles_numpy
+]
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
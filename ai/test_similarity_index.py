@@ -0,0 +1,128 @@
+"""
+Checks for the embedding similarity index: exact and IVF search, int8 storage,
+filters, duplicate ids and save/load.
+
+Usage:
+    python test_similarity_index.py
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from similarity_index import IVF_MIN_POINTS_PER_LIST, SimilarityIndex, normalize
+
+def clustered_vectors(count: int, dim: int = 32, clusters: int = 16, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, dim)))
+    return normalize(centers[rng.integers(0, clusters, count)] + 0.05 * rng.standard_normal((count, dim)))
+
+def brute_force(data: np.ndarray, query: np.ndarray, k: int) -> list:
+    return list(np.argsort(-(data @ normalize(query[None, :])[0]))[:k])
+
+def test_exact_search_matches_brute_force():
+    data = clustered_vectors(500)
+    index = SimilarityIndex()
+    index.add([str(i) for i in range(len(data))], data)
+    for query in data[:10]:
+        hits = index.search(query, k=5)[0]
+        assert [hit["id"] for hit in hits] == [str(i) for i in brute_force(data, query, 5)]
+        assert hits[0]["score"] == 1.0
+
+def test_int8_scores_are_close_to_float32():
+    data = clustered_vectors(300)
+    exact, quantized = SimilarityIndex(dtype="float32"), SimilarityIndex(dtype="int8")
+    ids = [str(i) for i in range(len(data))]
+    exact.add(ids, data)
+    quantized.add(ids, data)
+    assert quantized.stats()["memory_mb"] < exact.stats()["memory_mb"]
+    for query in data[:10]:
+        expected = {hit["id"]: hit["score"] for hit in exact.search(query, k=20)[0]}
+        for hit in quantized.search(query, k=5)[0]:
+            assert hit["id"] in expected and abs(hit["score"] - expected[hit["id"]]) < 0.02
+
+def test_ivf_partitions_and_keeps_recall():
+    nlist = 4
+    data = clustered_vectors(nlist * IVF_MIN_POINTS_PER_LIST * 2)
+    index = SimilarityIndex(nlist=nlist, nprobe=2)
+    ids = [str(i) for i in range(len(data))]
+    for start in range(0, len(data), 50):
+        index.add(ids[start:start + 50], data[start:start + 50])
+    assert index.stats()["partitioned"]
+    assert round(index.stats()["list_size_mean"] * nlist) == len(data)
+    recall = np.mean([
+        len({hit["id"] for hit in index.search(query, k=10)[0]} & {str(i) for i in brute_force(data, query, 10)}) / 10
+        for query in data[:20]
+    ])
+    assert recall >= 0.9, recall
+
+def test_where_and_exclude():
+    data = clustered_vectors(100)
+    metadata = [{"incident": "a" if i % 2 else "b"} for i in range(len(data))]
+    index = SimilarityIndex()
+    index.add([str(i) for i in range(len(data))], data, metadata)
+    hits = index.search(data[1], k=10, where={"incident": "a"})[0]
+    assert hits and all(hit["metadata"]["incident"] == "a" for hit in hits)
+    hits = index.search(data[1], k=5, exclude=["1"])[0]
+    assert len(hits) == 5 and "1" not in {hit["id"] for hit in hits}
+    assert index.search(data[1], k=5, where={"incident": "none"})[0] == []
+
+def test_readding_an_id_replaces_it():
+    data = clustered_vectors(3)
+    index = SimilarityIndex()
+    index.add(["x", "y"], data[:2], [{"n": 0}, {"n": 1}])
+    index.add(["x"], data[2:3], [{"n": 2}])
+    assert index.size == 2
+    assert np.allclose(index.vector("x"), data[2], atol=1e-6)
+    assert index.search(data[2], k=1)[0][0]["metadata"] == {"n": 2}
+
+def test_duplicate_ids_in_one_batch_keep_the_last():
+    data = clustered_vectors(3)
+    index = SimilarityIndex()
+    assert index.add(["a", "b", "a"], data, [{"n": 0}, {"n": 1}, {"n": 2}]) == 2
+    assert sorted(index.ids) == ["a", "b"]
+    assert np.allclose(index.vector("a"), data[2], atol=1e-6)
+    assert {hit["id"] for hit in index.search(data[0], k=5)[0]} == {"a", "b"}
+
+def test_save_and_load_round_trip():
+    data = clustered_vectors(200)
+    index = SimilarityIndex(dtype="int8", nlist=2, nprobe=2)
+    index.add([f"incident/{i}" for i in range(len(data))], data, [{"i": i} for i in range(len(data))])
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.npz")
+        index.save(path)
+        with np.load(path, allow_pickle=False) as stored:
+            assert all(stored[key].dtype != object for key in stored.files)
+        loaded = SimilarityIndex.load(path)
+        assert loaded.ids == index.ids and loaded.metadata == index.metadata
+        assert loaded.stats()["dtype"] == "int8" and loaded.stats()["partitioned"] == index.stats()["partitioned"]
+        assert loaded.search(data[5], k=3) == index.search(data[5], k=3)
+
+        SimilarityIndex().save(path)
+        assert SimilarityIndex.load(path).size == 0
+
+TESTS = [
+    test_exact_search_matches_brute_force,
+    test_int8_scores_are_close_to_float32,
+    test_ivf_partitions_and_keeps_recall,
+    test_where_and_exclude,
+    test_readding_an_id_replaces_it,
+    test_duplicate_ids_in_one_batch_keep_the_last,
+    test_save_and_load_round_trip
+]
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Joint TensorFlow / PyTorch thread configuration.
+
+Both frameworks size their intra-op and inter-op pools to every core by default,
+so one process running both models (and several uvicorn workers on one host)
+oversubscribes the CPU. apply_thread_config() sets all four pool sizes together
+from, in order of precedence:
+
+    1. TF_INTRA_OP_THREADS / TF_INTER_OP_THREADS / TORCH_INTRA_OP_THREADS /
+       TORCH_INTER_OP_THREADS environment variables
+    2. The JSON file named by $THREAD_CONFIG (default: thread_config.json)
+    3. An even split of the cores across $WEB_CONCURRENCY workers
+
+Usage:
+    python thread_config.py show
+    python thread_config.py tune --cores 16 --workers 4 --output thread_config.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_CONFIG_PATH = "thread_config.json"
+
+ENV_KEYS = {
+    "tf_intra": "TF_INTRA_OP_THREADS",
+    "tf_inter": "TF_INTER_OP_THREADS",
+    "torch_intra": "TORCH_INTRA_OP_THREADS",
+    "torch_inter": "TORCH_INTER_OP_THREADS"
+}
+
+def available_cores() -> int:
+    """Number of cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def default_plan(cores: int, workers: int) -> dict:
+    """Split cores evenly across workers; both models run one after the other, so they share the budget"""
+    budget = max(1, cores // max(1, workers))
+    return {
+        "tf_intra": budget,
+        "tf_inter": 1,
+        "torch_intra": budget,
+        "torch_inter": 1
+    }
+
+def resolve_thread_config(path: str = None) -> dict:
+    """Work out the thread counts to use for this process"""
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    config = default_plan(available_cores(), workers)
+    config["source"] = "default"
+
+    path = path or os.environ.get("THREAD_CONFIG", DEFAULT_CONFIG_PATH)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            saved = json.load(f)
+        config.update({key: int(saved[key]) for key in ENV_KEYS if key in saved})
+        config["source"] = path
+
+    for key, env_name in ENV_KEYS.items():
+        if os.environ.get(env_name):
+            config[key] = int(os.environ[env_name])
+            config["source"] = "environment"
+    return config
+
+def apply_thread_config(config: dict = None) -> dict:
+    """Set TensorFlow and PyTorch pool sizes. Must run before either framework executes an op"""
+    config = config or resolve_thread_config()
+
+    try:
+        import torch
+        torch.set_num_threads(config["torch_intra"])
+        try:
+            torch.set_num_interop_threads(config["torch_inter"])
+        except RuntimeError as e:
+            print(f"⚠ Warning: Could not set torch inter-op threads: {e}")
+    except ImportError:
+        pass
+
+    try:
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(config["tf_intra"])
+            tf.config.threading.set_inter_op_parallelism_threads(config["tf_inter"])
+        except RuntimeError as e:
+            print(f"⚠ Warning: Could not set TensorFlow threads: {e}")
+    except ImportError:
+        pass
+
+    return config
+
+def _bench_worker(args):
+    """Benchmark one worker process under the given config and print a JSON result line"""
+    # fastapi_backend applies the thread config on import, so hand it over through the environment
+    config = json.loads(args.config)
+    for key, env_name in ENV_KEYS.items():
+        os.environ[env_name] = str(config[key])
+
+    import numpy as np
+    import torch
+    import fastapi_backend as backend
+
+    backend.load_disaster_model(args.disaster_model)
+    backend.load_damage_model(args.damage_model)
+
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, size=(args.batch_size, 64, 64, 3), dtype=np.uint8)
+    disaster_batch = images.astype("float32") / 255.0
+    damage_batch = torch.from_numpy(np.ascontiguousarray(disaster_batch.transpose(0, 3, 1, 2)))
+
+    def step():
+        backend.predict_disaster_probs(disaster_batch)
+        backend.predict_damage_probs(damage_batch)
+
+    for _ in range(args.warmup):
+        step()
+
+    latencies = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        step()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+
+    print(json.dumps({"latencies_ms": latencies, "batch_size": args.batch_size}))
+
+def candidate_configs(cores: int, workers: int) -> list:
+    """Candidate pool sizes to try for one worker's share of the cores"""
+    budget = max(1, cores // max(1, workers))
+    intra = sorted({1, budget} | {n for n in (2, 4, 8, 16, 32) if n < budget} | {max(1, budget // 2)})
+    inter = [1, 2] if budget > 1 else [1]
+    return [
+        {"tf_intra": t, "tf_inter": ti, "torch_intra": p, "torch_inter": pi}
+        for t, p, ti, pi in itertools.product(intra, intra, inter, inter)
+    ]
+
+def benchmark_config(config: dict, args) -> dict:
+    """Run `workers` concurrent benchmark processes pinned to the first `cores` CPUs"""
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "_bench",
+        "--config", json.dumps(config),
+        "--disaster-model", args.disaster_model,
+        "--damage-model", args.damage_model,
+        "--iterations", str(args.iterations),
+        "--warmup", str(args.warmup),
+        "--batch-size", str(args.batch_size)
+    ]
+    cpus = sorted(os.sched_getaffinity(0))[:args.cores] if hasattr(os, "sched_getaffinity") else None
+
+    def pin():
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+
+    start = time.perf_counter()
+    procs = [
+        subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                         preexec_fn=pin if cpus else None)
+        for _ in range(args.workers)
+    ]
+    latencies = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"Benchmark worker failed for {config}")
+        latencies.extend(json.loads(out.strip().splitlines()[-1])["latencies_ms"])
+    wall = time.perf_counter() - start
+
+    latencies = sorted(latencies)
+    total_images = len(latencies) * args.batch_size
+    busy = sum(latencies) / 1000.0 / args.workers
+    return {
+        "config": config,
+        "images_per_s": total_images / busy if busy else 0.0,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "wall_s": wall
+    }
+
+def tune(args):
+    candidates = candidate_configs(args.cores, args.workers)
+    print(f"🔧 Tuning for {args.cores} cores x {args.workers} workers: {len(candidates)} candidates")
+
+    results = []
+    for config in candidates:
+        try:
+            result = benchmark_config(config, args)
+        except RuntimeError as e:
+            print(f"  ✗ {e}")
+            continue
+        results.append(result)
+        print(f"  {config} -> {result['images_per_s']:.1f} img/s, p95 {result['p95_ms']:.1f} ms")
+
+    if not results:
+        print("❌ No candidate configuration could be benchmarked")
+        sys.exit(1)
+
+    best = max(results, key=lambda r: (r["images_per_s"], -r["p95_ms"]))
+    output = dict(best["config"])
+    output.update({
+        "cores": args.cores,
+        "workers": args.workers,
+        "images_per_s": round(best["images_per_s"], 2),
+        "p95_ms": round(best["p95_ms"], 3),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    })
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+
+    print(f"\n✅ Best: {best['config']} ({best['images_per_s']:.1f} img/s, p95 {best['p95_ms']:.1f} ms)")
+    print(f"   Written to {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="TensorFlow / PyTorch thread configuration")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("show", help="Show the configuration this process would use")
+
+    tune_parser = subparsers.add_parser("tune", help="Benchmark candidate configurations and save the best")
+    bench_parser = subparsers.add_parser("_bench")
+    bench_parser.add_argument("--config", required=True)
+
+    for sub in (tune_parser, bench_parser):
+        sub.add_argument("--disaster-model", default="disaster.h5")
+        sub.add_argument("--damage-model", default="best_damage.pth")
+        sub.add_argument("--iterations", type=int, default=50, help="Timed requests per worker (default: 50)")
+        sub.add_argument("--warmup", type=int, default=5)
+        sub.add_argument("--batch-size", type=int, default=1, help="Images per request (default: 1)")
+
+    tune_parser.add_argument("--cores", type=int, default=available_cores(), help="Cores to tune for")
+    tune_parser.add_argument("--workers", type=int, default=1, help="Server worker processes sharing those cores")
+    tune_parser.add_argument("--output", default=DEFAULT_CONFIG_PATH)
+
+    args = parser.parse_args()
+
+    if args.command == "show":
+        print(json.dumps(resolve_thread_config(), indent=2))
+    elif args.command == "tune":
+        tune(args)
+    else:
+        _bench_worker(args)
+
+if __name__ == "__main__":
+    main()
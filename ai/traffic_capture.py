@@ -0,0 +1,157 @@
+"""
+Sampled capture of live API traffic for replay benchmarks.
+
+Capture is off unless CAPTURE_DIR is set. A fraction of requests
+(CAPTURE_SAMPLE_RATE) whose path starts with one of CAPTURE_PATHS is recorded,
+one JSON line per request, in CAPTURE_DIR/capture-<start time>-<pid>.jsonl:
+
+- arrival offset from the start of the capture, method, path and query
+- content type, body size and SHA-256
+- response status, response size and latency
+
+With CAPTURE_PAYLOADS=1 the raw request bodies (multipart boundaries included)
+are also stored under CAPTURE_DIR/payloads/<sha256>, once per distinct body.
+Bodies larger than CAPTURE_MAX_PAYLOAD_MB are hashed but not stored.
+replay_traffic.py sends the stored bodies again with the recorded arrival
+pattern.
+
+The middleware works at the ASGI level. It sees the body chunks as the app
+reads them, so streamed uploads are not buffered beyond what is stored.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+CAPTURE_DIR = os.environ.get("CAPTURE_DIR", "")
+CAPTURE_SAMPLE_RATE = float(os.environ.get("CAPTURE_SAMPLE_RATE", "0.1"))
+CAPTURE_PAYLOADS = os.environ.get("CAPTURE_PAYLOADS", "0").lower() in ("1", "true", "yes")
+CAPTURE_MAX_PAYLOAD_MB = float(os.environ.get("CAPTURE_MAX_PAYLOAD_MB", "20"))
+CAPTURE_PATHS = [p for p in os.environ.get("CAPTURE_PATHS", "/predict,/analyze-video").split(",") if p]
+
+def capture_enabled() -> bool:
+    return bool(CAPTURE_DIR)
+
+class CapturedRequest:
+    """Body digest, sizes and timing of one sampled request"""
+
+    def __init__(self, scope: Dict, offset: float, keep_payload: bool, max_payload_bytes: int):
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        self.record = {
+            "offset_s": round(offset, 6),
+            "timestamp": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "content_type": headers.get("content-type", ""),
+            "accept": headers.get("accept", ""),
+            "body_bytes": 0,
+            "status": None,
+            "response_bytes": 0
+        }
+        self.start = time.perf_counter()
+        self._digest = hashlib.sha256()
+        self._payload = bytearray() if keep_payload else None
+        self._max_payload_bytes = max_payload_bytes
+
+    def add_body(self, chunk: bytes):
+        self.record["body_bytes"] += len(chunk)
+        self._digest.update(chunk)
+        if self._payload is not None:
+            if len(self._payload) + len(chunk) > self._max_payload_bytes:
+                self._payload = None  # too large to store; keep hashing
+            else:
+                self._payload.extend(chunk)
+
+    def stop_clock(self):
+        """Record the latency; called as the response completes, not when the record is written"""
+        self.record["latency_ms"] = round((time.perf_counter() - self.start) * 1000.0, 3)
+
+    def finish(self) -> Optional[bytes]:
+        """Fill in the digest; returns the payload to store, if any"""
+        self.record["body_sha256"] = self._digest.hexdigest()
+        self.record["payload_stored"] = self._payload is not None
+        return bytes(self._payload) if self._payload is not None else None
+
+class TrafficCapture:
+    """Sampling decision and the on-disk capture archive"""
+
+    def __init__(self, directory: str = CAPTURE_DIR, sample_rate: float = CAPTURE_SAMPLE_RATE,
+                 store_payloads: bool = CAPTURE_PAYLOADS, max_payload_mb: float = CAPTURE_MAX_PAYLOAD_MB,
+                 paths=None):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.store_payloads = store_payloads
+        self.max_payload_bytes = int(max_payload_mb * 1024 * 1024)
+        self.paths = list(paths if paths is not None else CAPTURE_PATHS)
+        self.payload_dir = os.path.join(directory, "payloads")
+        os.makedirs(self.payload_dir if store_payloads else directory, exist_ok=True)
+        self.log_path = os.path.join(directory, time.strftime("capture-%Y%m%d-%H%M%S") + f"-{os.getpid()}.jsonl")
+        self.started = time.perf_counter()
+        self.captured = 0
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def should_capture(self, path: str) -> bool:
+        return any(path.startswith(prefix) for prefix in self.paths) and self._random.random() < self.sample_rate
+
+    def begin(self, scope: Dict) -> CapturedRequest:
+        return CapturedRequest(scope, time.perf_counter() - self.started,
+                               self.store_payloads, self.max_payload_bytes)
+
+    def write(self, request: CapturedRequest):
+        """Append the record (and store the payload if new); runs in a worker thread"""
+        payload = request.finish()
+        if payload is not None:
+            payload_path = os.path.join(self.payload_dir, request.record["body_sha256"])
+            if not os.path.exists(payload_path):
+                tmp_path = f"{payload_path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_path, payload_path)
+        with self._lock:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(request.record) + "\n")
+            self.captured += 1
+
+class TrafficCaptureMiddleware:
+    """ASGI middleware that records sampled requests with a TrafficCapture"""
+
+    def __init__(self, app, capture: TrafficCapture = None):
+        self.app = app
+        self.capture = capture or TrafficCapture()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.capture.should_capture(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        request = self.capture.begin(scope)
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                request.add_body(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                request.record["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                request.record["response_bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            # Stamp the latency here: the write below may wait in the shared executor's queue
+            request.stop_clock()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.capture.write, request)
+            except Exception as e:
+                print(f"⚠ Warning: Could not write captured request: {e}")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Train and evaluate the early-exit damage model.
+
+`train` starts from a trained DamageCNN checkpoint and adds EarlyExitDamageCNN
+exit heads after blocks 1-3. By default the backbone and final classifier are
+frozen, so only the heads learn and the final exit keeps its accuracy. With
+--finetune-backbone everything trains on the summed loss of all exits, with
+the final classifier weighted highest.
+
+`report` runs a labeled folder through every exit once and then, for each
+confidence threshold, reports:
+
+- the share of images leaving at each exit
+- accuracy, and agreement with the final classifier
+- mean batch-1 latency and batched throughput, measured with the actual
+  early-exit path on the validation images, next to the full model
+
+--save-threshold writes the chosen threshold into a checkpoint. The server
+loads early-exit checkpoints like any other damage checkpoint.
+
+Usage:
+    python train_early_exit.py train best_damage.pth --train-dir data/train --epochs 5 --output best_damage_early_exit.pth
+    python train_early_exit.py report best_damage_early_exit.pth --val-dir data/val --thresholds 0.8 0.9 0.95 0.99
+    python train_early_exit.py report best_damage_early_exit.pth --val-dir data/val --save-threshold 0.95 \\
+        --output best_damage_early_exit.pth
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from damage_model import EarlyExitDamageCNN, create_damage_model
+from prune_damage import load_checkpoint, save_checkpoint, load_labeled_images
+
+DEFAULT_THRESHOLDS = [0.7, 0.8, 0.9, 0.95, 0.99]
+EXIT_NAMES = ["block1", "block2", "block3", "final"]
+
+def build_early_exit_model(checkpoint_path: str, exit_threshold: float, exit_hidden: int) -> EarlyExitDamageCNN:
+    """EarlyExitDamageCNN with the backbone and classifier of a DamageCNN (or early-exit) checkpoint"""
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    config = dict(checkpoint.get("model_config", {}))
+    config.update({"early_exit": True, "exit_threshold": exit_threshold})
+    config.setdefault("exit_hidden", exit_hidden)
+    model = create_damage_model(**config)
+    missing = model.load_state_dict(checkpoint["model_state_dict"], strict=False).missing_keys
+    if any(not key.startswith("exit_heads.") for key in missing):
+        raise ValueError(f"{checkpoint_path} is missing backbone weights: {missing[:5]}")
+    return model
+
+def train_exits(model: EarlyExitDamageCNN, inputs: torch.Tensor, labels: torch.Tensor, epochs: int,
+                lr: float, batch_size: int, finetune_backbone: bool, exit_weights):
+    """Train the exit heads (and optionally everything) on the weighted sum of per-exit losses"""
+    for name, param in model.named_parameters():
+        param.requires_grad = finetune_backbone or name.startswith("exit_heads.")
+    optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad], lr=lr)
+    criterion = nn.CrossEntropyLoss()
+
+    for epoch in range(epochs):
+        model.train()
+        if not finetune_backbone:
+            # Keep BatchNorm statistics and dropout of the frozen backbone as served
+            model.features.eval()
+            model.classifier.eval()
+        order = torch.randperm(len(inputs))
+        totals = np.zeros(len(exit_weights))
+        for i in range(0, len(order), batch_size):
+            idx = order[i:i + batch_size]
+            batch = inputs[idx]
+            flip = torch.rand(len(batch)) < 0.5
+            batch[flip] = batch[flip].flip(-1)
+            optimizer.zero_grad()
+            losses = [criterion(logits, labels[idx]) for logits in model.forward_all(batch)]
+            loss = sum(weight * l for weight, l in zip(exit_weights, losses))
+            loss.backward()
+            optimizer.step()
+            totals += np.array([l.item() for l in losses]) * len(idx)
+        per_exit = " ".join(f"{name} {total / len(inputs):.4f}" for name, total in zip(EXIT_NAMES, totals))
+        print(f"    epoch {epoch + 1}/{epochs}: loss {per_exit}")
+
+    for param in model.parameters():
+        param.requires_grad = True
+    return model.eval()
+
+def exit_outputs(model: EarlyExitDamageCNN, inputs: torch.Tensor, batch_size: int = 256):
+    """(confidence, predicted class) per exit for every image, shape (exits, N)"""
+    model.eval()
+    confidences, predictions = [], []
+    with torch.no_grad():
+        for i in range(0, len(inputs), batch_size):
+            probs = [torch.softmax(logits.float(), dim=1) for logits in model.forward_all(inputs[i:i + batch_size])]
+            confidences.append(torch.stack([p.max(dim=1)[0] for p in probs]))
+            predictions.append(torch.stack([p.argmax(dim=1) for p in probs]))
+    return torch.cat(confidences, dim=1), torch.cat(predictions, dim=1)
+
+def simulate_exits(confidences: torch.Tensor, predictions: torch.Tensor, threshold: float):
+    """Exit index and prediction per image for a threshold, as forward_with_exits would choose"""
+    last = len(confidences) - 1
+    exits = torch.full((confidences.shape[1],), last, dtype=torch.long)
+    for j in reversed(range(last)):
+        exits[confidences[j] >= threshold] = j
+    chosen = predictions.gather(0, exits.unsqueeze(0)).squeeze(0)
+    return exits, chosen
+
+def time_model(model: nn.Module, inputs: torch.Tensor, batch_size: int, limit: int = 200):
+    """Mean ms per image at batch size 1 and images/s at batch_size, on the frozen TorchScript module"""
+    with torch.no_grad():
+        frozen = torch.jit.freeze(torch.jit.script(model.eval()))
+        for i in range(min(10, len(inputs))):
+            frozen(inputs[i:i + 1])
+        sample = inputs[:limit]
+        start = time.perf_counter()
+        for i in range(len(sample)):
+            frozen(sample[i:i + 1])
+        single_ms = (time.perf_counter() - start) * 1000.0 / len(sample)
+
+        start = time.perf_counter()
+        for i in range(0, len(inputs), batch_size):
+            frozen(inputs[i:i + batch_size])
+        throughput = len(inputs) / (time.perf_counter() - start)
+    return single_ms, throughput
+
+def train_command(args):
+    model = build_early_exit_model(args.checkpoint, args.threshold, args.exit_hidden)
+    print(f"📂 Loading training images from {args.train_dir}")
+    inputs, labels = load_labeled_images(args.train_dir, args.limit)
+    print(f"🏋 Training exit heads on {len(inputs)} images"
+          f"{' (backbone fine-tuned)' if args.finetune_backbone else ' (backbone frozen)'}")
+    train_exits(model, inputs, labels, args.epochs, args.lr, args.batch_size,
+                args.finetune_backbone, args.exit_weights)
+    save_checkpoint(model, args.output, source_checkpoint=args.checkpoint)
+    print(f"✅ Early-exit model saved to {args.output} (threshold {model.exit_threshold})")
+
+def report_command(args):
+    model, checkpoint = load_checkpoint(args.checkpoint)
+    if not isinstance(model, EarlyExitDamageCNN):
+        print(f"❌ {args.checkpoint} is not an early-exit checkpoint; run `train` first")
+        sys.exit(1)
+
+    print(f"📂 Loading validation images from {args.val_dir}")
+    inputs, labels = load_labeled_images(args.val_dir, args.limit)
+    confidences, predictions = exit_outputs(model, inputs)
+    final = predictions[-1]
+
+    # The full model is the same backbone and classifier without the heads
+    full = create_damage_model(**{k: v for k, v in model.model_config().items()
+                                  if k not in ("early_exit", "exit_threshold", "exit_hidden")})
+    full.load_state_dict({k: v for k, v in model.state_dict().items() if not k.startswith("exit_heads.")})
+    full_ms, full_throughput = time_model(full, inputs, args.batch_size)
+    full_accuracy = (final == labels).float().mean().item()
+    print(f"\n  full model: accuracy {full_accuracy * 100:.2f}% | {full_ms:.3f} ms/image at batch 1 | "
+          f"{full_throughput:.0f} images/s at batch {args.batch_size}")
+
+    report = {
+        "checkpoint": args.checkpoint,
+        "images": len(inputs),
+        "full_model": {"accuracy": full_accuracy, "batch1_ms": full_ms, "throughput": full_throughput},
+        "per_exit_accuracy": {name: (predictions[j] == labels).float().mean().item()
+                              for j, name in enumerate(EXIT_NAMES)},
+        "thresholds": []
+    }
+    original_threshold = model.exit_threshold
+    for threshold in args.thresholds:
+        exits, chosen = simulate_exits(confidences, predictions, threshold)
+        rates = torch.bincount(exits, minlength=len(EXIT_NAMES)).float() / len(exits)
+        model.exit_threshold = threshold
+        single_ms, throughput = time_model(model, inputs, args.batch_size)
+        row = {
+            "threshold": threshold,
+            "exit_rates": {name: round(rates[j].item(), 4) for j, name in enumerate(EXIT_NAMES)},
+            "accuracy": (chosen == labels).float().mean().item(),
+            "agreement_with_final": (chosen == final).float().mean().item(),
+            "batch1_ms": single_ms,
+            "throughput": throughput
+        }
+        report["thresholds"].append(row)
+        exits_text = " ".join(f"{name} {rate * 100:5.1f}%" for name, rate in row["exit_rates"].items())
+        print(f"  threshold {threshold:.3f}: {exits_text} | accuracy {row['accuracy'] * 100:.2f}% "
+              f"({(row['accuracy'] - full_accuracy) * 100:+.2f}) | agree {row['agreement_with_final'] * 100:.1f}% | "
+              f"{single_ms:.3f} ms ({full_ms / single_ms:.2f}x) | {throughput:.0f} images/s")
+    model.exit_threshold = original_threshold
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.report}")
+
+    if args.save_threshold is not None:
+        model.exit_threshold = args.save_threshold
+        extra = {k: v for k, v in checkpoint.items() if k not in ("model_state_dict", "model_config")}
+        save_checkpoint(model, args.output or args.checkpoint, **extra)
+        print(f"✅ Saved threshold {args.save_threshold} to {args.output or args.checkpoint}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Early-exit damage model training and evaluation")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Add and train exit heads on a trained DamageCNN")
+    train_parser.add_argument("checkpoint", help="Trained DamageCNN checkpoint (e.g. best_damage.pth)")
+    train_parser.add_argument("--train-dir", required=True, help="Labeled <Class>/<image> training folder")
+    train_parser.add_argument("--output", default="best_damage_early_exit.pth")
+    train_parser.add_argument("--epochs", type=int, default=5)
+    train_parser.add_argument("--lr", type=float, default=1e-3)
+    train_parser.add_argument("--batch-size", type=int, default=32)
+    train_parser.add_argument("--threshold", type=float, default=0.9, help="Exit confidence stored in the checkpoint")
+    train_parser.add_argument("--exit-hidden", type=int, default=64, help="Hidden units per exit head")
+    train_parser.add_argument("--finetune-backbone", action="store_true", help="Also train the backbone and classifier")
+    train_parser.add_argument("--exit-weights", type=float, nargs=4, default=[0.3, 0.3, 0.4, 1.0],
+                              help="Loss weights of the block1/block2/block3/final exits")
+    train_parser.add_argument("--limit", type=int, help="Use at most this many images")
+
+    report_parser = subparsers.add_parser("report", help="Exit rates, accuracy and latency per threshold")
+    report_parser.add_argument("checkpoint", help="Early-exit checkpoint")
+    report_parser.add_argument("--val-dir", required=True, help="Labeled <Class>/<image> validation folder")
+    report_parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS)
+    report_parser.add_argument("--batch-size", type=int, default=64, help="Batch size for the throughput run")
+    report_parser.add_argument("--report", help="Write the report as JSON")
+    report_parser.add_argument("--save-threshold", type=float, help="Store this threshold in the checkpoint")
+    report_parser.add_argument("--output", help="Checkpoint to write with --save-threshold (default: in place)")
+    report_parser.add_argument("--limit", type=int, help="Use at most this many images")
+
+    args = parser.parse_args()
+
+    if args.command == "train":
+        train_command(args)
+    else:
+        report_command(args)
+
+if __name__ == "__main__":
+    main()
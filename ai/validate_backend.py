@@ -2,10 +2,22 @@
 """
 Simple validation script to check if the FastAPI backend can start without runtime errors.
 This checks imports and basic structure without starting the server.
+
+With --profile it also measures a cold start in a fresh process. It times each
+import (PIL, FastAPI, torch, torchvision, TensorFlow, the backend module), each
+model load, the warm-up pass and the first real inference. It also records the
+resident and peak memory after every step. Budgets turn the report into a gate:
+
+    python validate_backend.py --profile --max-startup-s 20 --max-rss-mb 2500 \
+        --step-budget import_tensorflow=6 --step-budget load_damage_model=1 --output cold_start.json
 """
 
+import argparse
+import json
+import subprocess
 import sys
 import os
+import time
 
 def check_imports():
     """Check if all required imports can be loaded"""
@@ -82,15 +94,213 @@ def check_syntax():
         print(f"❌ Error checking syntax: {e}")
         return False
 
+def _proc_status_mb(key):
+    """A memory figure from /proc/self/status in MB (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+def _rss_mb():
+    return _proc_status_mb("VmRSS")
+
+def _peak_rss_mb():
+    # VmHWM starts fresh at exec; ru_maxrss can carry over the parent's peak on Linux
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+def _profile_child(args):
+    """Run every cold-start step in this (fresh) process and print the results as JSON"""
+    steps = []
+    context = {}
+    process_start = time.perf_counter()
+    
+    def step(name, func):
+        start = time.perf_counter()
+        entry = {"name": name}
+        try:
+            result = func()
+            entry["status"] = "skipped" if result == "skipped" else "ok"
+        except Exception as e:
+            entry["status"] = "error"
+            entry["error"] = f"{type(e).__name__}: {e}"
+        entry["seconds"] = round(time.perf_counter() - start, 4)
+        entry["elapsed_s"] = round(time.perf_counter() - process_start, 4)
+        entry["rss_mb"] = round(_rss_mb(), 1) if _rss_mb() is not None else None
+        entry["peak_rss_mb"] = round(_peak_rss_mb(), 1) if _peak_rss_mb() is not None else None
+        steps.append(entry)
+    
+    def load(kind, path):
+        if not os.path.exists(path):
+            return "skipped"
+        getattr(context["backend"], f"load_{kind}_model")(path)
+    
+    def warm_up():
+        import numpy as np
+        import torch
+        backend = context["backend"]
+        if backend.DISASTER_MODEL is not None:
+            height, width = backend.DISASTER_MODEL_INPUT_SIZE
+            backend.predict_disaster_probs(np.zeros((1, height, width, 3), dtype=np.float32))
+        if backend.DAMAGE_MODEL is not None:
+            backend.predict_damage_probs(torch.zeros(1, 3, 64, 64))
+        if backend.DISASTER_MODEL is None and backend.DAMAGE_MODEL is None:
+            return "skipped"
+    
+    def first_inference():
+        backend = context["backend"]
+        if not os.path.exists(args.image):
+            return "skipped"
+        with open(args.image, "rb") as f:
+            image_bytes = f.read()
+        ran = False
+        if backend.DISASTER_MODEL is not None:
+            backend.predict_disaster_bytes(image_bytes)
+            ran = True
+        if backend.DAMAGE_MODEL is not None:
+            backend.predict_damage_bytes(image_bytes)
+            ran = True
+        return None if ran else "skipped"
+    
+    def import_backend():
+        import fastapi_backend
+        context["backend"] = fastapi_backend
+    
+    step("import_numpy", lambda: __import__("numpy"))
+    step("import_pil", lambda: __import__("PIL.Image"))
+    step("import_fastapi", lambda: __import__("fastapi"))
+    step("import_torch", lambda: __import__("torch"))
+    step("import_torchvision", lambda: __import__("torchvision"))
+    step("import_tensorflow", lambda: __import__("tensorflow"))
+    step("import_backend", import_backend)
+    if "backend" in context:
+        step("load_disaster_model", lambda: load("disaster", args.disaster_model))
+        step("load_damage_model", lambda: load("damage", args.damage_model))
+        step("warm_up", warm_up)
+        step("first_inference", first_inference)
+    
+    print(json.dumps({
+        "python": sys.version.split()[0],
+        "total_s": round(time.perf_counter() - process_start, 4),
+        "peak_rss_mb": round(_peak_rss_mb(), 1) if _peak_rss_mb() is not None else None,
+        "steps": steps
+    }))
+
+def profile_cold_start(args):
+    """Profile a cold start in a fresh interpreter and check it against the budgets"""
+    print("\nProfiling cold start...")
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--profile-child",
+        "--disaster-model", args.disaster_model,
+        "--damage-model", args.damage_model,
+        "--image", args.image
+    ]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        print(f"❌ Cold-start profile process failed (exit code {proc.returncode})")
+        print(proc.stderr[-2000:])
+        return False
+    
+    report = json.loads(lines[-1])
+    report["process_wall_s"] = round(wall, 4)
+    
+    print(f"  {'step':22s} {'status':8s} {'seconds':>9s} {'elapsed':>9s} {'rss MB':>9s} {'peak MB':>9s}")
+    for entry in report["steps"]:
+        print(f"  {entry['name']:22s} {entry['status']:8s} {entry['seconds']:9.3f} {entry['elapsed_s']:9.3f} "
+              f"{entry['rss_mb'] if entry['rss_mb'] is not None else '-':>9} "
+              f"{entry['peak_rss_mb'] if entry['peak_rss_mb'] is not None else '-':>9}")
+        if entry["status"] == "error":
+            print(f"    ❌ {entry['error']}")
+    print(f"  Total: {report['total_s']:.3f}s in-process, {wall:.3f}s including interpreter start | "
+          f"peak RSS {report['peak_rss_mb']} MB")
+    
+    # Budgets
+    failures = [f"{entry['name']} failed: {entry['error']}" for entry in report["steps"] if entry["status"] == "error"]
+    if args.max_startup_s is not None and wall > args.max_startup_s:
+        failures.append(f"cold start {wall:.2f}s exceeds budget {args.max_startup_s}s")
+    if args.max_rss_mb is not None and report["peak_rss_mb"] is not None and report["peak_rss_mb"] > args.max_rss_mb:
+        failures.append(f"peak RSS {report['peak_rss_mb']} MB exceeds budget {args.max_rss_mb} MB")
+    steps_by_name = {entry["name"]: entry for entry in report["steps"]}
+    for name, limit in args.step_budget:
+        if name not in steps_by_name:
+            failures.append(f"unknown step in budget: {name}")
+        elif steps_by_name[name]["seconds"] > limit:
+            failures.append(f"{name} took {steps_by_name[name]['seconds']:.2f}s, budget {limit}s")
+    
+    report["budgets"] = {
+        "max_startup_s": args.max_startup_s,
+        "max_rss_mb": args.max_rss_mb,
+        "steps": dict(args.step_budget),
+        "failures": failures,
+        "passed": not failures
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"  Report written to {args.output}")
+    
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✓ Cold start within budgets")
+    return not failures
+
+def step_budget(value: str):
+    """Parse a STEP=SECONDS budget into (step, seconds)"""
+    name, sep, limit = value.partition("=")
+    try:
+        seconds = float(limit)
+    except ValueError:
+        seconds = None
+    if not sep or not name.strip() or seconds is None or seconds < 0:
+        raise argparse.ArgumentTypeError(f"expected STEP=SECONDS (e.g. import_tensorflow=6), got '{value}'")
+    return name.strip(), seconds
+
 def main():
+    parser = argparse.ArgumentParser(description="Validate the FastAPI backend and profile its cold start")
+    parser.add_argument("--profile", action="store_true", help="Profile a cold start in a fresh process")
+    parser.add_argument("--max-startup-s", type=float, default=None, help="Cold-start time budget in seconds")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="Peak resident memory budget in MB")
+    parser.add_argument("--step-budget", action="append", default=[], type=step_budget, metavar="STEP=SECONDS",
+                        help="Time budget for one step, e.g. import_tensorflow=6 (repeatable)")
+    parser.add_argument("--output", default=None, help="Write the cold-start report as JSON")
+    parser.add_argument("--disaster-model", default="disaster.h5")
+    parser.add_argument("--damage-model", default="best_damage.pth")
+    parser.add_argument("--image", default="image1.jpg", help="Image for the first inference")
+    parser.add_argument("--profile-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.profile_child:
+        _profile_child(args)
+        return
+    
+    # Any budget implies profiling
+    profile = args.profile or args.max_startup_s is not None or args.max_rss_mb is not None or bool(args.step_budget)
+    
     print("FastAPI Backend Validation")
     print("=" * 40)
     
     syntax_ok = check_syntax()
     imports_ok = check_imports()
+    profile_ok = profile_cold_start(args) if profile else True
     
     print("\n" + "=" * 40)
-    if syntax_ok and imports_ok:
+    if syntax_ok and imports_ok and profile_ok:
         print("✅ Validation successful! Backend should start properly.")
         print("\nTo start the server:")
         print("  python fastapi_backend.py")
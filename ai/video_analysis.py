@@ -0,0 +1,164 @@
+"""
+Frame sampling, scene-change skipping and timeline building for video analysis.
+
+Frames are sampled at a fixed rate. Each sampled frame is reduced to a small
+grayscale signature; if it differs from the last analyzed frame by less than the
+change threshold, the frame is skipped and inherits the previous predictions.
+Only frames that changed are sent to the models, in batches, so compute scales
+with scene content rather than clip length. Consecutive frames with the same
+predictions are merged into timeline segments.
+
+Video decoding uses OpenCV (opencv-python-headless). Frame sequences can also be
+passed in directly as RGB uint8 arrays.
+"""
+
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+SIGNATURE_SIZE = (32, 32)
+
+def frame_signature(frame: np.ndarray) -> np.ndarray:
+    """Low-cost 32x32 grayscale thumbnail used for change detection"""
+    if cv2 is not None:
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        return cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+    img = Image.fromarray(frame).convert("L").resize(SIGNATURE_SIZE, Image.BILINEAR)
+    return np.asarray(img, dtype=np.float32)
+
+def change_score(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean absolute difference between two signatures, scaled to 0..1"""
+    return float(np.abs(a - b).mean() / 255.0)
+
+def iter_video_frames(path: str, sample_fps: float):
+    """Yield (timestamp_s, RGB frame) sampled at sample_fps from a video file"""
+    if cv2 is None:
+        raise RuntimeError("Video decoding requires OpenCV (pip install opencv-python-headless)")
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("Could not open video; unsupported container or codec")
+
+    try:
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        step = 1.0 / sample_fps if sample_fps > 0 else 0.0
+        next_sample = 0.0
+        index = 0
+        while True:
+            # grab() advances without converting the frame; only sampled frames are retrieved
+            if not capture.grab():
+                break
+            timestamp = index / source_fps
+            index += 1
+            if timestamp + 1e-9 < next_sample:
+                continue
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            next_sample += step
+            yield timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        capture.release()
+
+def iter_sequence_frames(frames, source_fps: float, sample_fps: float, decode=None):
+    """Yield (timestamp_s, RGB frame) sampled from an ordered sequence of frames
+
+    With decode, frames are still encoded (e.g. image bytes) and only the sampled ones are decoded.
+    """
+    step = 1.0 / sample_fps if sample_fps > 0 else 0.0
+    next_sample = 0.0
+    for index, frame in enumerate(frames):
+        timestamp = index / source_fps
+        if timestamp + 1e-9 < next_sample:
+            continue
+        next_sample += step
+        yield timestamp, decode(frame) if decode is not None else frame
+
+def analyze_frames(frames, predict_batch, class_names: dict, change_threshold: float = 0.04,
+                   max_skip_seconds: float = 10.0, batch_size: int = 32) -> dict:
+    """
+    Run change-gated batched inference over sampled frames and build a timeline.
+
+    Args:
+        frames: iterable of (timestamp_s, RGB uint8 frame)
+        predict_batch: callable taking a list of frames and returning {model_name: (N, classes) probs}
+        class_names: {model_name: [class names]}
+        change_threshold: minimum change score for a frame to be analyzed
+        max_skip_seconds: analyze a frame at least this often even without changes
+        batch_size: frames per inference batch
+    """
+    samples = []  # [timestamp, analyzed, change score, row of the predictions it uses]
+    pending_frames = []
+    probs_by_model = {name: [] for name in class_names}
+    last_signature = None
+    last_analyzed_at = None
+
+    def flush():
+        if not pending_frames:
+            return
+        outputs = predict_batch(pending_frames)
+        for name in class_names:
+            probs_by_model[name].append(np.asarray(outputs[name], dtype=np.float32))
+        pending_frames.clear()
+
+    analyzed_count = 0
+    for timestamp, frame in frames:
+        signature = frame_signature(frame)
+        score = 1.0 if last_signature is None else change_score(signature, last_signature)
+        due = last_analyzed_at is None or timestamp - last_analyzed_at >= max_skip_seconds
+        if score >= change_threshold or due:
+            samples.append([timestamp, True, score, analyzed_count])
+            pending_frames.append(frame)
+            analyzed_count += 1
+            last_signature = signature
+            last_analyzed_at = timestamp
+            if len(pending_frames) >= batch_size:
+                flush()
+        else:
+            # Unchanged frame: reuse the predictions of the last analyzed frame
+            samples.append([timestamp, False, score, analyzed_count - 1])
+    flush()
+
+    probs = {name: np.concatenate(rows) if rows else np.zeros((0, len(class_names[name])), dtype=np.float32)
+             for name, rows in probs_by_model.items()}
+    segments = build_segments(samples, probs, class_names)
+
+    return {
+        "frames_sampled": len(samples),
+        "frames_analyzed": analyzed_count,
+        "frames_skipped_unchanged": len(samples) - analyzed_count,
+        "segments": segments
+    }
+
+def build_segments(samples: list, probs: dict, class_names: dict) -> list:
+    """Merge consecutive samples with the same predicted classes into segments"""
+    segments = []
+    for timestamp, analyzed, score, row in samples:
+        labels = {name: int(probs[name][row].argmax()) for name in probs}
+        current = segments[-1] if segments else None
+        if current is None or current["_labels"] != labels:
+            current = {"_labels": labels, "start_s": timestamp, "end_s": timestamp,
+                       "frames_sampled": 0, "frames_analyzed": 0, "_rows": []}
+            segments.append(current)
+        current["end_s"] = timestamp
+        current["frames_sampled"] += 1
+        if analyzed:
+            current["frames_analyzed"] += 1
+            current["_rows"].append(row)
+
+    for segment in segments:
+        labels = segment.pop("_labels")
+        rows = segment.pop("_rows")
+        segment["start_s"] = round(segment["start_s"], 3)
+        segment["end_s"] = round(segment["end_s"], 3)
+        for name, idx in labels.items():
+            names = class_names[name]
+            segment[name] = {
+                "predicted_class": names[idx] if idx < len(names) else f"class_{idx}",
+                "confidence": float(probs[name][rows, idx].mean()) if rows else None
+            }
+    return segments